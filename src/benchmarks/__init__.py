@@ -0,0 +1,3 @@
+"""
+性能基准测试包 - 可离线运行的性能测量脚本
+"""
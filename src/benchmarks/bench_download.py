@@ -0,0 +1,130 @@
+"""
+下载基准测试 - 使用本地模拟 HTTP 服务器测量并发下载器的吞吐量
+
+用法:
+    python -m src.benchmarks.bench_download --images 200 --latency 50 --workers 1 4 8
+
+服务器为每个请求返回同一张 PNG 图像，并在响应前等待指定的延迟以模拟网络往返，
+结果以 JSON 输出，可以保存下来用于回归比较。
+"""
+import io
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from PIL import Image
+
+from src.tools.sources.downloader import ConcurrentDownloader
+
+
+def make_payload(size: int = 512) -> bytes:
+    """
+    生成模拟服务器返回的 PNG 图像数据
+
+    Args:
+        size: 图像边长
+
+    Returns:
+        PNG 数据
+    """
+    image = Image.new('RGB', (size, size))
+    image.putdata([((x * 7) % 256, (y * 3) % 256, (x ^ y) % 256)
+                   for y in range(size) for x in range(size)])
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def start_server(payload: bytes, latency: float) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动模拟图像服务器
+
+    Args:
+        payload: 每个请求返回的数据
+        latency: 每个请求的模拟延迟（秒）
+
+    Returns:
+        已启动的服务器
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_case(base_url: str, images: int, workers: int, rate: float) -> Dict[str, Any]:
+    """
+    以指定并发数下载全部图像并统计吞吐量
+
+    Args:
+        base_url: 模拟服务器地址
+        images: 下载的图像数量
+        workers: 每个主机的并发下载数
+        rate: 每秒请求数上限，0 表示不限速
+
+    Returns:
+        测试结果
+    """
+    downloader = ConcurrentDownloader(workers_per_host=workers, default_rate=rate)
+    try:
+        start = time.perf_counter()
+        futures = [downloader.submit(f"{base_url}/{i}.png") for i in range(images)]
+        total_bytes = sum(len(future.result()) for future in futures)
+        elapsed = time.perf_counter() - start
+    finally:
+        downloader.close()
+    return {
+        'workers_per_host': workers,
+        'rate_limit': rate,
+        'images': images,
+        'seconds': round(elapsed, 3),
+        'images_per_second': round(images / elapsed, 2),
+        'megabytes_per_second': round(total_bytes / elapsed / 1024 / 1024, 2),
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="并发下载器吞吐量基准测试")
+    parser.add_argument('--images', type=int, default=200, help="下载的图像数量")
+    parser.add_argument('--latency', type=float, default=50, help="每个请求的模拟延迟（毫秒）")
+    parser.add_argument('--size', type=int, default=512, help="模拟图像边长")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help="要测试的并发数")
+    parser.add_argument('--rate', type=float, default=0, help="每秒请求数上限，0 表示不限速")
+    parser.add_argument('--output', help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    server = start_server(make_payload(args.size), args.latency / 1000)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        results = [run_case(base_url, args.images, workers, args.rate) for workers in args.workers]
+    finally:
+        server.shutdown()
+
+    report = json.dumps({'benchmark': 'download', 'latency_ms': args.latency, 'results': results},
+                        ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+工作流引擎基准测试 - 用确定性生成的合成图像集在各执行模式下运行代表性工作流
+
+用法:
+    python -m src.benchmarks.bench_engine --images 60 --modes materialize stream --output result.json
+
+图像集由随机种子完全确定：包括不同尺寸和宽高比的 RGB 图像、带透明通道的图像、
+灰度和以 RGB 保存的黑白图像、调色板图像以及多帧 GIF。工作流只使用不需要下载模型的操作，
+整个测试不访问网络。每个用例在新的解释器进程中运行，并使用独立的配置目录，
+动作池、步骤缓存和模块缓存都不会影响其他用例。结果以 JSON 输出，可以保存下来在提交之间比较。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from src.data.execution_plan import EXECUTION_MODES
+
+# 合成图像的种类，按顺序循环生成
+IMAGE_KINDS = ('rgb', 'rgba', 'gray', 'mono_rgb', 'palette', 'gif', 'jpeg')
+
+# 图像尺寸的长边和宽高比
+LONG_SIDES = (96, 256, 512, 768, 1024, 1600)
+ASPECT_RATIOS = (1.0, 0.75, 4 / 3, 0.5, 2.0, 9 / 16, 3.0)
+
+WORKFLOWS: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {
+    'convert': [
+        ("ModeConvertAction", {'mode': 'RGB', 'force_background': 'white'}),
+        ("AlignMaxSizeAction", {'max_size': 512}),
+    ],
+    'augment': [
+        ("ModeConvertAction", {'mode': 'RGB', 'force_background': 'white'}),
+        ("MirrorAction", {}),
+        ("PaddingAlignAction", {'size': [384, 384], 'color': 'white'}),
+        ("FileOrderAction", {'ext': '.png'}),
+    ],
+    'filter': [
+        ("MinSizeFilterAction", {'min_size': 200}),
+        ("ModeConvertAction", {'mode': 'RGB', 'force_background': 'white'}),
+        ("AlignMinSizeAction", {'min_size': 256}),
+        ("AlignMaxAreaAction", {'size': 512}),
+    ],
+}
+
+
+def _content(rng: random.Random, width: int, height: int, mode: str) -> Image.Image:
+    """
+    生成平滑变化的图像内容：低分辨率随机色块放大后的结果，压缩率接近真实插画
+    """
+    bands = len(mode)
+    grid = Image.frombytes(mode, (8, 8), rng.randbytes(64 * bands))
+    return grid.resize((width, height), Image.BILINEAR)
+
+
+def generate_corpus(directory: str, count: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    生成确定性的合成图像集
+
+    Args:
+        directory: 输出目录
+        count: 图像数量
+        seed: 随机种子，相同的种子生成完全相同的图像
+
+    Returns:
+        图像集信息，包含每种图像的数量、总字节数和所有文件内容的摘要
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    kinds: Dict[str, int] = {}
+    digest = hashlib.sha256()
+    total_bytes = 0
+    for i in range(count):
+        kind = IMAGE_KINDS[i % len(IMAGE_KINDS)]
+        long_side = rng.choice(LONG_SIDES)
+        ratio = rng.choice(ASPECT_RATIOS)
+        if ratio >= 1:
+            width, height = long_side, max(16, round(long_side / ratio))
+        else:
+            width, height = max(16, round(long_side * ratio)), long_side
+        path = os.path.join(directory, f"{i:05d}_{kind}.{'jpg' if kind == 'jpeg' else 'gif' if kind == 'gif' else 'png'}")
+
+        if kind == 'rgba':
+            image = _content(rng, width, height, 'RGBA')
+            # 左上到右下逐渐透明，保证既有不透明也有透明区域
+            alpha = Image.linear_gradient('L').resize((width, height)).rotate(45, expand=False, fillcolor=255)
+            image.putalpha(alpha)
+            image.save(path)
+        elif kind == 'gray':
+            _content(rng, width, height, 'L').save(path)
+        elif kind == 'mono_rgb':
+            _content(rng, width, height, 'L').convert('RGB').save(path)
+        elif kind == 'palette':
+            _content(rng, width, height, 'RGB').quantize(colors=32).save(path)
+        elif kind == 'gif':
+            frames = [_content(rng, width, height, 'RGB').quantize(colors=64) for _ in range(3)]
+            frames[0].save(path, save_all=True, append_images=frames[1:], duration=100, loop=0)
+        elif kind == 'jpeg':
+            _content(rng, width, height, 'RGB').save(path, quality=90)
+        else:
+            _content(rng, width, height, 'RGB').save(path)
+
+        kinds[kind] = kinds.get(kind, 0) + 1
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest.update(data)
+        total_bytes += len(data)
+    return {'images': count, 'seed': seed, 'kinds': kinds, 'bytes': total_bytes, 'sha256': digest.hexdigest()}
+
+
+def _directory_size(directory: Optional[str]) -> int:
+    total = 0
+    if not directory or not os.path.isdir(directory):
+        return 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def run_case(workflow_name: str, mode: str, corpus_dir: str, output_dir: str,
+             interval: float = 0.05) -> Dict[str, Any]:
+    """
+    在当前进程中执行一个用例，并按固定间隔采样常驻内存和临时目录大小
+
+    应在独立的进程中调用（由 main 负责），步骤缓存会被关闭以免重复运行时直接命中缓存。
+
+    Args:
+        workflow_name: 工作流名称（WORKFLOWS 的键）
+        mode: 执行模式
+        corpus_dir: 输入图像目录
+        output_dir: 输出目录
+        interval: 采样间隔（秒）
+
+    Returns:
+        用例结果
+    """
+    from src.data.config_manager import config_manager
+    from src.data.workflow import Workflow, WorkflowStep
+    from src.data.workflow_engine import workflow_engine
+    from src.tools.actions.action_pool import current_rss
+
+    config_manager.set('cache.step_cache_enabled', False)
+    workflow = Workflow(f"bench-{workflow_name}")
+    for action_name, params in WORKFLOWS[workflow_name]:
+        workflow.add_step(WorkflowStep(action_name, params))
+
+    baseline_rss = current_rss()
+    peaks = {'rss': baseline_rss or 0, 'scratch': 0}
+    start = time.perf_counter()
+    record = workflow_engine.execute_workflow(workflow, "LocalSource", {'directory': corpus_dir}, output_dir,
+                                              execution_mode=mode)
+    while workflow_engine.get_running_tasks():
+        peaks['rss'] = max(peaks['rss'], current_rss() or 0)
+        peaks['scratch'] = max(peaks['scratch'], _directory_size(record.run_dir))
+        time.sleep(interval)
+    elapsed = time.perf_counter() - start
+
+    inputs = len(os.listdir(corpus_dir))
+    outputs = sum(1 for name in os.listdir(output_dir) if not name.startswith('.'))
+    summary = record.profile_summary() or {}
+    return {
+        'workflow': workflow_name,
+        'mode': mode,
+        'status': record.status,
+        'error': record.error_message,
+        'images_in': inputs,
+        'images_out': outputs,
+        'seconds': round(elapsed, 3),
+        'images_per_second': round(inputs / elapsed, 2) if elapsed > 0 else None,
+        'cpu_seconds': summary.get('cpu_seconds'),
+        'peak_rss_bytes': peaks['rss'],
+        'peak_rss_growth_bytes': peaks['rss'] - baseline_rss if baseline_rss is not None else None,
+        'peak_scratch_bytes': peaks['scratch'],
+        'output_bytes': _directory_size(output_dir),
+    }
+
+
+_RUNNER = """
+import json
+from src.benchmarks.bench_engine import run_case
+print(json.dumps(run_case({workflow!r}, {mode!r}, {corpus!r}, {output!r})))
+"""
+
+
+def run_isolated(workflow_name: str, mode: str, corpus_dir: str, work_dir: str,
+                 python: str) -> Dict[str, Any]:
+    """
+    在新进程中运行一个用例，使用独立的配置目录（历史记录、缓存）和工作目录（日志）
+
+    Args:
+        workflow_name: 工作流名称
+        mode: 执行模式
+        corpus_dir: 输入图像目录
+        work_dir: 用例的工作目录，运行前清空
+        python: Python 解释器路径
+
+    Returns:
+        用例结果，在当前环境中无法运行时包含 error
+    """
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(os.path.join(work_dir, 'home'))
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, HOME=os.path.join(work_dir, 'home'),
+               PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    code = _RUNNER.format(workflow=workflow_name, mode=mode, corpus=corpus_dir,
+                          output=os.path.join(work_dir, 'output'))
+    proc = subprocess.run([python, '-c', code], cwd=work_dir, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'workflow': workflow_name, 'mode': mode,
+                'error': proc.stderr.strip().splitlines()[-1] if proc.stderr else "失败"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    合并同一用例的多次运行：耗时取中位数，内存和磁盘取最大值
+
+    Args:
+        runs: 各次运行的结果
+
+    Returns:
+        合并后的结果
+    """
+    failed = [run for run in runs if 'seconds' not in run]
+    if failed:
+        return failed[0]
+    result = dict(runs[-1])
+    result['repeat'] = len(runs)
+    result['seconds'] = round(statistics.median(run['seconds'] for run in runs), 3)
+    result['images_per_second'] = round(result['images_in'] / result['seconds'], 2) if result['seconds'] else None
+    for key in ('peak_rss_bytes', 'peak_rss_growth_bytes', 'peak_scratch_bytes'):
+        values = [run[key] for run in runs if run.get(key) is not None]
+        result[key] = max(values) if values else None
+    return result
+
+
+def _git_commit(root: str) -> Optional[str]:
+    try:
+        proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True)
+    except OSError:
+        return None
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="工作流引擎吞吐量、内存和临时磁盘基准测试")
+    parser.add_argument('--images', type=int, default=60, help="合成图像数量")
+    parser.add_argument('--seed', type=int, default=0, help="生成图像集的随机种子")
+    parser.add_argument('--workflows', nargs='+', choices=list(WORKFLOWS), default=list(WORKFLOWS),
+                        help="要测试的工作流")
+    parser.add_argument('--modes', nargs='+', choices=list(EXECUTION_MODES), default=list(EXECUTION_MODES),
+                        help="要测试的执行模式")
+    parser.add_argument('--repeat', type=int, default=1, help="每个用例的运行次数")
+    parser.add_argument('--work-dir', help="图像集和用例输出的目录，默认使用临时目录并在结束后删除")
+    parser.add_argument('--output', help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="image_processor_bench_")
+    try:
+        corpus_dir = os.path.join(work_dir, 'corpus')
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        corpus = generate_corpus(corpus_dir, args.images, args.seed)
+        results = []
+        for workflow_name in args.workflows:
+            for mode in args.modes:
+                case_dir = os.path.join(work_dir, f"{workflow_name}_{mode}")
+                runs = [run_isolated(workflow_name, mode, corpus_dir, case_dir, sys.executable)
+                        for _ in range(args.repeat)]
+                results.append(summarize(runs))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    report = json.dumps({'benchmark': 'engine', 'python': sys.version.split()[0], 'commit': _git_commit(root),
+                         'corpus': corpus, 'results': results}, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+导入基准测试 - 测量导入注册表和列出操作参数的耗时，以及是否加载了重量级依赖
+
+用法:
+    python -m src.benchmarks.bench_import --repeat 5
+
+每个场景在新的解释器进程中运行，避免模块缓存影响结果：
+    registry: 只导入动作和来源注册表（Gradio 界面启动时的路径）
+    list_params: 导入注册表并读取所有操作的参数定义（工作流编辑页面）
+    eager: 导入注册表并加载所有操作类（相当于延迟导入之前的启动方式）
+结果以 JSON 输出，可以保存下来用于回归比较。
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Any, Dict, List
+
+# 统计是否被加载的重量级依赖
+HEAVY_MODULES = ('torch', 'imgutils', 'waifuc', 'onnxruntime', 'gradio')
+
+SCENARIOS = {
+    'registry': (
+        "from src.tools.actions.action_registry import registry\n"
+        "from src.tools.sources.source_registry import registry as source_registry\n"
+    ),
+    'list_params': (
+        "from src.tools.actions.action_registry import registry\n"
+        "for names in registry.get_all_actions().values():\n"
+        "    for name in names:\n"
+        "        registry.get_action_params(name)\n"
+    ),
+    'eager': (
+        "from src.tools.actions.action_registry import registry\n"
+        "from src.tools.sources.source_registry import registry as source_registry\n"
+        "for names in registry.get_all_actions().values():\n"
+        "    for name in names:\n"
+        "        registry.get_action_class(name)\n"
+        "for names in source_registry.get_all_sources().values():\n"
+        "    for name in names:\n"
+        "        source_registry.get_source_class(name)\n"
+    ),
+}
+
+_RUNNER = """
+import sys, json, time
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def run_scenario(name: str, repeat: int, python: str) -> Dict[str, Any]:
+    """
+    在新进程中多次运行一个场景，取耗时的中位数
+
+    Args:
+        name: 场景名称
+        repeat: 运行次数
+        python: Python 解释器路径
+
+    Returns:
+        测试结果，场景在当前环境中无法运行时包含 error
+    """
+    code = _RUNNER.format(body=SCENARIOS[name], heavy=HEAVY_MODULES)
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    timings = []
+    loaded: List[str] = []
+    for _ in range(repeat):
+        proc = subprocess.run([python, '-c', code], cwd=root, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {'scenario': name, 'error': proc.stderr.strip().splitlines()[-1] if proc.stderr else "失败"}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        timings.append(result['seconds'])
+        loaded = result['loaded']
+    return {
+        'scenario': name,
+        'repeat': repeat,
+        'median_seconds': round(statistics.median(timings), 4),
+        'min_seconds': round(min(timings), 4),
+        'heavy_modules_loaded': loaded,
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="注册表导入耗时基准测试")
+    parser.add_argument('--repeat', type=int, default=5, help="每个场景的运行次数")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help="要测试的场景")
+    parser.add_argument('--output', help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    results = [run_scenario(name, args.repeat, sys.executable) for name in args.scenarios]
+    report = json.dumps({'benchmark': 'import', 'python': sys.version.split()[0], 'results': results},
+                        ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -48,6 +48,25 @@ class ConfigManager:
                     '3:2': 960
                 },
             },
+            'engine': {
+                'execution_mode': 'materialize',  # materialize: 每步落盘, stream: 流式串联, hybrid: 仅在屏障步骤落盘, pipeline: 分阶段流水线
+                'process_workers': 0,  # 无状态步骤的并行进程数，0或1表示不启用
+                'queue_size': 8,  # pipeline 模式下阶段之间的队列长度
+                'commit_workers': 8,  # 提交最终结果时的并行线程数
+                'intermediate_codec': 'auto',  # 中间结果编码格式: auto, mmap, raw, png0, png1, webp
+                'batch_size': 8,  # 支持批量推理的动作每批处理的图像数，1表示逐项推理
+                'action_pool_enabled': True,  # 是否在多次执行之间复用无状态动作的实例（及其加载的模型）
+                'action_pool_max_gb': 4,  # 动作池的内存上限（GB），超出后按最近最少使用淘汰空闲实例
+            },
+            'cache': {
+                'directory': None,  # 缓存目录，默认为配置目录下的 cache
+                'step_cache_enabled': False,  # 是否缓存无状态步骤的输出（每个输出都要编码写入），重复运行时只重新计算修改过的步骤
+                'step_cache_max_gb': 5,  # 步骤缓存大小上限（GB），超出后按最近最少使用淘汰
+                'tag_cache_enabled': True,  # 是否按图像内容缓存 wd14 标签分数，修改阈值或重复运行时不再推理
+                'detection_cache_enabled': True,  # 是否按图像内容缓存人脸、头部、人物等检测结果，多个步骤共用
+                'embedding_store_enabled': True,  # 是否按图像内容保存 LPIPS、CCIP 特征，重复运行或跨数据集去重时不再提取
+                'embedding_store_max_gb': 20,  # 每个特征模型的存储大小上限（GB），达到后不再保存新的特征
+            },
             'sources': {
                 'danbooru': {
                     'default_limit': 100,
@@ -62,6 +81,11 @@ class ConfigManager:
                     'password': '',
                     'default_limit': 100,
                 },
+                'download': {
+                    'workers_per_host': 4,  # 每个主机的并发下载数
+                    'default_rate': 0,  # 未配置主机的每秒请求数，0表示不限速
+                    'rate_limits': {},  # 主机名后缀到每秒请求数的映射，覆盖内置的站点限速
+                },
             },
             'recent_workflows': [],  # 最近使用的工作流
             'recent_sources': [],    # 最近使用的图像来源
@@ -0,0 +1,139 @@
+"""
+估算模块 - 根据样本上各步骤的测量结果推算完整运行的耗时、输出数量和临时磁盘占用
+"""
+from typing import Any, Dict, List, Optional
+
+from .execution_plan import ExecutionSegment, is_barrier_action
+
+
+class StepSample:
+    """
+    单个步骤在样本上的测量结果
+    """
+    def __init__(self, index: int, action_name: str, inputs: int, outputs: int, seconds: float,
+                 load_seconds: float = 0.0, output_bytes: Optional[int] = None,
+                 error: Optional[str] = None):
+        """
+        初始化测量结果
+
+        Args:
+            index: 步骤序号
+            action_name: 操作名称
+            inputs: 样本中流入该步骤的图像数
+            outputs: 该步骤输出的图像数
+            seconds: 处理全部样本图像的耗时（不含模型加载）
+            load_seconds: 首次处理时额外的耗时（模型加载等固定开销）
+            output_bytes: 输出图像保存后的总字节数，未测量时为None
+            error: 步骤失败时的错误信息
+        """
+        self.index = index
+        self.action_name = action_name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.seconds = seconds
+        self.load_seconds = load_seconds
+        self.output_bytes = output_bytes
+        self.error = error
+
+    @property
+    def ratio(self) -> Optional[float]:
+        """输出数与输入数之比（扇出大于1，过滤小于1），没有输入时为None"""
+        return self.outputs / self.inputs if self.inputs else None
+
+    @property
+    def seconds_per_item(self) -> Optional[float]:
+        """每张输入图像的平均耗时"""
+        return self.seconds / self.inputs if self.inputs else None
+
+    @property
+    def bytes_per_output(self) -> Optional[float]:
+        """每张输出图像的平均字节数"""
+        if self.output_bytes is None or not self.outputs:
+            return None
+        return self.output_bytes / self.outputs
+
+
+def extrapolate(samples: List[StepSample], sample_size: int, total_inputs: Optional[int],
+                plan: List[ExecutionSegment], source_seconds: float = 0.0,
+                source_bytes: Optional[int] = None, scratch_input: bool = False,
+                spill_bytes: Optional[Dict[int, float]] = None) -> Dict[str, Any]:
+    """
+    按各步骤的扇出比例逐步推算每个步骤的输入数量，再推算耗时和磁盘占用
+
+    片段的输出保存在临时目录中，直到下一个片段完成后才删除，因此临时磁盘的峰值
+    为相邻两个片段输出之和的最大值（从网络来源下载的输入也算作第一个片段之前的输出）。
+
+    Args:
+        samples: 各步骤的测量结果，按步骤顺序排列
+        sample_size: 样本图像数
+        total_inputs: 完整运行的输入图像数，未知时按每 1000 张输入推算
+        plan: 完整运行使用的执行计划
+        source_seconds: 读取或下载样本图像的耗时
+        source_bytes: 样本图像的总字节数
+        scratch_input: 输入图像是否会先下载到临时目录
+        spill_bytes: 写入中间存储的片段（按最后一个步骤的序号）中每张输出图像的字节数
+
+    Returns:
+        估算结果字典
+    """
+    spill_bytes = spill_bytes or {}
+    scale_inputs = total_inputs if total_inputs is not None else 1000
+    scale = scale_inputs / sample_size if sample_size else 0.0
+    warnings: List[str] = []
+    if total_inputs is None:
+        warnings.append("无法得知来源的图像总数，以下按每 1000 张输入图像估算")
+
+    steps = []
+    estimated_inputs = float(scale_inputs)
+    total_seconds = source_seconds * scale
+    step_bytes: Dict[int, float] = {}
+    for sample in samples:
+        ratio = sample.ratio if sample.ratio is not None else 0.0
+        estimated_outputs = estimated_inputs * ratio
+        seconds = (sample.seconds_per_item or 0.0) * estimated_inputs + sample.load_seconds
+        bytes_per_output = spill_bytes.get(sample.index, sample.bytes_per_output)
+        estimated_bytes = estimated_outputs * bytes_per_output if bytes_per_output is not None else None
+        if estimated_bytes is not None:
+            step_bytes[sample.index] = estimated_bytes
+        total_seconds += seconds
+        steps.append({
+            'index': sample.index,
+            'action': sample.action_name,
+            'sample_inputs': sample.inputs,
+            'sample_outputs': sample.outputs,
+            'ratio': round(sample.ratio, 4) if sample.ratio is not None else None,
+            'seconds_per_item': sample.seconds_per_item,
+            'load_seconds': round(sample.load_seconds, 3),
+            'bytes_per_output': bytes_per_output,
+            'estimated_inputs': round(estimated_inputs),
+            'estimated_outputs': round(estimated_outputs),
+            'estimated_seconds': round(seconds, 1),
+            'estimated_bytes': round(estimated_bytes) if estimated_bytes is not None else None,
+            'error': sample.error,
+        })
+        if sample.error:
+            warnings.append(f"步骤 {sample.index + 1} ({sample.action_name}) 在样本上失败: {sample.error}")
+        elif is_barrier_action(sample.action_name):
+            warnings.append(f"步骤 {sample.index + 1} ({sample.action_name}) 的结果依赖完整数据集，"
+                            f"按样本推算的输出数量仅供参考")
+        # 失败的步骤在实际运行中不产生输出，后续步骤继续使用上一步的结果
+        if not sample.error:
+            estimated_inputs = estimated_outputs
+
+    # 临时磁盘峰值：相邻两个片段的输出同时存在
+    segment_bytes = [step_bytes.get(segment.last_index, 0.0) for segment in plan]
+    if scratch_input and source_bytes is not None:
+        segment_bytes.insert(0, source_bytes * scale)
+    peak = max([a + b for a, b in zip(segment_bytes, segment_bytes[1:])] + segment_bytes + [0.0])
+
+    return {
+        'sample_size': sample_size,
+        'total_inputs': total_inputs,
+        'source_seconds_per_item': source_seconds / sample_size if sample_size else None,
+        'estimated_seconds': round(total_seconds, 1),
+        'estimated_outputs': round(estimated_inputs),
+        'output_bytes': round(step_bytes.get(plan[-1].last_index, 0.0)) if plan else 0,
+        'peak_scratch_bytes': round(peak),
+        'steps': steps,
+        'warnings': warnings,
+    }
@@ -4,6 +4,7 @@
 import os
 import json
 import uuid
+import shutil
 import logging
 from typing import Any, Dict, List, Optional, Tuple, Union
 from datetime import datetime
@@ -47,6 +48,13 @@ class ExecutionRecord:
         self.failed_images = 0
         
         self.step_logs: List[Dict[str, Any]] = []
+
+        # 断点续跑信息
+        self.run_dir: Optional[str] = None  # 保存中间结果的工作目录，失败或取消后保留
+        self.workflow_snapshot: Optional[Dict[str, Any]] = None  # 启动时的工作流快照
+        self.options: Dict[str, Any] = {}  # 执行选项
+        self.checkpoints: List[Dict[str, Any]] = []  # 已完成片段的检查点
+        self.resume_count = 0
     
     def add_step_log(self, step_id: str, step_name: str, status: str, 
                     message: str = None, details: Dict[str, Any] = None) -> None:
@@ -70,6 +78,51 @@ class ExecutionRecord:
         }
         self.step_logs.append(log)
     
+    def add_checkpoint(self, position: int, step_ids: List[str], last_step: int,
+                       output_dir: str, total_images: int, failed_steps: int) -> None:
+        """
+        记录一个已完成片段的检查点
+
+        Args:
+            position: 片段在执行计划中的位置
+            step_ids: 片段包含的步骤ID
+            last_step: 片段最后一个步骤的序号
+            output_dir: 片段输出目录
+            total_images: 当时已获取的图像总数
+            failed_steps: 当时累计失败的片段数
+        """
+        self.checkpoints.append({
+            'position': position,
+            'step_ids': step_ids,
+            'last_step': last_step,
+            'output_dir': output_dir,
+            'total_images': total_images,
+            'failed_steps': failed_steps,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    def last_checkpoint(self) -> Optional[Dict[str, Any]]:
+        """
+        获取最后一个输出仍然存在的检查点
+
+        Returns:
+            检查点字典或None
+        """
+        for checkpoint in reversed(self.checkpoints):
+            if os.path.isdir(checkpoint['output_dir']):
+                return checkpoint
+        return None
+
+    def can_resume(self) -> bool:
+        """
+        判断记录是否可以继续执行：失败或取消（包括进程退出时仍为运行中）且工作目录仍然存在
+
+        Returns:
+            是否可以继续执行
+        """
+        return (self.status != "completed" and self.workflow_snapshot is not None
+                and bool(self.run_dir) and os.path.isdir(self.run_dir))
+
     def complete(self, total_images: int, processed_images: int, 
                 success_images: int, failed_images: int) -> None:
         """
@@ -99,6 +152,58 @@ class ExecutionRecord:
         self.status = "failed"
         self.error_message = error_message
     
+    def profile_summary(self) -> Optional[Dict[str, Any]]:
+        """
+        汇总步骤日志中的性能记录
+
+        共享同一阶段的步骤只计一次，片段级的数值（墙钟和 CPU 时间、读写字节数）按片段计一次，
+        继续执行时重新运行的片段单独累加。
+
+        Returns:
+            汇总结果，包含总计和按阶段汇总的列表（按耗时从高到低排列），没有性能记录时返回None
+        """
+        segments: Dict[Any, Dict[str, Any]] = {}
+        stages: Dict[Any, Dict[str, Any]] = {}
+        for log in self.step_logs:
+            profile = (log.get('details') or {}).get('profile')
+            if not profile:
+                continue
+            segment_key = (profile['segment'], profile['segment_started'])
+            segments.setdefault(segment_key, profile)
+            stages.setdefault(segment_key + (profile['stage_index'],), profile)
+        if not segments:
+            return None
+
+        by_stage: Dict[str, Dict[str, Any]] = {}
+        for profile in stages.values():
+            entry = by_stage.setdefault(profile['stage'], {
+                'stage': profile['stage'], 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'items_in': 0,
+                'items_out': 0, 'items_dropped': 0, 'items_errored': 0, 'model_load_seconds': 0.0,
+                'peak_rss_bytes': None})
+            for key in ('wall_seconds', 'cpu_seconds', 'items_in', 'items_out', 'items_dropped',
+                        'items_errored', 'model_load_seconds'):
+                entry[key] += profile[key]
+            if profile['peak_rss_bytes'] is not None:
+                entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'] or 0, profile['peak_rss_bytes'])
+
+        def total(key: str) -> Optional[float]:
+            values = [profile[key] for profile in segments.values() if profile.get(key) is not None]
+            return sum(values) if values else None
+
+        peaks = [profile['peak_rss_bytes'] for profile in segments.values() if profile['peak_rss_bytes'] is not None]
+        return {
+            'wall_seconds': round(total('segment_wall_seconds') or 0.0, 3),
+            'cpu_seconds': round(total('segment_cpu_seconds') or 0.0, 3),
+            'bytes_read': total('bytes_read'),
+            'bytes_written': total('bytes_written'),
+            'peak_rss_bytes': max(peaks) if peaks else None,
+            'stages': sorted(({**entry, 'wall_seconds': round(entry['wall_seconds'], 3),
+                               'cpu_seconds': round(entry['cpu_seconds'], 3),
+                               'model_load_seconds': round(entry['model_load_seconds'], 3)}
+                              for entry in by_stage.values()),
+                             key=lambda entry: entry['wall_seconds'], reverse=True),
+        }
+
     def to_dict(self) -> Dict[str, Any]:
         """
         将执行记录转换为字典
@@ -121,7 +226,13 @@ class ExecutionRecord:
             'processed_images': self.processed_images,
             'success_images': self.success_images,
             'failed_images': self.failed_images,
-            'step_logs': self.step_logs
+            'step_logs': self.step_logs,
+            'run_dir': self.run_dir,
+            'workflow_snapshot': self.workflow_snapshot,
+            'options': self.options,
+            'checkpoints': self.checkpoints,
+            'resume_count': self.resume_count,
+            'profile_summary': self.profile_summary()
         }
     
     @classmethod
@@ -155,6 +266,12 @@ class ExecutionRecord:
         record.failed_images = data.get('failed_images', 0)
         
         record.step_logs = data.get('step_logs', [])
+
+        record.run_dir = data.get('run_dir')
+        record.workflow_snapshot = data.get('workflow_snapshot')
+        record.options = data.get('options', {})
+        record.checkpoints = data.get('checkpoints', [])
+        record.resume_count = data.get('resume_count', 0)
         
         return record
     
@@ -288,8 +405,10 @@ class ExecutionHistoryManager:
             return False
         
         try:
-            # 从内存中删除
-            del self._records[record_id]
+            # 从内存中删除，同时清理保留的工作目录
+            record = self._records.pop(record_id)
+            if record.run_dir and os.path.isdir(record.run_dir):
+                shutil.rmtree(record.run_dir, ignore_errors=True)
             
             # 从文件中删除
             record_path = os.path.join(self.history_dir, f"{record_id}.json")
@@ -314,6 +433,9 @@ class ExecutionHistoryManager:
         if days is None:
             # 清理所有记录
             count = len(self._records)
+            for record in self._records.values():
+                if record.run_dir and os.path.isdir(record.run_dir):
+                    shutil.rmtree(record.run_dir, ignore_errors=True)
             self._records.clear()
             
             for filename in os.listdir(self.history_dir):
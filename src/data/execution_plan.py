@@ -0,0 +1,255 @@
+"""
+执行计划模块 - 将工作流步骤划分为执行片段
+"""
+from typing import List, Tuple
+
+from .workflow import WorkflowStep
+
+
+# 以目录为输入输出的自定义动作，无法参与流式串联
+DIRECTORY_ACTIONS = frozenset({
+    "PreSortImagesAction",
+    "EnhancedImageProcessAction",
+})
+
+# 需要看到完整数据集或保留跨图像状态的动作，在混合模式下只在这些步骤之前落盘
+BARRIER_ACTIONS = frozenset({
+    "FilterSimilarAction",
+    "PHashDedupAction",
+    "CCIPAction",
+    "FirstNSelectAction",
+    "SliceSelectAction",
+    "FileOrderAction",
+}) | DIRECTORY_ACTIONS
+
+# 逐项处理且不保留跨图像状态的动作，可以分片到多个进程中并行执行
+STATELESS_ACTIONS = frozenset({
+    "ModeConvertAction",
+    "BackgroundRemovalAction",
+    "AlignMaxSizeAction",
+    "AlignMinSizeAction",
+    "AlignMaxAreaAction",
+    "PaddingAlignAction",
+    "MirrorAction",
+    "PersonSplitAction",
+    "ThreeStageSplitAction",
+    "FrameSplitAction",
+    "MinSizeFilterAction",
+    "MinAreaFilterAction",
+    "NoMonochromeAction",
+    "OnlyMonochromeAction",
+    "ClassFilterAction",
+    "RatingFilterAction",
+    "FaceCountAction",
+    "HeadCountAction",
+    "PersonRatioAction",
+    "TaggingAction",
+    "TagFilterAction",
+    "TagOverlapDropAction",
+    "TagDropAction",
+    "BlacklistedTagDropAction",
+    "TagRemoveUnderlineAction",
+    "SafetyAction",
+    "HeadCutOutAction",
+    "HeadCoverAction",
+    "SmartCropActionWrapper",
+})
+
+# 不保留跨图像状态、实例可以在多次执行之间复用的动作（ESRGAN 模型过大，不适合在多个进程中各加载一份）
+POOLABLE_ACTIONS = STATELESS_ACTIONS | frozenset({
+    "ESRGANActionWrapper",
+})
+
+# 结果依赖输入顺序的动作，其上游的并行步骤必须保持输出顺序
+ORDER_SENSITIVE_ACTIONS = frozenset({
+    "FilterSimilarAction",
+    "PHashDedupAction",
+    "CCIPAction",
+    "FirstNSelectAction",
+    "SliceSelectAction",
+    "FileOrderAction",
+})
+
+# 支持的执行模式
+EXECUTION_MODES = ("materialize", "stream", "hybrid", "pipeline")
+
+
+class ExecutionSegment:
+    """
+    执行片段，代表一组在内存中串联执行、只在片段边界落盘的步骤
+    """
+    def __init__(self, kind: str, steps: List[Tuple[int, WorkflowStep]]):
+        """
+        初始化执行片段
+
+        Args:
+            kind: 片段类型（stream: 逐项流式处理, directory: 目录级处理）
+            steps: (步骤序号, 工作流步骤) 列表，序号从0开始
+        """
+        self.kind = kind
+        self.steps = steps
+
+    @property
+    def first_index(self) -> int:
+        """片段中第一个步骤的序号"""
+        return self.steps[0][0]
+
+    @property
+    def last_index(self) -> int:
+        """片段中最后一个步骤的序号"""
+        return self.steps[-1][0]
+
+    @property
+    def action_names(self) -> List[str]:
+        """片段中各步骤的操作名称"""
+        return [step.action_name for _, step in self.steps]
+
+    def __repr__(self) -> str:
+        return f"ExecutionSegment(kind={self.kind}, steps={' -> '.join(self.action_names)})"
+
+
+def is_directory_action(action_name: str) -> bool:
+    """
+    判断操作是否为目录级自定义动作
+
+    Args:
+        action_name: 操作名称
+
+    Returns:
+        是否需要以目录作为输入
+    """
+    return action_name in DIRECTORY_ACTIONS
+
+
+def is_barrier_action(action_name: str) -> bool:
+    """
+    判断操作是否为屏障动作（有状态或需要完整数据集）
+
+    Args:
+        action_name: 操作名称
+
+    Returns:
+        是否需要在该步骤之前落盘
+    """
+    return action_name in BARRIER_ACTIONS
+
+
+def is_stateless_action(action_name: str) -> bool:
+    """
+    判断操作是否为可并行的无状态动作
+
+    Args:
+        action_name: 操作名称
+
+    Returns:
+        是否可以分片到进程池中执行
+    """
+    return action_name in STATELESS_ACTIONS
+
+
+def is_poolable_action(action_name: str) -> bool:
+    """
+    判断操作的实例是否可以放入动作池，在多次执行之间复用
+
+    Args:
+        action_name: 操作名称
+
+    Returns:
+        是否可以复用实例
+    """
+    return action_name in POOLABLE_ACTIONS
+
+
+def split_parallel_runs(steps: List[Tuple[int, WorkflowStep]],
+                        parallel: bool) -> List[Tuple[bool, List[Tuple[int, WorkflowStep]]]]:
+    """
+    将片段内的步骤拆分为连续的并行组和串行组
+
+    Args:
+        steps: (步骤序号, 工作流步骤) 列表
+        parallel: 是否启用并行，未启用时所有步骤归为一个串行组
+
+    Returns:
+        (是否并行, 步骤列表) 列表
+    """
+    runs: List[Tuple[bool, List[Tuple[int, WorkflowStep]]]] = []
+    for index, step in steps:
+        is_parallel = parallel and is_stateless_action(step.action_name)
+        if runs and runs[-1][0] == is_parallel:
+            runs[-1][1].append((index, step))
+        else:
+            runs.append((is_parallel, [(index, step)]))
+    return runs
+
+
+def requires_order(steps: List[WorkflowStep], after_index: int) -> bool:
+    """
+    判断某个步骤之后是否存在依赖输入顺序的动作
+
+    Args:
+        steps: 工作流全部步骤
+        after_index: 步骤序号
+
+    Returns:
+        是否需要保持输出顺序
+    """
+    return any(step.action_name in ORDER_SENSITIVE_ACTIONS for step in steps[after_index + 1:])
+
+
+def build_execution_plan(steps: List[WorkflowStep], mode: str = "materialize",
+                         start: int = 0) -> List[ExecutionSegment]:
+    """
+    根据执行模式将工作流步骤划分为执行片段
+
+    - materialize: 每个步骤单独成段，步骤之间全部落盘（兼容原有行为）
+    - stream: 相邻的逐项步骤合并为一个惰性迭代链，只在目录级动作前后落盘
+    - hybrid: 在 stream 的基础上于每个屏障动作之前落盘，屏障动作从完整的中间结果读取，
+      并与其后的逐项步骤继续串联，例如含一个去重步骤的10步工作流只需2次落盘
+    - pipeline: 片段划分与 stream 相同，但片段内每个步骤在独立线程中运行，步骤之间通过有界队列传递
+
+    Args:
+        steps: 工作流步骤列表
+        mode: 执行模式
+        start: 从该序号的步骤开始规划，之前的步骤视为已完成（例如由共享前缀计算）
+
+    Returns:
+        执行片段列表
+    """
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"未知的执行模式: {mode}")
+
+    segments: List[ExecutionSegment] = []
+    for index, step in enumerate(steps):
+        if index < start:
+            continue
+        if is_directory_action(step.action_name):
+            segments.append(ExecutionSegment("directory", [(index, step)]))
+        elif mode == "hybrid" and is_barrier_action(step.action_name):
+            segments.append(ExecutionSegment("stream", [(index, step)]))
+        elif mode in ("stream", "hybrid", "pipeline") and segments and segments[-1].kind == "stream":
+            segments[-1].steps.append((index, step))
+        else:
+            segments.append(ExecutionSegment("stream", [(index, step)]))
+    return segments
+
+
+def supports_item_journal(segment: ExecutionSegment, execution_mode: str, parallel: bool,
+                          batched: bool = False) -> bool:
+    """
+    判断片段能否使用逐项日志断点续跑：只有逐项同步处理的片段才能确定哪些输入已经完成
+
+    Args:
+        segment: 执行片段
+        execution_mode: 执行模式
+        parallel: 是否启用了进程池并行
+        batched: 片段中是否有按批推理的步骤（批量步骤会预读输入，输入被记为完成时其输出可能尚未写出）
+
+    Returns:
+        是否可以在续跑时跳过已完成的输入图像
+    """
+    if segment.kind != "stream" or execution_mode == "pipeline" or batched:
+        return False
+    for _, step in segment.steps:
+        if is_barrier_action(step.action_name) or (parallel and is_stateless_action(step.action_name)):
+            return False
+    return True
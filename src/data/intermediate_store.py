@@ -0,0 +1,362 @@
+"""
+中间结果存储模块 - 在执行片段边界保存图像及其元数据
+"""
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+import numpy as np
+from PIL import Image
+
+
+# 可选的中间编码格式
+#   raw: 未压缩的 NumPy 数组，编解码几乎不耗 CPU，但占用磁盘最多
+#   png0 / png1: 不压缩 / 最快压缩级别的 PNG
+#   webp: 最快档位的无损 WebP，体积最小但编码最慢
+#   mmap: 解码后的像素连续写入一个数据文件，读取时通过内存映射直接访问，见 MmapImageStore
+CODECS = ("mmap", "raw", "png0", "png1", "webp")
+# auto 表示根据内置的微基准测试选择最快的格式
+INTERMEDIATE_CODECS = ("auto",) + CODECS
+
+# raw 格式能无损往返的图像模式，其余模式（如调色板图像）改用 png1
+_RAW_MODES = ('L', 'LA', 'RGB', 'RGBA', 'I', 'F')
+# WebP 只能无损保存 RGB / RGBA
+_WEBP_MODES = ('RGB', 'RGBA')
+
+_auto_codec: Optional[str] = None
+_auto_codec_lock = threading.Lock()
+
+
+class IntermediateStore:
+    """
+    片段之间的中间结果存储
+
+    所有图像按写入顺序编号保存在 images 目录下，元数据集中记录在一个 index.jsonl 文件中，
+    读取时按原顺序恢复为带完整元数据的图像项，不会像 SaveExporter 那样为每张图像额外生成元数据文件。
+    每条索引记录各自的编码格式，因此读取时不需要知道写入时使用的格式。
+    """
+    INDEX_FILENAME = "index.jsonl"
+    IMAGES_DIRNAME = "images"
+
+    def __init__(self, directory: str, codec: str = "png1"):
+        """
+        初始化中间结果存储
+
+        Args:
+            directory: 存储目录
+            codec: 写入时使用的编码格式，见 CODECS（mmap 请使用 MmapImageStore）
+        """
+        if codec not in CODECS or codec == "mmap":
+            raise ValueError(f"未知的中间编码格式: {codec}")
+        self.directory = directory
+        self.codec = codec
+        self.images_dir = os.path.join(directory, self.IMAGES_DIRNAME)
+        self.index_file = os.path.join(directory, self.INDEX_FILENAME)
+
+    @classmethod
+    def is_store(cls, directory: str) -> bool:
+        """
+        判断目录是否为中间结果存储
+
+        Args:
+            directory: 目录路径
+
+        Returns:
+            是否包含存储索引
+        """
+        return os.path.isfile(os.path.join(directory, cls.INDEX_FILENAME))
+
+    def write(self, items: Iterable[Any], append: bool = False) -> int:
+        """
+        写入图像项序列
+
+        Args:
+            items: 图像项序列
+            append: 是否追加到已有内容之后（断点续跑时使用），否则覆盖
+
+        Returns:
+            本次写入的图像数量
+        """
+        os.makedirs(self.images_dir, exist_ok=True)
+        start = len(self) if append else 0
+        count = 0
+        with open(self.index_file, 'a' if append else 'w', encoding='utf-8') as index:
+            for item in items:
+                entry = self._save_image(item.image, start + count)
+                entry['meta'] = item.meta
+                index.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+                index.flush()
+                count += 1
+        return count
+
+    def __iter__(self) -> Iterator[Any]:
+        """
+        按写入顺序读取图像项
+
+        Yields:
+            图像项
+        """
+        from waifuc.model import ImageItem
+
+        with open(self.index_file, 'r', encoding='utf-8') as index:
+            for line in index:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                try:
+                    image = self._load_image(entry)
+                except Exception as e:
+                    logging.error(f"读取中间结果 {entry['file']} 失败: {str(e)}")
+                    continue
+                yield ImageItem(image, entry.get('meta') or {})
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.index_file):
+            return 0
+        with open(self.index_file, 'r', encoding='utf-8') as index:
+            return sum(1 for line in index if line.strip())
+
+    def _save_image(self, image: Image.Image, number: int) -> Dict[str, Any]:
+        """
+        按编码格式保存单张图像，多帧图像始终保存为 GIF 以保留所有帧，
+        当前格式无法无损保存的图像模式退回到 png1
+        """
+        if getattr(image, 'is_animated', False):
+            filename = f"{number:08d}.gif"
+            image.save(os.path.join(self.images_dir, filename), format='GIF', save_all=True)
+            return {'file': filename, 'codec': 'gif'}
+
+        codec = self.codec
+        if (codec == "raw" and image.mode not in _RAW_MODES) or \
+                (codec == "webp" and image.mode not in _WEBP_MODES):
+            codec = "png1"
+
+        if codec == "raw":
+            filename = f"{number:08d}.npy"
+            np.save(os.path.join(self.images_dir, filename), np.asarray(image), allow_pickle=False)
+            return {'file': filename, 'codec': codec, 'mode': image.mode}
+        if codec == "webp":
+            filename = f"{number:08d}.webp"
+            image.save(os.path.join(self.images_dir, filename), format='WEBP',
+                       lossless=True, quality=0, method=0)
+            return {'file': filename, 'codec': codec}
+
+        filename = f"{number:08d}.png"
+        if image.mode not in ('1', 'L', 'LA', 'I', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.save(os.path.join(self.images_dir, filename), format='PNG',
+                   compress_level=0 if codec == "png0" else 1)
+        return {'file': filename, 'codec': codec}
+
+    def _load_image(self, entry: Dict[str, Any]) -> Image.Image:
+        """
+        按索引记录读取单张图像
+        """
+        path = os.path.join(self.images_dir, entry['file'])
+        if entry.get('codec') == "raw":
+            image = Image.fromarray(np.load(path, allow_pickle=False))
+            if image.mode != entry['mode']:
+                image = image.convert(entry['mode'])
+            return image
+        image = Image.open(path)
+        image.load()
+        return image
+
+
+class MmapImageStore(IntermediateStore):
+    """
+    基于内存映射的中间结果存储
+
+    解码后的像素按写入顺序连续追加到一个数据文件中，索引只记录偏移量、形状、数据类型、
+    图像模式和元数据。读取时整个数据文件映射到内存，每张图像直接引用映射区域构建，
+    不需要解码 PNG，也不会在页缓存之外再复制一份压缩数据，适合 ThreeStageSplitAction
+    等成倍增加图像数量的步骤。多帧图像和无法直接表示为数组的模式仍按 png1 单独保存。
+    """
+    DATA_FILENAME = "pixels.bin"
+    # 每张图像的起始偏移按此字节数对齐，保证 int32 / float32 数组可以直接映射
+    ALIGNMENT = 64
+
+    def __init__(self, directory: str):
+        """
+        初始化内存映射存储
+
+        Args:
+            directory: 存储目录
+        """
+        # 无法映射的图像按 png1 单独保存
+        super().__init__(directory, "png1")
+        self.data_file = os.path.join(directory, self.DATA_FILENAME)
+        self._data_handle = None
+        self._data = None
+
+    @classmethod
+    def is_mmap_store(cls, directory: str) -> bool:
+        """
+        判断目录是否为内存映射存储
+
+        Args:
+            directory: 目录路径
+
+        Returns:
+            是否包含像素数据文件
+        """
+        return cls.is_store(directory) and os.path.isfile(os.path.join(directory, cls.DATA_FILENAME))
+
+    def write(self, items: Iterable[Any], append: bool = False) -> int:
+        os.makedirs(self.images_dir, exist_ok=True)
+        with open(self.data_file, 'ab' if append else 'wb') as self._data_handle:
+            try:
+                return super().write(items, append)
+            finally:
+                self._data_handle = None
+
+    def __iter__(self) -> Iterator[Any]:
+        self._data = np.memmap(self.data_file, dtype=np.uint8, mode='r') \
+            if os.path.getsize(self.data_file) else np.empty(0, dtype=np.uint8)
+        try:
+            yield from super().__iter__()
+        finally:
+            self._data = None
+
+    def _save_image(self, image: Image.Image, number: int) -> Dict[str, Any]:
+        if getattr(image, 'is_animated', False) or image.mode not in _RAW_MODES:
+            return super()._save_image(image, number)
+        array = np.ascontiguousarray(np.asarray(image))
+        handle = self._data_handle
+        offset = handle.tell()
+        padding = -offset % self.ALIGNMENT
+        if padding:
+            handle.write(b'\0' * padding)
+            offset += padding
+        handle.write(memoryview(array).cast('B'))
+        handle.flush()
+        return {'file': self.DATA_FILENAME, 'codec': 'mmap', 'mode': image.mode,
+                'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+
+    def _load_image(self, entry: Dict[str, Any]) -> Image.Image:
+        if entry.get('codec') != "mmap":
+            return super()._load_image(entry)
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        offset = entry['offset']
+        array = self._data[offset:offset + nbytes].view(dtype).reshape(shape)
+        image = Image.fromarray(array)
+        if image.mode != entry['mode']:
+            image = image.convert(entry['mode'])
+        return image
+
+
+def create_intermediate_store(directory: str, codec: str = "png1") -> IntermediateStore:
+    """
+    按编码格式创建用于写入的中间结果存储
+
+    Args:
+        directory: 存储目录
+        codec: 编码格式，见 CODECS
+
+    Returns:
+        中间结果存储实例
+    """
+    if codec == "mmap":
+        return MmapImageStore(directory)
+    return IntermediateStore(directory, codec)
+
+
+def open_intermediate_store(directory: str) -> IntermediateStore:
+    """
+    打开已写入的中间结果存储，自动识别存储类型
+
+    Args:
+        directory: 存储目录
+
+    Returns:
+        中间结果存储实例
+    """
+    if MmapImageStore.is_mmap_store(directory):
+        return MmapImageStore(directory)
+    return IntermediateStore(directory)
+
+
+def _sample_image(size: int) -> Image.Image:
+    """
+    生成用于微基准测试的样本图像：平滑渐变叠加噪声，压缩难度接近真实插画
+    """
+    rng = np.random.default_rng(0)
+    ramp = np.linspace(0, 255, size, dtype=np.float32)
+    base = np.stack([ramp[None, :].repeat(size, 0), ramp[:, None].repeat(size, 1),
+                     np.full((size, size), 128, np.float32)], axis=-1)
+    noise = rng.normal(0, 12, (size, size, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+class _BenchmarkItem:
+    """
+    微基准测试使用的最小图像项
+    """
+    def __init__(self, image: Image.Image):
+        self.image = image
+        self.meta = {}
+
+
+def benchmark_codecs(size: int = 512, rounds: int = 3) -> Dict[str, float]:
+    """
+    在临时目录中对各编码格式进行写入再读取的微基准测试
+
+    测量包含编码、写文件、读文件和解码，因此同时反映 CPU 开销和磁盘吞吐量。
+
+    Args:
+        size: 样本图像边长
+        rounds: 每种格式的重复次数
+
+    Returns:
+        编码格式到单张图像平均耗时（秒）的映射
+    """
+    image = _sample_image(size)
+    results = {}
+    directory = tempfile.mkdtemp(prefix="codec_bench_")
+    try:
+        for codec in CODECS:
+            store = create_intermediate_store(os.path.join(directory, codec), codec)
+            start = time.perf_counter()
+            store.write(_BenchmarkItem(image) for _ in range(rounds))
+            for item in store:
+                item.image.load()
+            results[codec] = (time.perf_counter() - start) / rounds
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def resolve_codec(codec: str) -> str:
+    """
+    解析配置的中间编码格式，auto 时使用微基准测试中最快的格式（每个进程只测一次）
+
+    Args:
+        codec: 配置的编码格式
+
+    Returns:
+        实际使用的编码格式
+    """
+    global _auto_codec
+    if codec != "auto":
+        if codec not in CODECS:
+            raise ValueError(f"未知的中间编码格式: {codec}")
+        return codec
+    with _auto_codec_lock:
+        if _auto_codec is None:
+            try:
+                timings = benchmark_codecs()
+                _auto_codec = min(timings, key=timings.get)
+                logging.info(f"中间编码格式基准测试: "
+                             f"{', '.join(f'{k} {v * 1000:.1f}ms' for k, v in timings.items())}，"
+                             f"选择 {_auto_codec}")
+            except Exception as e:
+                logging.warning(f"中间编码格式基准测试失败，使用 png1: {str(e)}")
+                _auto_codec = "png1"
+        return _auto_codec
@@ -0,0 +1,75 @@
+"""
+逐项日志模块 - 记录片段中已处理完成的输入图像，断点续跑时跳过这些图像
+"""
+import os
+from typing import Any, Iterable, Iterator, Optional
+
+
+def item_key(item: Any) -> Optional[str]:
+    """
+    获取图像项的标识，使用元数据中的文件名
+
+    Args:
+        item: 图像项
+
+    Returns:
+        图像项标识，没有文件名时返回None（这类图像不会被跳过）
+    """
+    meta = getattr(item, 'meta', None) or {}
+    filename = meta.get('filename')
+    return str(filename) if filename else None
+
+
+class ItemJournal:
+    """
+    片段的逐项日志
+
+    每个输入图像流经片段内所有步骤、其输出被写入之后，才把它的标识追加到日志文件中，
+    因此日志中的图像在续跑时可以安全跳过。只适用于逐项同步处理的片段：
+    流水线、进程池和需要看到完整数据集的步骤会提前读取后续图像，无法据此判断完成情况。
+    """
+    def __init__(self, path: str):
+        """
+        初始化逐项日志
+
+        Args:
+            path: 日志文件路径
+        """
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+
+    def __len__(self) -> int:
+        return len(self.done)
+
+    def reset(self) -> None:
+        """
+        清空日志
+        """
+        self.done = set()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def track(self, items: Iterable[Any]) -> Iterator[Any]:
+        """
+        跳过已完成的图像，并在下游请求下一项时把上一项记为已完成
+
+        Args:
+            items: 输入图像项序列
+
+        Yields:
+            尚未完成的图像项
+        """
+        with open(self.path, 'a', encoding='utf-8') as journal:
+            for item in items:
+                key = item_key(item)
+                if key is not None and key in self.done:
+                    continue
+                yield item
+                # 生成器在下游请求下一项时才会恢复执行，此时上一项的所有输出都已写入
+                if key is not None:
+                    journal.write(key + '\n')
+                    journal.flush()
+                    self.done.add(key)
@@ -0,0 +1,163 @@
+"""
+输出提交模块 - 将最终结果从临时目录快速转移到输出目录
+"""
+import os
+import uuid
+import errno
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+# Linux FICLONE ioctl，在 btrfs / xfs 等文件系统上以写时复制方式克隆文件
+_FICLONE = 0x40049409
+
+logger = logging.getLogger(__name__)
+
+
+def _is_within(path: str, directory: str) -> bool:
+    path = os.path.realpath(path)
+    directory = os.path.realpath(directory)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def create_scratch_dir(output_directory: str, temp_root: Optional[str] = None,
+                       exclude: Iterable[str] = ()) -> str:
+    """
+    创建临时工作目录
+
+    默认放在输出目录所在的文件系统上（输出目录下的隐藏目录），这样提交阶段只需重命名文件。
+    配置了临时目录时使用配置的目录；工作目录落在输入目录之内时改用系统临时目录，
+    避免递归读取输入时读到中间结果。
+
+    Args:
+        output_directory: 输出目录
+        temp_root: 配置的临时目录，为空时使用输出目录
+        exclude: 工作目录不能位于其中的目录（例如输入目录）
+
+    Returns:
+        临时工作目录路径
+    """
+    root = temp_root or output_directory
+    if not any(directory and _is_within(root, directory) for directory in exclude):
+        try:
+            os.makedirs(root, exist_ok=True)
+            return tempfile.mkdtemp(prefix=".image_processor_", dir=root)
+        except OSError as e:
+            logger.warning(f"无法在 {root} 创建临时目录，改用系统临时目录: {str(e)}")
+    return tempfile.mkdtemp()
+
+
+def _clone_file(src: str, dst: str) -> None:
+    """
+    跨文件系统复制单个文件：优先 reflink，其次 copy_file_range 在内核中复制，最后退回 copy2
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                shutil.copystat(src, dst)
+                return
+            except OSError:
+                pass
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    shutil.copystat(src, dst)
+                    return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+            fdst.seek(0)
+            fdst.truncate()
+    shutil.copy2(src, dst)
+
+
+def transfer_file(src: str, dst: str, same_filesystem: bool, move: bool = True) -> str:
+    """
+    转移单个文件：源文件之后会被删除时，同一文件系统上直接重命名；
+    源文件需要保留时（例如多个工作流共享的结果）使用硬链接
+
+    Args:
+        src: 源文件路径
+        dst: 目标文件路径
+        same_filesystem: 源和目标是否位于同一文件系统
+        move: 是否允许移走源文件
+
+    Returns:
+        实际使用的方式（rename / link / clone）
+    """
+    if same_filesystem:
+        if move:
+            try:
+                os.rename(src, dst)
+                return "rename"
+            except OSError:
+                pass
+        try:
+            os.link(src, dst)
+            return "link"
+        except OSError:
+            pass
+    _clone_file(src, dst)
+    return "clone"
+
+
+def commit_outputs(source_dir: str, output_directory: str, extensions: Tuple[str, ...],
+                   workers: int = 8, cancel_event: Optional[threading.Event] = None,
+                   task_logger: Optional[logging.Logger] = None, move: bool = True) -> int:
+    """
+    将源目录中的图像文件并行转移到输出目录，文件名追加随机后缀避免覆盖已有文件
+
+    Args:
+        source_dir: 最终结果所在的目录
+        output_directory: 输出目录
+        extensions: 需要提交的文件扩展名
+        workers: 并行线程数
+        cancel_event: 取消事件，设置后不再提交剩余文件
+        task_logger: 任务日志记录器
+        move: 是否允许移走源文件，源目录之后会被删除时为True
+
+    Returns:
+        成功提交的文件数量
+    """
+    task_logger = task_logger or logger
+    jobs: List[Tuple[str, str]] = []
+    for root, dirs, files in os.walk(source_dir):
+        for filename in files:
+            if filename.lower().endswith(extensions):
+                base, ext = os.path.splitext(filename)
+                unique_filename = f"{base}_{uuid.uuid4().hex[:8]}{ext}"
+                jobs.append((os.path.join(root, filename), os.path.join(output_directory, unique_filename)))
+    if not jobs:
+        return 0
+
+    same_filesystem = os.stat(source_dir).st_dev == os.stat(output_directory).st_dev
+
+    def commit(job: Tuple[str, str]) -> Optional[str]:
+        if cancel_event and cancel_event.is_set():
+            return None
+        src_path, dst_path = job
+        try:
+            return transfer_file(src_path, dst_path, same_filesystem, move)
+        except Exception as e:
+            task_logger.error(f"复制最终文件失败: {src_path} -> {dst_path}, 错误: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        methods = [method for method in executor.map(commit, jobs) if method]
+    task_logger.info(f"提交方式: {', '.join(f'{m} {methods.count(m)}' for m in sorted(set(methods)))}")
+    return len(methods)
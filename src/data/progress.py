@@ -0,0 +1,491 @@
+"""
+进度跟踪模块 - 统计片段内逐项的处理进度、吞吐量和预计剩余时间，以及各步骤的资源占用
+"""
+import time
+import inspect
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.tools.actions.action_pool import current_rss
+
+
+def report_progress(callback: Optional[Callable[..., None]], status: str, progress: float, message: str,
+                    details: Optional[Dict[str, Any]] = None) -> None:
+    """
+    调用进度回调，回调接受 details 参数（或 **kwargs）时一并传入结构化的进度详情
+
+    Args:
+        callback: 进度回调，为None时不做任何事
+        status: 状态
+        progress: 进度（0-1）
+        message: 进度消息
+        details: 进度详情
+    """
+    if not callback:
+        return
+    if details is not None and _accepts_details(callback):
+        callback(status, progress, message, details=details)
+    else:
+        callback(status, progress, message)
+
+
+def _accepts_details(callback: Callable[..., None]) -> bool:
+    try:
+        parameters = inspect.signature(callback).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == 'details' or p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters)
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """
+    将秒数格式化为 时:分:秒
+
+    Args:
+        seconds: 秒数，为None时表示未知
+
+    Returns:
+        格式化后的字符串
+    """
+    if seconds is None:
+        return "未知"
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def read_io_counters() -> Optional[Tuple[int, int]]:
+    """
+    获取当前进程累计读取和写入的字节数（包括命中页缓存的读写）
+
+    Returns:
+        (读取字节数, 写入字节数)，无法获取时返回None
+    """
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        import psutil
+        counters = psutil.Process().io_counters()
+        return counters.read_bytes, counters.write_bytes
+    except (ImportError, AttributeError, OSError):
+        return None
+
+
+class StageStats:
+    """
+    单个阶段的计数和耗时
+
+    阶段的耗时为从该阶段取下一项所花的时间减去其中向上游取项的时间，
+    惰性迭代链中上游阶段的处理发生在下游阶段的 next 调用之内，相减后得到阶段自身的耗时；
+    流水线中向上游取项即等待队列，相减后同样只剩阶段自身的处理时间。
+    CPU 时间按执行阶段的线程统计，进程池中工作进程的 CPU 时间不计入。
+    """
+    def __init__(self, name: str, steps: List[int], setup_seconds: float = 0.0):
+        """
+        初始化阶段统计
+
+        Args:
+            name: 阶段名称
+            steps: 阶段包含的步骤序号
+            setup_seconds: 创建阶段动作实例的耗时
+        """
+        self.name = name
+        self.steps = steps
+        self.setup_seconds = setup_seconds
+        self.inputs = 0
+        self.outputs = 0
+        self.errors = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.upstream_wall = 0.0
+        self.upstream_cpu = 0.0
+        self.first_output_seconds: Optional[float] = None
+        self.inputs_at_first_output = 0
+        self.upstream_failed = False
+
+    @property
+    def self_wall(self) -> float:
+        """阶段自身的墙钟耗时"""
+        return max(0.0, self.wall - self.upstream_wall)
+
+    @property
+    def self_cpu(self) -> float:
+        """阶段自身的 CPU 耗时"""
+        return max(0.0, self.cpu - self.upstream_cpu)
+
+    def load_seconds(self) -> float:
+        """
+        估算模型加载等一次性开销：创建实例的耗时，加上产出第一项的耗时比之后平均每张输入多出的部分
+
+        Returns:
+            秒数
+        """
+        if self.first_output_seconds is None:
+            return self.setup_seconds
+        rest_inputs = self.inputs - self.inputs_at_first_output
+        per_input = (self.self_wall - self.first_output_seconds) / rest_inputs if rest_inputs > 0 else 0.0
+        extra = self.first_output_seconds - per_input * max(1, self.inputs_at_first_output)
+        return self.setup_seconds + max(0.0, extra)
+
+    def wrap(self, stage: Callable[[Iterator[Any]], Iterator[Any]]) -> Callable[[Iterator[Any]], Iterator[Any]]:
+        """
+        包装阶段处理函数，统计流入、流出和出错的图像数以及耗时
+
+        Args:
+            stage: 阶段处理函数，接收输入迭代器并返回输出迭代器
+
+        Returns:
+            包装后的阶段处理函数
+        """
+        def pull(items: Iterable[Any]) -> Iterator[Any]:
+            iterator = iter(items)
+            while True:
+                wall, cpu = time.perf_counter(), time.thread_time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                except BaseException:
+                    self.upstream_failed = True
+                    raise
+                finally:
+                    self.upstream_wall += time.perf_counter() - wall
+                    self.upstream_cpu += time.thread_time() - cpu
+                self.inputs += 1
+                yield item
+
+        def push(stream: Iterable[Any]) -> Iterator[Any]:
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                iterator = iter(stage(pull(stream)))
+            finally:
+                self.wall += time.perf_counter() - wall
+                self.cpu += time.thread_time() - cpu
+            while True:
+                wall, cpu = time.perf_counter(), time.thread_time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                except Exception:
+                    # 上游抛出的异常只记在出错的阶段上
+                    if not self.upstream_failed:
+                        self.errors += 1
+                    raise
+                finally:
+                    self.wall += time.perf_counter() - wall
+                    self.cpu += time.thread_time() - cpu
+                self.outputs += 1
+                if self.first_output_seconds is None:
+                    self.first_output_seconds = self.self_wall
+                    self.inputs_at_first_output = self.inputs
+                yield item
+
+        return push
+
+
+class ProgressTracker:
+    """
+    片段进度跟踪器
+
+    统计片段读取的输入图像数、各阶段流入和流出的图像数，按固定间隔采样吞吐量并做指数移动平均，
+    据此估算片段的剩余时间。作为上下文管理器使用时，后台线程按固定间隔通过进度回调上报，
+    即使步骤长时间没有产出也会继续上报（并给出无产出的时长），可以区分卡住和处理较慢。
+    消息中包含计数、吞吐量和预计剩余时间，结构化的详情通过回调的 details 参数传递。
+    计数器只做简单的累加，可以在流水线的多个线程中同时更新。
+
+    同时记录片段的资源占用：墙钟和进程 CPU 时间、读写字节数、常驻内存峰值（后台线程按间隔采样），
+    以及各阶段自身的耗时和计数，片段结束后由 profile 生成每个步骤的性能记录。
+    """
+    # 超过该时长没有读取或输出图像时，在进度消息中提示可能卡住
+    STALL_SECONDS = 30
+
+    def __init__(self, callback: Optional[Callable[..., None]], step_label: str, action_names: List[str],
+                 base: float, span: float, total: Optional[int] = None, done: int = 0,
+                 interval: float = 1.0, smoothing: float = 0.3, step_indices: Optional[List[int]] = None):
+        """
+        初始化进度跟踪器
+
+        Args:
+            callback: 进度回调，为None时只计数不上报
+            step_label: 步骤序号标签，例如 "3-6/10"
+            action_names: 片段包含的操作名称
+            base: 片段开始时的整体进度
+            span: 片段在整体进度中所占的比例
+            total: 片段输入图像总数，未知时为None（例如边下载边处理）
+            done: 继续执行时已完成的输入图像数
+            interval: 上报和采样吞吐量的最小间隔（秒）
+            smoothing: 吞吐量指数移动平均的平滑系数，越大越偏向最近的采样
+            step_indices: 片段包含的步骤序号，用于生成每个步骤的性能记录
+        """
+        self.callback = callback
+        self.step_label = step_label
+        self.action_names = action_names
+        self.base = base
+        self.span = span
+        self.total = total
+        self.done = done
+        self.outputs = 0
+        self.interval = interval
+        self.smoothing = smoothing
+        self.step_indices = step_indices if step_indices is not None else list(range(len(action_names)))
+        self.stages: List[StageStats] = []
+        self.setup_seconds = 0.0
+        self.queue_depths: List[Tuple[str, int, int]] = []
+        self.throughput: Optional[float] = None
+        self.start_time = time.time()
+        self.last_activity = self.start_time
+        self._sample_time = self.start_time
+        self._sample_done = done
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.peak_rss = current_rss()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._io_start = read_io_counters()
+        self.wall_seconds: Optional[float] = None
+        self.cpu_seconds: Optional[float] = None
+        self.io_bytes: Optional[Tuple[int, int]] = None
+
+    def __enter__(self) -> 'ProgressTracker':
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._io_start = read_io_counters()
+        self._sample_rss()
+        self._thread = threading.Thread(target=self._report_loop, name="progress-tracker", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample_rss()
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        self.cpu_seconds = time.process_time() - self._cpu_start
+        io_end = read_io_counters()
+        if io_end is not None and self._io_start is not None:
+            self.io_bytes = (io_end[0] - self._io_start[0], io_end[1] - self._io_start[1])
+
+    def _report_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample_rss()
+            if self.callback:
+                self.report()
+
+    def _sample_rss(self) -> None:
+        rss = current_rss()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def track_input(self, items: Iterable[Any]) -> Iterator[Any]:
+        """
+        统计片段读取的输入图像
+
+        Args:
+            items: 输入图像项序列
+
+        Yields:
+            原样输出的图像项
+        """
+        for item in items:
+            self.done += 1
+            self.last_activity = time.time()
+            yield item
+
+    def track_output(self, items: Iterable[Any]) -> Iterator[Any]:
+        """
+        统计片段最终输出的图像
+
+        Args:
+            items: 输出图像项序列
+
+        Yields:
+            原样输出的图像项
+        """
+        for item in items:
+            self.outputs += 1
+            self.last_activity = time.time()
+            yield item
+
+    def track_stage(self, name: str, stage: Callable[[Iterator[Any]], Iterator[Any]],
+                    steps: Optional[List[int]] = None,
+                    setup_seconds: float = 0.0) -> Callable[[Iterator[Any]], Iterator[Any]]:
+        """
+        包装一个阶段，统计流入和流出该阶段的图像数以及阶段自身的耗时
+
+        Args:
+            name: 阶段名称
+            stage: 阶段处理函数，接收输入迭代器并返回输出迭代器
+            steps: 阶段包含的步骤序号，未提供时按名称无法对应到步骤
+            setup_seconds: 创建阶段动作实例的耗时
+
+        Returns:
+            包装后的阶段处理函数
+        """
+        stats = StageStats(name, steps or [], setup_seconds)
+        self.stages.append(stats)
+        return stats.wrap(stage)
+
+    def add_setup_time(self, seconds: float) -> None:
+        """
+        记录不经过阶段的动作（目录级动作）创建实例的耗时
+
+        Args:
+            seconds: 秒数
+        """
+        self.setup_seconds += seconds
+
+    def set_queue_depths(self, depths: List[Tuple[str, int, int]]) -> None:
+        """
+        记录流水线各阶段的队列深度，可直接作为 StagePipeline 的 monitor 回调
+
+        Args:
+            depths: (阶段名称, 当前深度, 最大深度) 列表
+        """
+        self.queue_depths = depths
+
+    def item_done(self) -> None:
+        """
+        记录一张图像处理完成（用于不经过迭代链的目录级动作）
+        """
+        self.done += 1
+        self.outputs += 1
+        self.last_activity = time.time()
+
+    def report(self) -> None:
+        """
+        更新吞吐量并通过进度回调上报当前进度
+        """
+        self._update_throughput(time.time())
+        details = self.details()
+        report_progress(self.callback, "处理图像", details['progress'], self.message(details), details)
+
+    def _update_throughput(self, now: float) -> None:
+        elapsed = now - self._sample_time
+        if elapsed <= 0:
+            return
+        rate = (self.done - self._sample_done) / elapsed
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput = self.smoothing * rate + (1 - self.smoothing) * self.throughput
+        self._sample_time = now
+        self._sample_done = self.done
+
+    def eta(self) -> Optional[float]:
+        """
+        根据吞吐量的移动平均估算片段剩余时间，流水线队列中尚未处理完的图像也计入剩余数量
+
+        Returns:
+            剩余秒数，总数未知或尚无吞吐量时返回None
+        """
+        if self.total is None or not self.throughput:
+            return None
+        queued = sum(size for _, size, _ in self.queue_depths)
+        return (max(0, self.total - self.done) + queued) / self.throughput
+
+    def details(self) -> Dict[str, Any]:
+        """
+        生成结构化的进度详情
+
+        Returns:
+            进度详情字典
+        """
+        # 流水线中已读取但仍在队列里的图像不算作已完成
+        queued = sum(size for _, size, _ in self.queue_depths)
+        fraction = min(1.0, max(0, self.done - queued) / self.total) if self.total else 0.0
+        return {
+            'step': self.step_label,
+            'actions': list(self.action_names),
+            'items_done': self.done,
+            'items_total': self.total,
+            'items_out': self.outputs,
+            'throughput': round(self.throughput, 3) if self.throughput is not None else None,
+            'eta_seconds': self.eta(),
+            'elapsed_seconds': round(time.time() - self.start_time, 1),
+            'idle_seconds': round(time.time() - self.last_activity, 1),
+            'progress': self.base + self.span * fraction,
+            'stages': [{'name': stats.name, 'in': stats.inputs, 'out': stats.outputs,
+                        'seconds': round(stats.self_wall, 3)} for stats in self.stages],
+            'queues': [{'name': name, 'size': size, 'max': maxsize} for name, size, maxsize in self.queue_depths],
+        }
+
+    def message(self, details: Dict[str, Any]) -> str:
+        """
+        生成进度消息，例如 "执行步骤 2/3: 已读取 120/500 张 | 输出 118 张 | 8.3 张/秒 | 预计剩余 00:00:45"
+
+        Args:
+            details: 进度详情
+
+        Returns:
+            进度消息
+        """
+        total = details['items_total']
+        parts = [f"执行步骤 {self.step_label}: 已读取 {details['items_done']}/{total if total is not None else '?'} 张",
+                 f"输出 {details['items_out']} 张"]
+        if details['throughput'] is not None:
+            parts.append(f"{details['throughput']:.1f} 张/秒")
+        if total is not None:
+            parts.append(f"预计剩余 {format_duration(details['eta_seconds'])}")
+        if details['idle_seconds'] >= self.STALL_SECONDS:
+            parts.append(f"已 {format_duration(details['idle_seconds'])} 没有新的图像")
+        if details['queues']:
+            parts.append("队列深度: " + ", ".join(f"{q['name']} {q['size']}/{q['max']}" for q in details['queues']))
+        return " | ".join(parts)
+
+    def profile(self) -> Dict[int, Dict[str, Any]]:
+        """
+        生成片段中每个步骤的性能记录，应在片段结束（退出上下文）后调用
+
+        同一阶段包含多个步骤时（并行或缓存执行的连续步骤），这些步骤共享阶段的记录；
+        常驻内存峰值和读写字节数只能按片段统计，片段内的每个步骤都记录片段的数值。
+
+        Returns:
+            步骤序号到性能记录的字典
+        """
+        wall = self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self._wall_start
+        cpu = self.cpu_seconds if self.cpu_seconds is not None else time.process_time() - self._cpu_start
+        segment = {
+            'segment': self.step_label,
+            'segment_started': self.start_time,
+            'segment_wall_seconds': round(wall, 3),
+            'segment_cpu_seconds': round(cpu, 3),
+            'peak_rss_bytes': self.peak_rss,
+            'bytes_read': self.io_bytes[0] if self.io_bytes is not None else None,
+            'bytes_written': self.io_bytes[1] if self.io_bytes is not None else None,
+        }
+        profiles: Dict[int, Dict[str, Any]] = {}
+        for position, stats in enumerate(self.stages):
+            for index in stats.steps:
+                profiles[index] = dict(segment, **{
+                    'stage': stats.name,
+                    'stage_index': position,
+                    'stage_steps': len(stats.steps),
+                    'wall_seconds': round(stats.self_wall, 3),
+                    'cpu_seconds': round(stats.self_cpu, 3),
+                    'items_in': stats.inputs,
+                    'items_out': stats.outputs,
+                    'items_dropped': max(0, stats.inputs - stats.outputs - stats.errors),
+                    'items_errored': stats.errors,
+                    'model_load_seconds': round(stats.load_seconds(), 3),
+                })
+        # 目录级动作和没有对应阶段的步骤按整个片段记录
+        for index, name in zip(self.step_indices, self.action_names):
+            if index not in profiles:
+                profiles[index] = dict(segment, **{
+                    'stage': name,
+                    'stage_index': -1 - index,
+                    'stage_steps': 1,
+                    'wall_seconds': round(wall, 3),
+                    'cpu_seconds': round(cpu, 3),
+                    'items_in': self.done,
+                    'items_out': self.outputs,
+                    'items_dropped': max(0, self.done - self.outputs),
+                    'items_errored': 0,
+                    'model_load_seconds': round(self.setup_seconds, 3),
+                })
+        return profiles
@@ -0,0 +1,295 @@
+"""
+流式执行模块 - 将多个逐项处理的动作串联为一个惰性迭代器
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.tools.actions.parallel import init_worker, process_item
+from src.tools.cache.step_cache import StepCache, run_cached
+
+
+class CancelledError(Exception):
+    pass
+
+
+def cancellable(items: Iterable[Any], cancel_event: Optional[threading.Event]) -> Iterator[Any]:
+    """
+    在读取每个图像项之前检查取消事件，使正在运行的步骤在当前图像处理完成后即可停止
+
+    放在片段输入的最前端：下游请求下一项时才会检查，因此已产出的结果都已完整写入
+
+    Args:
+        items: 图像项序列
+        cancel_event: 取消事件，为None时不检查
+
+    Yields:
+        原样输出的图像项
+
+    Raises:
+        CancelledError: 取消事件已设置
+    """
+    iterator = iter(items)
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise CancelledError("任务被取消")
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield item
+
+
+def iter_action(action: Any, items: Iterable[Any]) -> Iterator[Any]:
+    """
+    使用单个动作处理图像项序列
+
+    Args:
+        action: waifuc 动作实例
+        items: 输入图像项序列
+
+    Yields:
+        处理后的图像项
+    """
+    yield from action.iter_from(items)
+
+
+def chain_actions(items: Iterable[Any], actions: List[Any]) -> Iterator[Any]:
+    """
+    将多个动作串联为惰性迭代链，图像项逐个流经所有动作，中间结果不落盘
+
+    Args:
+        items: 输入图像项序列
+        actions: 按执行顺序排列的 waifuc 动作实例列表
+
+    Returns:
+        最后一个动作的输出迭代器
+    """
+    stream = iter(items)
+    for action in actions:
+        stream = iter_action(action, stream)
+    return stream
+
+
+def count_items(items: Iterable[Any], on_item: Callable[[int], None]) -> Iterator[Any]:
+    """
+    在图像项流经时计数
+
+    Args:
+        items: 图像项序列
+        on_item: 每经过一项时以累计数量调用的回调
+
+    Yields:
+        原样输出的图像项
+    """
+    for count, item in enumerate(items, 1):
+        on_item(count)
+        yield item
+
+
+def cached_chain(items: Iterable[Any], actions: List[Any], signatures: List[str],
+                 cache: StepCache) -> Iterator[Any]:
+    """
+    逐项执行一组无状态动作，复用步骤缓存中已计算的最长前缀
+
+    Args:
+        items: 输入图像项序列
+        actions: 按执行顺序排列的动作实例列表
+        signatures: 各步骤的前缀签名
+        cache: 步骤缓存
+
+    Yields:
+        处理后的图像项
+    """
+    for item in items:
+        yield from run_cached(item, actions, signatures, cache)
+
+
+def parallel_chain(items: Iterable[Any], step_specs: List[Tuple[str, Dict[str, Any]]],
+                   workers: int, ordered: bool = True,
+                   cache_config: Optional[Tuple[str, int]] = None) -> Iterator[Any]:
+    """
+    将一组无状态动作分片到进程池中并行执行
+
+    每个工作进程只在启动时创建一次动作实例（模型也只加载一次），图像项按需提交，
+    同时在途的任务数量有上限，避免一次性把全部图像读入内存。
+
+    Args:
+        items: 输入图像项序列
+        step_specs: (操作名称, 操作参数) 列表，按执行顺序排列
+        workers: 工作进程数量
+        ordered: 是否保持输入顺序输出
+        cache_config: (缓存目录, 大小上限)，提供时工作进程使用步骤缓存
+
+    Yields:
+        处理后的图像项
+    """
+    max_pending = workers * 4
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(step_specs, cache_config)) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(process_item, item))
+                while len(pending) >= max_pending:
+                    yield from _collect_results(pending, ordered)
+            while pending:
+                yield from _collect_results(pending, ordered)
+        finally:
+            # 取消或出错时丢弃尚未开始的任务，不等待整个队列处理完
+            for future in pending:
+                future.cancel()
+
+
+def _collect_results(pending: deque, ordered: bool) -> Iterator[Any]:
+    """
+    取出已完成任务的结果：有序模式按提交顺序取最早的任务，无序模式取任意已完成的任务
+    """
+    if ordered:
+        yield from pending.popleft().result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield from future.result()
+
+
+# 流水线队列结束标记
+_END = object()
+
+
+class _StageFailure:
+    """
+    阶段异常标记，沿队列向下游传递，最终在消费线程中重新抛出
+    """
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _PipelineStopped(Exception):
+    """
+    流水线已停止（消费端结束或出错），用于让阻塞中的阶段线程退出
+    """
+    pass
+
+
+class StagePipeline:
+    """
+    分阶段流水线，每个阶段在独立线程中运行，阶段之间通过有界队列传递图像项
+
+    第一个阶段负责从输入序列读取（解码、下载），最后一个队列由调用线程消费（编码、保存），
+    中间每个阶段执行一个步骤，因此解码、模型推理和编码可以同时进行。
+    队列已满时上游阶段会阻塞等待（背压），队列长度上限决定了内存占用上限。
+    """
+    def __init__(self, items: Iterable[Any],
+                 stages: List[Tuple[str, Callable[[Iterator[Any]], Iterator[Any]]]],
+                 queue_size: int = 8,
+                 monitor: Optional[Callable[[List[Tuple[str, int, int]]], None]] = None,
+                 report_interval: float = 1.0,
+                 cancel_event: Optional[threading.Event] = None):
+        """
+        初始化流水线
+
+        Args:
+            items: 输入图像项序列
+            stages: (阶段名称, 处理函数) 列表，处理函数接收输入迭代器并返回输出迭代器
+            queue_size: 每个队列的最大长度
+            monitor: 队列深度回调，参数为 (阶段名称, 当前深度, 最大深度) 列表
+            report_interval: 调用 monitor 的最小间隔（秒）
+            cancel_event: 取消事件，设置后消费端不再等待队列中剩余的图像项
+        """
+        self.items = items
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.monitor = monitor
+        self.report_interval = report_interval
+        self.cancel_event = cancel_event
+        self.names = ["读取"] + [name for name, _ in stages]
+        self.queues = [queue.Queue(maxsize=self.queue_size) for _ in self.names]
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def depths(self) -> List[Tuple[str, int, int]]:
+        """
+        获取各阶段输出队列的当前深度
+
+        Returns:
+            (阶段名称, 当前深度, 最大深度) 列表
+        """
+        return [(name, q.qsize(), q.maxsize) for name, q in zip(self.names, self.queues)]
+
+    def __iter__(self) -> Iterator[Any]:
+        threads = [threading.Thread(target=self._run_stage, args=(lambda _: iter(self.items), None, self.queues[0]),
+                                    name="pipeline-读取", daemon=True)]
+        for k, (name, fn) in enumerate(self.stages):
+            threads.append(threading.Thread(target=self._run_stage, args=(fn, self.queues[k], self.queues[k + 1]),
+                                            name=f"pipeline-{name}", daemon=True))
+        self._threads = threads
+        for thread in threads:
+            thread.start()
+
+        last_report = time.time()
+        try:
+            for item in self._drain(self.queues[-1], check_cancel=True):
+                yield item
+                if self.monitor and time.time() - last_report >= self.report_interval:
+                    self.monitor(self.depths())
+                    last_report = time.time()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """
+        停止流水线并等待所有阶段线程退出
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run_stage(self, fn: Callable[[Iterator[Any]], Iterator[Any]],
+                   inbox: Optional[queue.Queue], outbox: queue.Queue) -> None:
+        """
+        阶段线程主体：处理上游队列中的图像项并放入下游队列，异常会作为标记传给下游
+        """
+        try:
+            for item in fn(self._drain(inbox) if inbox is not None else None):
+                self._put(outbox, item)
+            self._put(outbox, _END)
+        except _PipelineStopped:
+            pass
+        except BaseException as e:
+            try:
+                self._put(outbox, _StageFailure(e))
+            except _PipelineStopped:
+                pass
+
+    def _put(self, q: queue.Queue, item: Any) -> None:
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    raise _PipelineStopped()
+
+    def _drain(self, q: queue.Queue, check_cancel: bool = False) -> Iterator[Any]:
+        while True:
+            # 停止后不再处理队列中剩余的图像项，取消时消费端立即结束而不等待上游排空
+            if check_cancel and self.cancel_event is not None and self.cancel_event.is_set():
+                raise CancelledError("任务被取消")
+            if self._stop.is_set():
+                raise _PipelineStopped()
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise _PipelineStopped()
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _StageFailure):
+                raise item.error
+            yield item
@@ -1,4 +1,6 @@
+import io
 import os
+import random
 import logging
 import tempfile
 import shutil
@@ -8,28 +10,70 @@ from typing import Any, Dict, List, Optional, Tuple, Union, Callable
 from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import threading
+from itertools import groupby, islice
 
 from .workflow import Workflow, WorkflowStep
 from .execution_history import ExecutionRecord, history_manager
-from src.tools.actions.action_registry import registry as action_registry
+from .config_manager import config_manager
+from .execution_plan import (
+    ExecutionSegment, build_execution_plan, is_barrier_action, is_directory_action, is_poolable_action,
+    split_parallel_runs, requires_order, supports_item_journal
+)
+from .estimator import StepSample, extrapolate
+from .workflow_prefix import build_prefix_tree
+from .item_journal import ItemJournal
+from .progress import ProgressTracker, format_duration, report_progress
+from .streaming import (
+    CancelledError, StagePipeline, cached_chain, cancellable, chain_actions, count_items, parallel_chain
+)
+from .output_commit import commit_outputs, create_scratch_dir
+from .intermediate_store import (
+    IntermediateStore, create_intermediate_store, open_intermediate_store, resolve_codec
+)
 from src.tools.sources.source_registry import registry as source_registry
-from src.tools.actions.waifuc_actions import WaifucActionWrapper
-from waifuc.source import LocalSource
+from src.tools.sources.downloader import ConcurrentDownloader
+from src.tools.actions.parallel import create_action_instance, create_batch_action, supports_batch
+from src.tools.actions.action_pool import ActionLease, ActionPool, action_pool
+from src.tools.cache.step_cache import StepCache, prefix_signatures
+from src.tools.cache.tag_cache import configure_tag_cache
+from src.tools.cache.detection_cache import configure_detection_cache
+from src.tools.cache.embedding_store import (
+    clear_embedding_stores, configure_embedding_store, embedding_store_usage
+)
+from src.tools.cache.hash_set import commit_hash_sets, configure_hash_sets
 
 # 新增：定义全局 logger
 logger = logging.getLogger(__name__)
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')
+
+
+def clean_metadata(directory):
+    try:
+        for filename in os.listdir(directory):
+            if filename.startswith('.') and filename.endswith('_meta.json'):
+                os.remove(os.path.join(directory, filename))
+    except Exception as e:
+        logger.warning(f"清理元数据失败: {str(e)}")
+
+
 class WorkflowEngine:
     def __init__(self, max_workers: int = 1):
         self.max_workers = max_workers
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
         self._running_tasks = {}
+        self._step_cache = None
+        self._step_cache_lock = threading.Lock()
         os.makedirs("logs", exist_ok=True)
 
     def execute_workflow(self, workflow: Workflow,
                        source_type: str, source_params: Dict[str, Any],
                        output_directory: str,
-                       progress_callback: Callable[[str, float, str], None] = None) -> ExecutionRecord:
+                       progress_callback: Callable[[str, float, str], None] = None,
+                       execution_mode: str = None,
+                       process_workers: int = None,
+                       queue_size: int = None) -> ExecutionRecord:
+        options = self._build_options(execution_mode, process_workers, queue_size)
         record = history_manager.create_record(
             workflow_id=workflow.id,
             workflow_name=workflow.name,
@@ -37,11 +81,131 @@ class WorkflowEngine:
             source_params=source_params,
             output_directory=output_directory
         )
+        record.workflow_snapshot = workflow.to_dict()
+        record.options = dict(options)
         cancel_event = threading.Event()
         future = self.executor.submit(
             self._execute_workflow_internal,
             workflow, source_type, source_params, output_directory,
-            record, progress_callback, cancel_event
+            record, progress_callback, cancel_event, options
+        )
+        self._running_tasks[record.id] = (future, record, cancel_event)
+        return record
+
+    @staticmethod
+    def _build_options(execution_mode: str = None, process_workers: int = None,
+                       queue_size: int = None) -> Dict[str, Any]:
+        """
+        合并调用参数和配置中的默认值，生成执行选项
+        """
+        return {
+            'execution_mode': execution_mode or config_manager.get('engine.execution_mode', 'materialize'),
+            'process_workers': int(process_workers if process_workers is not None
+                                   else config_manager.get('engine.process_workers', 0) or 0),
+            'queue_size': int(queue_size or config_manager.get('engine.queue_size', 8) or 8),
+            'intermediate_codec': config_manager.get('engine.intermediate_codec', 'auto') or 'auto',
+            'commit_workers': int(config_manager.get('engine.commit_workers', 8) or 8),
+            'step_cache': bool(config_manager.get('cache.step_cache_enabled', False)),
+            'tag_cache': bool(config_manager.get('cache.tag_cache_enabled', True)),
+            'detection_cache': bool(config_manager.get('cache.detection_cache_enabled', True)),
+            'embedding_store': bool(config_manager.get('cache.embedding_store_enabled', True)),
+            'batch_size': max(1, int(config_manager.get('engine.batch_size', 8) or 1)),
+            'action_pool': bool(config_manager.get('engine.action_pool_enabled', True)),
+        }
+
+    def execute_workflows(self, workflows: List[Workflow],
+                          source_type: str, source_params: Dict[str, Any],
+                          output_directory: str,
+                          progress_callback: Callable[[str, float, str], None] = None,
+                          execution_mode: str = None,
+                          process_workers: int = None,
+                          queue_size: int = None) -> List[ExecutionRecord]:
+        """
+        对同一图像来源运行多个工作流：各工作流共有的前缀步骤只执行一次，
+        结果再分发给每个工作流执行剩余的步骤
+
+        每个工作流有独立的执行记录，输出到输出目录下以工作流名称命名的子目录。
+
+        Args:
+            workflows: 工作流列表
+            source_type: 图像来源类型
+            source_params: 图像来源参数
+            output_directory: 输出目录
+            progress_callback: 进度回调
+            execution_mode: 执行模式
+            process_workers: 无状态步骤并行进程数
+            queue_size: 流水线队列长度
+
+        Returns:
+            各工作流的执行记录
+        """
+        unique = list({workflow.id: workflow for workflow in workflows}.values())
+        if not unique:
+            raise ValueError("没有要执行的工作流")
+        options = self._build_options(execution_mode, process_workers, queue_size)
+        records = []
+        used_names = set()
+        for workflow in unique:
+            name = "".join('_' if c in '<>:"/\\|?*' else c for c in workflow.name).strip() or workflow.id
+            if name in used_names:
+                name = f"{name}_{workflow.id[:8]}"
+            used_names.add(name)
+            record = history_manager.create_record(
+                workflow_id=workflow.id,
+                workflow_name=workflow.name,
+                source_type=source_type,
+                source_params=source_params,
+                output_directory=os.path.join(output_directory, name)
+            )
+            record.workflow_snapshot = workflow.to_dict()
+            record.options = dict(options)
+            records.append(record)
+
+        cancel_event = threading.Event()
+        future = self.executor.submit(
+            self._execute_workflows_internal,
+            unique, source_type, source_params, output_directory,
+            records, progress_callback, cancel_event, options
+        )
+        for record in records:
+            self._running_tasks[record.id] = (future, record, cancel_event)
+        return records
+
+    def resume_workflow(self, record_id: str,
+                        progress_callback: Callable[[str, float, str], None] = None) -> ExecutionRecord:
+        """
+        从最后一个检查点继续执行失败或取消的任务，使用记录中保存的工作流快照和执行选项
+
+        Args:
+            record_id: 执行记录ID
+            progress_callback: 进度回调
+
+        Returns:
+            继续执行的执行记录（与原记录相同）
+        """
+        record = history_manager.get_record(record_id)
+        if not record:
+            raise ValueError(f"执行记录不存在: {record_id}")
+        if record_id in self._running_tasks:
+            raise ValueError("任务正在运行中")
+        if not record.can_resume():
+            raise ValueError("该记录无法继续执行：任务已完成或工作目录已被删除")
+        if record.options.get('start_step') and record.last_checkpoint() is None:
+            raise ValueError("该记录无法继续执行：共享前缀的结果已被删除")
+
+        workflow = Workflow.from_dict(record.workflow_snapshot)
+        options = dict(record.options)
+        record.status = "running"
+        record.end_time = None
+        record.error_message = None
+        record.resume_count += 1
+        history_manager.save_record(record)
+
+        cancel_event = threading.Event()
+        future = self.executor.submit(
+            self._execute_workflow_internal,
+            workflow, record.source_type, record.source_params, record.output_directory,
+            record, progress_callback, cancel_event, options, True
         )
         self._running_tasks[record.id] = (future, record, cancel_event)
         return record
@@ -50,27 +214,33 @@ class WorkflowEngine:
                                   source_type: str, source_params: Dict[str, Any],
                                   output_directory: str, record: ExecutionRecord,
                                   progress_callback: Callable[[str, float, str], None] = None,
-                                  cancel_event: threading.Event = None) -> None:
-        class CancelledError(Exception):
-            pass
-
-        def clean_metadata(directory):
-            try:
-                for filename in os.listdir(directory):
-                    if filename.startswith('.') and filename.endswith('_meta.json'):
-                        os.remove(os.path.join(directory, filename))
-            except Exception as e:
-                logger.warning(f"清理元数据失败: {str(e)}")
-
+                                  cancel_event: threading.Event = None,
+                                  options: Dict[str, Any] = None, resume: bool = False) -> None:
+        options = options or {}
+        execution_mode = options.get('execution_mode', 'materialize')
         try:
             os.makedirs(output_directory, exist_ok=True)
-            temp_dir = tempfile.mkdtemp()
+            # 工作目录在失败或取消后保留，记录在执行记录中以便继续执行
+            if resume and record.run_dir and os.path.isdir(record.run_dir):
+                temp_dir = record.run_dir
+                checkpoint = record.last_checkpoint()
+            else:
+                temp_dir = create_scratch_dir(output_directory, config_manager.get('general.temp_directory'),
+                                              exclude=[source_params.get('directory')])
+                # 多工作流运行时，共享前缀的结果以位置为 -1 的检查点预先记录
+                record.checkpoints = [c for c in record.checkpoints if c['position'] < 0]
+                checkpoint = record.last_checkpoint()
+            record.run_dir = temp_dir
+            history_manager.save_record(record)
+            # 本次保留的图像的哈希先写入工作目录，运行成功完成后才合并到哈希集合
+            options = {**options, 'hash_set_pending': os.path.join(temp_dir, 'hash_sets')}
             temp_input_dir = os.path.join(temp_dir, 'input')
             os.makedirs(temp_input_dir, exist_ok=True)
+            downloader = None
 
             try:
                 log_file = os.path.join("logs", f"{record.id}_log.txt")
-                file_handler = logging.FileHandler(log_file, 'w', 'utf-8')
+                file_handler = logging.FileHandler(log_file, 'a' if resume else 'w', 'utf-8')
                 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
                 task_logger = logging.getLogger(f"workflow.{record.id}")
                 task_logger.setLevel(logging.INFO)
@@ -78,165 +248,225 @@ class WorkflowEngine:
 
                 if progress_callback:
                     progress_callback("获取图像", 0.0, "准备图像来源...")
+                if resume:
+                    resume_from = checkpoint['last_step'] + 2 if checkpoint else 1
+                    task_logger.info(f"第 {record.resume_count} 次继续执行，从步骤 {resume_from} 开始")
+                    record.add_step_log("resume", workflow.name, "started",
+                                        f"从步骤 {resume_from}/{len(workflow.steps)} 继续执行")
                 task_logger.info(f"开始执行工作流: {workflow.name}")
                 task_logger.info(f"图像来源: {source_type}")
                 task_logger.info(f"输出目录: {output_directory}")
+                task_logger.info(f"执行模式: {execution_mode}")
+                options['intermediate_codec'] = resolve_codec(options.get('intermediate_codec', 'auto'))
+                record.options['intermediate_codec'] = options['intermediate_codec']
+                task_logger.info(f"中间编码格式: {options['intermediate_codec']}")
+                if options.get('process_workers', 0) > 1:
+                    task_logger.info(f"无状态步骤并行进程数: {options['process_workers']}")
 
                 if cancel_event and cancel_event.is_set():
                     raise CancelledError("任务被取消")
 
-                try:
-                    source = source_registry.create_source(source_type, **source_params)
-                    record.add_step_log("source", source_type, "started", "创建图像来源")
-                    task_logger.info("从来源获取图像...")
-                    if progress_callback:
-                        progress_callback("获取图像", 0.1, "正在获取图像...")
-                    if source_type == "LocalSource":
-                        input_dir = source_params.get("directory", "")
-                        if not os.path.exists(input_dir):
-                            raise FileNotFoundError(f"输入目录不存在: {input_dir}")
-                        total_files = sum(1 for f in os.listdir(input_dir)
-                                        if os.path.isfile(os.path.join(input_dir, f)) and
-                                        f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')))
-                        record.total_images = total_files
-                        task_logger.info(f"发现 {total_files} 个图像文件")
+                total_steps = len(workflow.steps)
+                start_step = options.get('start_step', 0)
+                plan = build_execution_plan(workflow.steps, execution_mode, start_step)
+                # 网络来源在第一个片段可以逐项处理时直接边下载边处理，不再等待全部下载完成
+                source_items = None
+
+                if checkpoint is not None:
+                    input_dir = checkpoint['output_dir']
+                    if checkpoint['position'] < 0:
+                        task_logger.info(f"步骤 1-{checkpoint['last_step']+1} 与其他工作流共享，"
+                                         f"使用共享前缀的结果: {input_dir}")
                     else:
-                        task_logger.info("开始下载图像...")
+                        task_logger.info(f"从检查点继续执行: 步骤 1-{checkpoint['last_step']+1} 已完成，"
+                                         f"跳过图像获取")
+                else:
+                    try:
+                        source = source_registry.create_source(source_type, **source_params)
+                        if source_type != "LocalSource":
+                            downloader = self._create_downloader(source)
+                        record.add_step_log("source", source_type, "started", "创建图像来源")
+                        task_logger.info("从来源获取图像...")
                         if progress_callback:
-                            progress_callback("获取图像", 0.2, "下载图像...")
-                        from waifuc.export import SaveExporter
-                        source.source.export(SaveExporter(temp_input_dir))
-                        total_files = sum(1 for f in os.listdir(temp_input_dir)
-                                        if os.path.isfile(os.path.join(temp_input_dir, f)) and
-                                        f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')))
-                        record.total_images = total_files
-                        task_logger.info(f"已下载 {total_files} 个图像文件")
-                        input_dir = temp_input_dir
-                    record.add_step_log("source", source_type, "completed",
-                                        f"成功获取 {record.total_images} 个图像文件")
-                except Exception as e:
-                    error_msg = f"获取图像失败: {str(e)}"
-                    task_logger.error(error_msg)
-                    record.add_step_log("source", source_type, "failed", error_msg)
-                    record.fail(error_msg)
-                    if progress_callback:
-                        progress_callback("错误", 0, error_msg)
-                    return
+                            progress_callback("获取图像", 0.1, "正在获取图像...")
+                        if source_type == "LocalSource":
+                            input_dir = source_params.get("directory", "")
+                            if not os.path.exists(input_dir):
+                                raise FileNotFoundError(f"输入目录不存在: {input_dir}")
+                            total_files = sum(1 for f in os.listdir(input_dir)
+                                            if os.path.isfile(os.path.join(input_dir, f)) and
+                                            f.lower().endswith(IMAGE_EXTENSIONS))
+                            record.total_images = total_files
+                            task_logger.info(f"发现 {total_files} 个图像文件")
+                        elif plan and plan[0].kind == "stream":
+                            task_logger.info("边下载边处理图像...")
+                            if progress_callback:
+                                progress_callback("获取图像", 0.2, "边下载边处理图像...")
+                            record.total_images = 0
+                            source_items = count_items(
+                                source.iter_items(downloader), lambda count: setattr(record, 'total_images', count))
+                            input_dir = temp_input_dir
+                        else:
+                            task_logger.info("开始下载图像...")
+                            if progress_callback:
+                                progress_callback("获取图像", 0.2, "下载图像...")
+                            from waifuc.export import SaveExporter
+                            SaveExporter(temp_input_dir).export_from(cancellable(source.iter_items(downloader), cancel_event))
+                            total_files = sum(1 for f in os.listdir(temp_input_dir)
+                                            if os.path.isfile(os.path.join(temp_input_dir, f)) and
+                                            f.lower().endswith(IMAGE_EXTENSIONS))
+                            record.total_images = total_files
+                            task_logger.info(f"已下载 {total_files} 个图像文件")
+                            input_dir = temp_input_dir
+                        if source_items is None:
+                            record.add_step_log("source", source_type, "completed",
+                                                f"成功获取 {record.total_images} 个图像文件")
+                    except Exception as e:
+                        error_msg = f"获取图像失败: {str(e)}"
+                        task_logger.error(error_msg)
+                        record.add_step_log("source", source_type, "failed", error_msg)
+                        record.fail(error_msg)
+                        if progress_callback:
+                            progress_callback("错误", 0, error_msg)
+                        return
 
                 if cancel_event and cancel_event.is_set():
                     raise CancelledError("任务被取消")
 
                 current_dir = input_dir
                 success_count = 0
-                failed_count = 0
+                failed_count = checkpoint['failed_steps'] if checkpoint else 0
+                start_position = checkpoint['position'] + 1 if checkpoint else 0
+                parallel = options.get('process_workers', 0) > 1
+                task_logger.info(f"执行计划: {len(plan)} 个片段 {plan}")
 
-                for i, step in enumerate(workflow.steps):
-                    step_progress_base = 0.3 + (i / len(workflow.steps)) * 0.6
-                    unique_id = uuid.uuid4().hex[:8]
-                    step_output_dir = os.path.join(temp_dir, f"step_{i+1}_{unique_id}")
+                for position, segment in enumerate(plan):
+                    if position < start_position:
+                        continue
+                    i = segment.first_index
+                    step_label = self._format_step_label(segment, total_steps)
+                    step_progress_base = 0.3 + (i / total_steps) * 0.6
+                    # 输出目录名固定，继续执行时可以找到上次未完成的输出
+                    step_output_dir = os.path.join(temp_dir, f"step_{segment.last_index+1}")
+                    journal = None
+                    batched = not parallel and options.get('batch_size', 1) > 1 and \
+                        any(supports_batch(step.action_name) for _, step in segment.steps)
+                    if supports_item_journal(segment, execution_mode, parallel, batched):
+                        journal = ItemJournal(os.path.join(temp_dir, f"journal_step_{segment.last_index+1}.txt"))
+                    resuming_segment = resume and journal is not None and os.path.isdir(step_output_dir)
+                    if not resuming_segment:
+                        shutil.rmtree(step_output_dir, ignore_errors=True)
+                        if journal is not None:
+                            journal.reset()
+                    elif len(journal):
+                        task_logger.info(f"步骤 {step_label} 已处理 {len(journal)} 张输入图像，继续处理剩余图像")
                     os.makedirs(step_output_dir, exist_ok=True)
-                    task_logger.info(f"执行步骤 {i+1}/{len(workflow.steps)}: {step.action_name}")
-                    task_logger.info(f"步骤 {i+1} 输入目录: {current_dir}")
-                    task_logger.info(f"步骤 {i+1} 输出目录: {step_output_dir}")
-                    record.add_step_log(step.id, step.action_name, "started",
-                                       f"开始执行步骤 {i+1}/{len(workflow.steps)}")
+                    task_logger.info(f"执行步骤 {step_label}: {' -> '.join(segment.action_names)}")
+                    segment_input = current_dir
+                    if position == 0 and source_items is not None:
+                        segment_input = source_items
+                        task_logger.info(f"步骤 {step_label} 输入: {source_type}（边下载边处理）")
+                    else:
+                        task_logger.info(f"步骤 {step_label} 输入目录: {current_dir}")
+                    task_logger.info(f"步骤 {step_label} 输出目录: {step_output_dir}")
+                    for index, step in segment.steps:
+                        record.add_step_log(step.id, step.action_name, "started",
+                                           f"开始执行步骤 {index+1}/{total_steps}")
                     if progress_callback:
                         progress_callback("处理图像", step_progress_base,
-                                         f"执行步骤 {i+1}/{len(workflow.steps)}: {step.action_name}")
+                                         f"执行步骤 {step_label}: {' -> '.join(segment.action_names)}")
 
                     if cancel_event and cancel_event.is_set():
                         raise CancelledError("任务被取消")
 
+                    tracker = None
                     try:
-                        action = action_registry.create_action(step.action_name, **step.params)
-                        if isinstance(action, WaifucActionWrapper) and hasattr(action, 'action'):
-                            action_instance = action.action
-                        else:
-                            action_instance = action
-
-                        if step.action_name == "PreSortImagesAction":
-                            for result in action_instance.iter(current_dir, step_output_dir):
-                                if cancel_event and cancel_event.is_set():
-                                    raise CancelledError("任务被取消")
-                                if 'item' in result:
-                                    item = result['item']
-                                    ratio = item.meta.get('ratio', 'unknown')
-                                    ratio_dir = os.path.join(step_output_dir, ratio.replace(':', '_'))
-                                    os.makedirs(ratio_dir, exist_ok=True)
-                                    unique_filename = f"{uuid.uuid4().hex[:8]}.png"
-                                    output_path = os.path.join(ratio_dir, unique_filename)
-                                    item.image.save(output_path, format='PNG')
-                                elif 'counts' in result:
-                                    task_logger.info(f"PreSortImagesAction 统计: {result['counts']}")
-
-                        elif step.action_name == "EnhancedImageProcessAction":
-                            for result in action_instance.iter(current_dir, step_output_dir):
-                                if cancel_event and cancel_event.is_set():
-                                    raise CancelledError("任务被取消")
-                                if 'item' in result:
-                                    item = result['item']
-                                    ratio = item.meta.get('ratio', 'unknown')
-                                    ratio_dir = os.path.join(step_output_dir, ratio.replace(':', '_'))
-                                    os.makedirs(ratio_dir, exist_ok=True)
-                                    unique_filename = f"{uuid.uuid4().hex[:8]}.png"
-                                    output_path = os.path.join(ratio_dir, unique_filename)
-                                    item.image.save(output_path, format='PNG')
-                                elif 'results' in result:
-                                    for ratio, info in result['results'].items():
-                                        task_logger.info(f"{ratio} 图像: {info['count']} 张")
+                        spill = self._should_spill_to_store(plan, position)
+                        tracker = ProgressTracker(progress_callback, step_label, segment.action_names,
+                                                  step_progress_base, len(segment.steps) / total_steps * 0.6,
+                                                  self._count_inputs(segment_input),
+                                                  len(journal) if resuming_segment else 0,
+                                                  step_indices=[index for index, _ in segment.steps])
+                        with tracker:
+                            self._run_segment(segment, segment_input, step_output_dir, task_logger,
+                                              cancel_event, spill, workflow.steps, options, tracker,
+                                              journal, resuming_segment)
+                        elapsed = max(time.time() - tracker.start_time, 1e-6)
+                        task_logger.info(f"步骤 {step_label} 读取 {tracker.done} 张图像，输出 {tracker.outputs} 张，"
+                                         f"耗时 {format_duration(elapsed)}，平均 {tracker.done / elapsed:.2f} 张/秒")
+                        if segment_input is source_items:
+                            task_logger.info(f"已下载 {record.total_images} 个图像文件")
+                            record.add_step_log("source", source_type, "completed",
+                                                f"成功获取 {record.total_images} 个图像文件")
 
+                        if spill:
+                            output_files = range(len(open_intermediate_store(step_output_dir)))
                         else:
-                            source = LocalSource(current_dir)
-                            processed = source.attach(action_instance)
-                            from waifuc.export import SaveExporter
-                            processed.export(SaveExporter(step_output_dir))
-                            clean_metadata(step_output_dir)
-
-                        output_files = [f for f in os.listdir(step_output_dir)
-                                      if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff'))]
+                            output_files = [f for f in os.listdir(step_output_dir)
+                                          if f.lower().endswith(IMAGE_EXTENSIONS)]
                         if not output_files:
-                            task_logger.warning(f"步骤 {step.action_name} 未生成任何图像")
-                        record.add_step_log(step.id, step.action_name, "completed",
-                                           f"步骤 {i+1}/{len(workflow.steps)} 成功完成，生成 {len(output_files)} 张图像")
-                        if progress_callback:
-                            progress_callback("处理图像", step_progress_base + 0.6/len(workflow.steps),
-                                            f"步骤 {i+1}/{len(workflow.steps)} 完成")
+                            task_logger.warning(f"步骤 {step_label} 未生成任何图像")
+                        profiles = tracker.profile()
+                        for index, step in segment.steps:
+                            record.add_step_log(step.id, step.action_name, "completed",
+                                               f"步骤 {index+1}/{total_steps} 成功完成" +
+                                               (f"，生成 {len(output_files)} 张图像"
+                                                if index == segment.last_index else ""),
+                                               {'profile': profiles.get(index)})
+                        report_progress(progress_callback, "处理图像",
+                                        0.3 + ((segment.last_index + 1) / total_steps) * 0.6,
+                                        f"步骤 {step_label} 完成", tracker.details())
+                        record.add_checkpoint(position, [step.id for _, step in segment.steps],
+                                              segment.last_index, step_output_dir,
+                                              record.total_images, failed_count)
+                        history_manager.save_record(record)
+                        # 上一片段的输出已不再需要（用户的输入目录除外）
+                        if os.path.dirname(os.path.abspath(current_dir)) == os.path.abspath(temp_dir):
+                            shutil.rmtree(current_dir, ignore_errors=True)
                         current_dir = step_output_dir
 
+                    except CancelledError:
+                        if journal is not None:
+                            task_logger.info(f"步骤 {step_label} 已处理的 {len(journal)} 张输入图像结果已保留，"
+                                             f"继续执行时跳过")
+                        raise
+
                     except Exception as e:
-                        error_msg = f"步骤 {i+1} ({step.action_name}) 执行失败: {str(e)}"
+                        error_msg = f"步骤 {step_label} ({' -> '.join(segment.action_names)}) 执行失败: {str(e)}"
                         task_logger.error(error_msg)
-                        record.add_step_log(step.id, step.action_name, "failed", error_msg)
+                        profiles = tracker.profile() if tracker is not None else {}
+                        for index, step in segment.steps:
+                            record.add_step_log(step.id, step.action_name, "failed", error_msg,
+                                                {'profile': profiles.get(index)})
                         failed_count += 1
-                        if i == 0:
+                        if i == start_step:
                             record.fail(error_msg)
                             if progress_callback:
                                 progress_callback("错误", 0, error_msg)
                             return
-                        current_dir = os.path.join(temp_dir, f"step_{i}")
+                        # 失败的片段不产生输出，后续片段继续使用上一片段的结果
 
                 if cancel_event and cancel_event.is_set():
                     raise CancelledError("任务被取消")
 
                 if workflow.steps:
-                    output_files_count = 0
-                    for root, dirs, files in os.walk(current_dir):
-                        if cancel_event and cancel_event.is_set():
-                            raise CancelledError("任务被取消")
-                        for filename in files:
-                            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')):
-                                base, ext = os.path.splitext(filename)
-                                unique_filename = f"{base}_{uuid.uuid4().hex[:8]}{ext}"
-                                src_path = os.path.join(root, filename)
-                                dst_path = os.path.join(output_directory, unique_filename)
-                                try:
-                                    shutil.copy2(src_path, dst_path)
-                                    output_files_count += 1
-                                except Exception as e:
-                                    task_logger.error(f"复制最终文件失败: {src_path} -> {dst_path}, 错误: {str(e)}")
-                    task_logger.info(f"已将 {output_files_count} 个文件复制到 {output_directory}")
+                    if IntermediateStore.is_store(current_dir):
+                        # 最后的片段失败时，上一片段的结果仍在中间存储中，需先导出为图像文件
+                        final_dir = os.path.join(temp_dir, f"final_{uuid.uuid4().hex[:8]}")
+                        from waifuc.export import SaveExporter
+                        SaveExporter(final_dir).export_from(cancellable(open_intermediate_store(current_dir), cancel_event))
+                        current_dir = final_dir
+                    # 只有本次运行工作目录中的结果可以移走，共享前缀的结果需要保留给其他工作流
+                    owned = os.path.dirname(os.path.abspath(current_dir)) == os.path.abspath(temp_dir)
+                    output_files_count = commit_outputs(current_dir, output_directory, IMAGE_EXTENSIONS,
+                                                        options.get('commit_workers', 8), cancel_event,
+                                                        task_logger, move=owned)
+                    if cancel_event and cancel_event.is_set():
+                        raise CancelledError("任务被取消")
+                    task_logger.info(f"已将 {output_files_count} 个文件提交到 {output_directory}")
                     clean_metadata(output_directory)
 
+                self._commit_hash_sets(temp_dir, task_logger)
                 success_count = record.total_images - failed_count
                 record.complete(
                     total_images=record.total_images,
@@ -245,6 +475,15 @@ class WorkflowEngine:
                     failed_images=failed_count
                 )
                 history_manager.save_record(record)
+                if options.get('step_cache') and self._step_cache is not None:
+                    stats = self._step_cache.stats()
+                    task_logger.info(f"步骤缓存: {stats['entries']} 个条目, {stats['bytes'] / 1024 ** 2:.1f} MB, "
+                                     f"累计命中 {stats['hits']} 次, 未命中 {stats['misses']} 次")
+                if options.get('action_pool'):
+                    stats = action_pool.stats()
+                    task_logger.info(f"动作池: {stats['idle']} 个空闲实例, 约 {stats['bytes'] / 1024 ** 2:.1f} MB, "
+                                     f"累计命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+                                     f"淘汰 {stats['evictions']} 次")
                 task_logger.info(f"工作流执行完成. 总图像: {record.total_images}, "
                           f"成功: {success_count}, 失败: {failed_count}")
                 if progress_callback:
@@ -262,7 +501,15 @@ class WorkflowEngine:
                 return
 
             finally:
-                shutil.rmtree(temp_dir)
+                if downloader:
+                    downloader.close()
+                if record.status == "completed":
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    record.run_dir = None
+                    history_manager.save_record(record)
+                else:
+                    task_logger.info(f"工作目录已保留，可从历史记录继续执行: {temp_dir}")
+                    history_manager.save_record(record)
                 file_handler.close()
                 task_logger.removeHandler(file_handler)
 
@@ -278,6 +525,646 @@ class WorkflowEngine:
             if record.id in self._running_tasks:
                 del self._running_tasks[record.id]
 
+    def estimate_workflow(self, workflow: Workflow, source_type: str, source_params: Dict[str, Any],
+                          sample_size: int = 20, execution_mode: str = None,
+                          seed: Optional[int] = None) -> Dict[str, Any]:
+        """
+        估算模式：在随机抽取的少量输入图像上逐步执行工作流，测量每个步骤的耗时、扇出比例和输出大小，
+        推算完整运行的耗时、输出数量和临时磁盘峰值。不创建执行记录，也不写入输出目录。
+
+        估算按单进程逐步执行计算，没有考虑并行进程和流水线的加速；
+        样本上创建的动作实例会留在动作池中，随后的实际运行不必重新加载模型。
+
+        Args:
+            workflow: 工作流
+            source_type: 来源类型
+            source_params: 来源参数
+            sample_size: 样本图像数
+            execution_mode: 执行模式，用于推算临时磁盘峰值，为None时使用配置
+            seed: 随机种子，为None时每次抽取不同的样本
+
+        Returns:
+            估算结果字典，见 estimator.extrapolate
+        """
+        options = self._build_options(execution_mode)
+        options['intermediate_codec'] = resolve_codec(options.get('intermediate_codec', 'auto'))
+        plan = build_execution_plan(workflow.steps, options['execution_mode'])
+        sample_size = max(1, int(sample_size))
+        # 估算只读取哈希集合，不保存样本中保留的图像的哈希
+        configure_hash_sets(self._hash_set_directory())
+        work_dir = tempfile.mkdtemp(prefix="image_processor_estimate_")
+        try:
+            start = time.perf_counter()
+            items, total_inputs = self._sample_source(source_type, source_params, sample_size, work_dir, seed)
+            source_seconds = time.perf_counter() - start
+            if not items:
+                raise ValueError("来源中没有可用于估算的图像")
+            source_bytes = sum(self._encoded_size(item) for item in items)
+            sampled = len(items)
+
+            spilled = {plan[position].last_index for position in range(len(plan))
+                       if self._should_spill_to_store(plan, position)}
+            samples = []
+            spill_bytes = {}
+            with self._get_action_pool().lease(options.get('action_pool', False)) as lease:
+                for index, step in enumerate(workflow.steps):
+                    sample, outputs = self._measure_step(index, step, items, work_dir, lease)
+                    if outputs is not None:
+                        items = outputs
+                        sample.output_bytes = sum(self._encoded_size(item) for item in items)
+                        if index in spilled and items:
+                            store_dir = os.path.join(work_dir, f"store_{index}")
+                            create_intermediate_store(store_dir, options['intermediate_codec']).write(iter(items))
+                            spill_bytes[index] = self._directory_size(store_dir) / len(items)
+                            shutil.rmtree(store_dir, ignore_errors=True)
+                    samples.append(sample)
+
+            result = extrapolate(samples, sampled, total_inputs, plan, source_seconds, source_bytes,
+                                 scratch_input=source_type != "LocalSource" and bool(plan) and plan[0].kind != "stream",
+                                 spill_bytes=spill_bytes)
+            result['execution_mode'] = options['execution_mode']
+            return result
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _sample_source(self, source_type: str, source_params: Dict[str, Any], sample_size: int,
+                       work_dir: str, seed: Optional[int]) -> Tuple[List[Any], Optional[int]]:
+        """
+        获取估算用的样本图像：本地目录随机抽取，网络来源取前 sample_size 张
+
+        Returns:
+            (样本图像项列表, 来源图像总数)，网络来源没有数量上限参数时总数为None
+        """
+        if source_type == "LocalSource":
+            input_dir = source_params.get("directory", "")
+            if not os.path.isdir(input_dir):
+                raise FileNotFoundError(f"输入目录不存在: {input_dir}")
+            files = sorted(f for f in os.listdir(input_dir)
+                           if os.path.isfile(os.path.join(input_dir, f)) and f.lower().endswith(IMAGE_EXTENSIONS))
+            chosen = random.Random(seed).sample(files, min(sample_size, len(files)))
+            sample_dir = os.path.join(work_dir, "sample")
+            os.makedirs(sample_dir)
+            for filename in chosen:
+                src, dst = os.path.join(input_dir, filename), os.path.join(sample_dir, filename)
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+            return list(self._open_items(sample_dir)), len(files)
+
+        source = source_registry.create_source(source_type, **source_params)
+        downloader = self._create_downloader(source)
+        try:
+            items = list(islice(source.iter_items(downloader), sample_size))
+        finally:
+            downloader.close()
+        limit = source_params.get("limit")
+        return items, int(limit) if isinstance(limit, (int, float)) and limit > 0 else None
+
+    def _measure_step(self, index: int, step: WorkflowStep, items: List[Any], work_dir: str,
+                      lease: ActionLease) -> Tuple[StepSample, Optional[List[Any]]]:
+        """
+        在样本上执行单个步骤并计时。逐项动作先单独处理第一张图像，
+        它比之后每张图像多出的耗时计为模型加载等固定开销；屏障动作需要完整的输入，整体计时。
+
+        Returns:
+            (测量结果, 输出图像项列表)，步骤失败时输出为None
+        """
+        try:
+            if is_directory_action(step.action_name):
+                action = create_action_instance(step.action_name, step.params)
+                input_dir = os.path.join(work_dir, f"dir_in_{index}")
+                output_dir = os.path.join(work_dir, f"dir_out_{index}")
+                from waifuc.export import SaveExporter
+                SaveExporter(input_dir).export_from(iter(items))
+                start = time.perf_counter()
+                self._run_directory_step(action, input_dir, output_dir, logging.getLogger(__name__))
+                seconds = time.perf_counter() - start
+                from waifuc.source import LocalSource
+                outputs = list(LocalSource(output_dir))
+                return StepSample(index, step.action_name, len(items), len(outputs), seconds), outputs
+
+            action = lease.acquire(step.action_name, step.params, create_action_instance,
+                                   is_poolable_action(step.action_name))
+            if is_barrier_action(step.action_name) or len(items) < 2:
+                start = time.perf_counter()
+                outputs = list(action.iter_from(iter(items)))
+                seconds = time.perf_counter() - start
+                return StepSample(index, step.action_name, len(items), len(outputs), seconds), outputs
+
+            start = time.perf_counter()
+            outputs = list(action.iter_from(iter(items[:1])))
+            first_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            outputs += list(action.iter_from(iter(items[1:])))
+            rest_seconds = time.perf_counter() - start
+            per_item = rest_seconds / (len(items) - 1)
+            load_seconds = max(0.0, first_seconds - per_item)
+            return StepSample(index, step.action_name, len(items), len(outputs),
+                              per_item * len(items), load_seconds), outputs
+        except Exception as e:
+            logging.warning(f"估算时步骤 {index+1} ({step.action_name}) 执行失败: {str(e)}")
+            return StepSample(index, step.action_name, len(items), len(items), 0.0, error=str(e)), None
+
+    @staticmethod
+    def _encoded_size(item: Any) -> int:
+        """
+        图像按 SaveExporter 的默认格式（PNG）保存后的字节数
+        """
+        buffer = io.BytesIO()
+        item.image.save(buffer, format='PNG')
+        return buffer.tell()
+
+    @staticmethod
+    def _directory_size(directory: str) -> int:
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(directory) for f in files)
+
+    def _execute_workflows_internal(self, workflows: List[Workflow],
+                                    source_type: str, source_params: Dict[str, Any],
+                                    output_directory: str, records: List[ExecutionRecord],
+                                    progress_callback: Callable[[str, float, str], None] = None,
+                                    cancel_event: threading.Event = None,
+                                    options: Dict[str, Any] = None) -> None:
+        """
+        多工作流运行：获取一次图像，按前缀树执行共享的前缀步骤，再依次执行各工作流的剩余步骤
+        """
+        options = dict(options or {})
+        options['intermediate_codec'] = resolve_codec(options.get('intermediate_codec', 'auto'))
+        shared_dir = create_scratch_dir(output_directory, config_manager.get('general.temp_directory'),
+                                         exclude=[source_params.get('directory')])
+        options['hash_set_pending'] = os.path.join(shared_dir, 'hash_sets')
+        log_file = os.path.join("logs", f"multi_{records[0].id}_log.txt")
+        file_handler = logging.FileHandler(log_file, 'w', 'utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        task_logger = logging.getLogger(f"workflow.multi.{records[0].id}")
+        task_logger.setLevel(logging.INFO)
+        task_logger.addHandler(file_handler)
+        downloader = None
+        try:
+            task_logger.info(f"多工作流运行: {', '.join(workflow.name for workflow in workflows)}")
+            if progress_callback:
+                progress_callback("获取图像", 0.0, "准备图像来源...")
+            if source_type == "LocalSource":
+                input_dir = source_params.get("directory", "")
+                if not os.path.exists(input_dir):
+                    raise FileNotFoundError(f"输入目录不存在: {input_dir}")
+            else:
+                # 网络来源只下载一次，所有工作流共用下载结果
+                source = source_registry.create_source(source_type, **source_params)
+                downloader = self._create_downloader(source)
+                input_dir = os.path.join(shared_dir, 'input')
+                if progress_callback:
+                    progress_callback("获取图像", 0.1, "下载图像...")
+                from waifuc.export import SaveExporter
+                SaveExporter(input_dir).export_from(cancellable(source.iter_items(downloader), cancel_event))
+                source_type, source_params = "LocalSource", {'directory': input_dir}
+            total_images = sum(1 for f in os.listdir(input_dir)
+                               if os.path.isfile(os.path.join(input_dir, f)) and
+                               f.lower().endswith(IMAGE_EXTENSIONS))
+            task_logger.info(f"共 {total_images} 个图像文件")
+
+            if cancel_event and cancel_event.is_set():
+                raise CancelledError("任务被取消")
+
+            # 按前缀树自上而下执行共享节点，失败的节点及其子节点不再共享，相关工作流退回上一层的结果
+            prefix_outputs: Dict[str, Tuple[int, str]] = {}
+            nodes = [(node, input_dir) for node in build_prefix_tree(workflows).children]
+            while nodes:
+                node, node_input = nodes.pop(0)
+                names = ' -> '.join(step.action_name for _, step in node.steps)
+                task_logger.info(f"执行共享步骤 {node.start+1}-{node.end}（{len(node.workflows)} 个工作流）: {names}")
+                if progress_callback:
+                    progress_callback("处理图像", 0.2, f"执行共享步骤: {names}")
+                as_files = any(len(workflow.steps) == node.end or
+                               is_directory_action(workflow.steps[node.end].action_name)
+                               for workflow in node.workflows)
+                try:
+                    node_output = self._run_steps(node.workflows[0].steps[:node.end], node.start, node_input,
+                                                  shared_dir, options, task_logger, cancel_event, as_files)
+                except CancelledError:
+                    raise
+                except Exception as e:
+                    task_logger.error(f"共享步骤 {node.start+1}-{node.end} 执行失败，"
+                                      f"相关工作流将单独执行这些步骤: {str(e)}")
+                    continue
+                for workflow in node.workflows:
+                    prefix_outputs[workflow.id] = (node.end, node_output)
+                nodes.extend((child, node_output) for child in node.children)
+
+            if cancel_event and cancel_event.is_set():
+                raise CancelledError("任务被取消")
+
+            for k, (workflow, record) in enumerate(zip(workflows, records)):
+                workflow_options = dict(options)
+                if workflow.id in prefix_outputs:
+                    start_step, prefix_dir = prefix_outputs[workflow.id]
+                    workflow_options['start_step'] = start_step
+                    record.options['start_step'] = start_step
+                    record.total_images = total_images
+                    record.add_checkpoint(-1, [step.id for step in workflow.steps[:start_step]],
+                                          start_step - 1, prefix_dir, total_images, 0)
+                    task_logger.info(f"{workflow.name}: 复用共享的前 {start_step} 个步骤")
+                history_manager.save_record(record)
+                self._execute_workflow_internal(
+                    workflow, source_type, source_params, record.output_directory, record,
+                    self._wrap_progress(progress_callback, k, len(workflows), workflow.name),
+                    cancel_event, workflow_options)
+                task_logger.info(f"{workflow.name}: {record.status}")
+                if cancel_event and cancel_event.is_set():
+                    raise CancelledError("任务被取消")
+
+            completed = sum(1 for record in records if record.status == "completed")
+            task_logger.info(f"多工作流运行完成: 成功 {completed} 个，失败 {len(records) - completed} 个")
+            if progress_callback:
+                progress_callback("完成", 1.0,
+                                  f"多工作流运行完成. 成功: {completed}, 失败: {len(records) - completed}")
+
+        except CancelledError as e:
+            task_logger.info(str(e))
+            if progress_callback:
+                progress_callback("取消", 0.0, str(e))
+        except Exception as e:
+            error_msg = f"多工作流运行出错: {str(e)}"
+            task_logger.error(error_msg)
+            if progress_callback:
+                progress_callback("错误", 0, error_msg)
+
+        finally:
+            if downloader:
+                downloader.close()
+            for record in records:
+                if record.status == "running":
+                    record.fail("任务被取消" if cancel_event and cancel_event.is_set() else "多工作流运行中止")
+                    history_manager.save_record(record)
+                self._running_tasks.pop(record.id, None)
+            # 未完成的工作流可能在继续执行时仍需要共享前缀的结果
+            if all(record.status == "completed" for record in records):
+                self._commit_hash_sets(shared_dir, task_logger)
+                shutil.rmtree(shared_dir, ignore_errors=True)
+            else:
+                task_logger.info(f"共享工作目录已保留: {shared_dir}")
+            file_handler.close()
+            task_logger.removeHandler(file_handler)
+
+    def _run_steps(self, steps: List[WorkflowStep], start: int, input_dir: str, work_dir: str,
+                   options: Dict[str, Any], task_logger: logging.Logger,
+                   cancel_event: threading.Event = None, as_files: bool = False) -> str:
+        """
+        在工作目录中执行 steps[start:]，任一片段失败即抛出异常
+
+        Args:
+            steps: 工作流步骤（到要执行的最后一个步骤为止）
+            start: 第一个要执行的步骤序号
+            input_dir: 输入目录或中间结果存储
+            work_dir: 工作目录
+            options: 执行选项
+            task_logger: 任务日志记录器
+            cancel_event: 取消事件
+            as_files: 结果是否必须保存为图像文件（否则可以写入中间结果存储）
+
+        Returns:
+            结果目录
+        """
+        plan = build_execution_plan(steps, options.get('execution_mode', 'materialize'), start)
+        current_dir = input_dir
+        created = []
+        for position, segment in enumerate(plan):
+            if cancel_event and cancel_event.is_set():
+                raise CancelledError("任务被取消")
+            if position == len(plan) - 1:
+                spill = not as_files and segment.kind == "stream"
+            else:
+                spill = self._should_spill_to_store(plan, position)
+            output_dir = os.path.join(work_dir, f"shared_{uuid.uuid4().hex[:8]}_step_{segment.last_index+1}")
+            os.makedirs(output_dir)
+            self._run_segment(segment, current_dir, output_dir, task_logger, cancel_event, spill, steps, options)
+            if current_dir in created:
+                shutil.rmtree(current_dir, ignore_errors=True)
+            created.append(output_dir)
+            current_dir = output_dir
+        return current_dir
+
+    @staticmethod
+    def _wrap_progress(progress_callback: Callable[[str, float, str], None], index: int, count: int,
+                       name: str) -> Optional[Callable[[str, float, str], None]]:
+        """
+        将单个工作流的进度映射到多工作流运行的整体进度，中间工作流的完成和错误不结束整个任务
+        """
+        if not progress_callback:
+            return None
+
+        def callback(status: str, progress: float, message: str, details: Dict[str, Any] = None) -> None:
+            if status in ("完成", "错误"):
+                status = "处理图像"
+            if details is not None:
+                details = dict(details, workflow=name)
+            report_progress(progress_callback, status, 0.3 + 0.7 * (index + progress) / count,
+                            f"[{name}] {message}", details)
+        return callback
+
+    @staticmethod
+    def _format_step_label(segment: ExecutionSegment, total_steps: int) -> str:
+        """
+        生成片段的步骤序号标签，例如 "3/10" 或 "3-6/10"
+        """
+        if segment.first_index == segment.last_index:
+            return f"{segment.first_index+1}/{total_steps}"
+        return f"{segment.first_index+1}-{segment.last_index+1}/{total_steps}"
+
+    def _get_step_cache(self) -> StepCache:
+        """
+        获取进程内共享的步骤缓存，首次使用时按配置创建
+        """
+        with self._step_cache_lock:
+            if self._step_cache is None:
+                max_bytes = float(config_manager.get('cache.step_cache_max_gb', 5) or 5) * 1024 ** 3
+                self._step_cache = StepCache(os.path.join(self._cache_directory(), 'steps'), int(max_bytes))
+            return self._step_cache
+
+    @staticmethod
+    def _cache_directory() -> str:
+        """
+        获取缓存根目录
+        """
+        return config_manager.get('cache.directory') or os.path.join(config_manager.config_dir, 'cache')
+
+    @classmethod
+    def _embedding_directory(cls) -> str:
+        """
+        获取特征存储根目录
+        """
+        return os.path.join(cls._cache_directory(), 'embeddings')
+
+    @classmethod
+    def _hash_set_directory(cls) -> str:
+        """
+        获取哈希集合目录
+        """
+        return os.path.join(cls._cache_directory(), 'hash_sets')
+
+    @classmethod
+    def _commit_hash_sets(cls, work_dir: str, task_logger: logging.Logger) -> None:
+        """
+        运行成功完成后，将工作目录中待合并的哈希追加到哈希集合
+        """
+        count = commit_hash_sets(os.path.join(work_dir, 'hash_sets'), cls._hash_set_directory())
+        if count:
+            task_logger.info(f"已将 {count} 个保留图像的哈希合并到哈希集合")
+
+    @staticmethod
+    def _embedding_max_bytes() -> int:
+        """
+        获取每个特征模型的存储大小上限（字节）
+        """
+        return int(float(config_manager.get('cache.embedding_store_max_gb', 20) or 20) * 1024 ** 3)
+
+    @staticmethod
+    def _get_action_pool() -> ActionPool:
+        """
+        获取进程内共享的动作池，内存上限每次按配置更新
+        """
+        action_pool.max_bytes = int(float(config_manager.get('engine.action_pool_max_gb', 4) or 0) * 1024 ** 3)
+        return action_pool
+
+    @staticmethod
+    def _create_downloader(source: Any) -> ConcurrentDownloader:
+        """
+        按配置创建并发下载器，优先复用来源自带的会话（保留登录状态和请求头）
+        """
+        return ConcurrentDownloader(
+            session=getattr(source.source, 'session', None),
+            workers_per_host=config_manager.get('sources.download.workers_per_host', 4),
+            rate_limits=config_manager.get('sources.download.rate_limits', {}),
+            default_rate=config_manager.get('sources.download.default_rate', 0),
+        )
+
+    @staticmethod
+    def _should_spill_to_store(plan: List[ExecutionSegment], position: int) -> bool:
+        """
+        判断片段输出是否写入中间存储：最后一个片段和目录级片段之前的输出必须是图像文件，
+        其余中间结果只保留到下一个片段，使用快速的中间编码格式而不是 SaveExporter
+        """
+        if position == len(plan) - 1:
+            return False
+        return plan[position].kind == "stream" and plan[position + 1].kind == "stream"
+
+    @staticmethod
+    def _open_items(current_dir: Any) -> Any:
+        """
+        打开片段输入，可以是中间结果存储、普通图像目录或来源直接产出的图像项序列
+        """
+        if not isinstance(current_dir, str):
+            return current_dir
+        if IntermediateStore.is_store(current_dir):
+            return open_intermediate_store(current_dir)
+        from waifuc.source import LocalSource
+        return LocalSource(current_dir)
+
+    @staticmethod
+    def _count_inputs(current_dir: Any) -> Optional[int]:
+        """
+        统计片段输入的图像数量，用于估算进度；来源直接产出的图像项序列数量未知，返回None
+        """
+        if not isinstance(current_dir, str):
+            return None
+        if IntermediateStore.is_store(current_dir):
+            return len(open_intermediate_store(current_dir))
+        return sum(1 for _, _, files in os.walk(current_dir)
+                   for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+
+    def _run_segment(self, segment: ExecutionSegment, current_dir: Any, output_dir: str,
+                     task_logger: logging.Logger, cancel_event: threading.Event = None,
+                     spill: bool = False, all_steps: List[WorkflowStep] = None,
+                     options: Dict[str, Any] = None,
+                     tracker: ProgressTracker = None,
+                     journal: ItemJournal = None, append: bool = False) -> None:
+        """
+        执行一个片段：目录级动作按目录处理，其余步骤串联为惰性迭代链，
+        每个图像只解码一次，流经片段内所有步骤后只编码一次
+
+        Args:
+            segment: 执行片段
+            current_dir: 输入目录、中间结果存储或图像项序列
+            output_dir: 输出目录
+            task_logger: 任务日志记录器
+            cancel_event: 取消事件
+            spill: 是否将输出写入中间结果存储而不是图像目录
+            all_steps: 工作流全部步骤，用于判断并行步骤是否需要保持顺序
+            options: 执行选项
+            tracker: 进度跟踪器，提供时统计逐项进度
+            journal: 逐项日志，提供时跳过已完成的输入图像并记录新完成的图像
+            append: 是否追加到上次未完成的输出之后
+        """
+        options = options or {}
+        if segment.kind == "directory":
+            _, step = segment.steps[0]
+            started = time.perf_counter()
+            action_instance = create_action_instance(step.action_name, step.params)
+            if tracker is not None:
+                tracker.add_setup_time(time.perf_counter() - started)
+            self._run_directory_step(action_instance, current_dir, output_dir, task_logger, cancel_event, tracker)
+            return
+
+        # 取消检查放在日志记录之前：日志记下上一项后才读取下一项，被取消时已写出的结果都已记录
+        items = cancellable(self._open_items(current_dir), cancel_event)
+        if journal is not None:
+            items = journal.track(items)
+        if tracker is not None:
+            items = tracker.track_input(items)
+        with self._get_action_pool().lease(options.get('action_pool', False)) as lease:
+            items = self._build_segment_stream(segment, items,
+                                               all_steps or [step for _, step in segment.steps],
+                                               options, task_logger, tracker, cancel_event, lease)
+            if tracker is not None:
+                items = tracker.track_output(items)
+            try:
+                if spill:
+                    count = create_intermediate_store(output_dir, options.get('intermediate_codec', 'png1')).write(items, append)
+                    task_logger.info(f"已将 {count} 张图像写入中间存储")
+                else:
+                    from waifuc.export import SaveExporter
+                    SaveExporter(output_dir).export_from(items)
+                    clean_metadata(output_dir)
+            finally:
+                # 先结束迭代链（包括流水线线程），再把动作实例归还给动作池
+                if hasattr(items, 'close'):
+                    items.close()
+
+    def _build_segment_stream(self, segment: ExecutionSegment, items: Any, all_steps: List[WorkflowStep],
+                              options: Dict[str, Any], task_logger: logging.Logger,
+                              tracker: ProgressTracker = None,
+                              cancel_event: threading.Event = None,
+                              lease: ActionLease = None) -> Any:
+        """
+        构建片段的惰性迭代链，连续的无状态步骤在启用并行时合并为一个进程池阶段，
+        启用步骤缓存时合并为一个缓存阶段（复用已计算的最长步骤前缀）；
+        pipeline 模式下每个阶段在独立线程中运行，阶段之间通过有界队列连接
+
+        Args:
+            segment: 执行片段
+            items: 片段输入图像项序列
+            all_steps: 工作流全部步骤
+            options: 执行选项（process_workers: 并行进程数，小于等于1时不启用进程池；
+                     execution_mode; queue_size: 流水线队列长度; step_cache: 是否使用步骤缓存;
+                     batch_size: 支持批量推理的步骤每批处理的图像数，批量步骤不使用步骤缓存）
+            task_logger: 任务日志记录器
+            tracker: 进度跟踪器，提供时统计每个阶段流入和流出的图像数以及流水线队列深度
+            cancel_event: 取消事件，pipeline 模式下用于及时停止各阶段线程
+            lease: 动作池租借记录，提供时无状态步骤的动作实例从动作池取用
+
+        Returns:
+            片段输出的迭代器
+        """
+        lease = lease or action_pool.lease(False)
+        process_workers = options.get('process_workers', 0)
+        step_cache = self._get_step_cache() if options.get('step_cache') else None
+        cache_config = (step_cache.directory, step_cache.max_bytes) if step_cache else None
+        configure_tag_cache(os.path.join(self._cache_directory(), 'tags') if options.get('tag_cache') else None)
+        configure_detection_cache(bool(options.get('detection_cache')),
+                                  os.path.join(self._cache_directory(), 'detections'))
+        configure_embedding_store(self._embedding_directory() if options.get('embedding_store') else None,
+                                  self._embedding_max_bytes())
+        pending = options.get('hash_set_pending')
+        if pending:
+            # 每个片段使用单独的待合并目录，片段从头执行时丢弃上次未完成时记录的哈希
+            pending = os.path.join(pending, f"step_{segment.steps[-1][1].id}")
+            shutil.rmtree(pending, ignore_errors=True)
+        configure_hash_sets(self._hash_set_directory(), pending)
+        # 批量推理在当前进程内进行，启用进程池时仍逐项推理
+        batch_size = options.get('batch_size', 1) if process_workers <= 1 else 1
+        batch_actions = {}
+        setup_seconds = {}
+        if batch_size > 1:
+            for index, step in segment.steps:
+                if supports_batch(step.action_name):
+                    started = time.perf_counter()
+                    batch_actions[index] = lease.acquire(step.action_name, step.params, create_batch_action,
+                                                         is_poolable_action(step.action_name))
+                    setup_seconds[index] = time.perf_counter() - started
+
+        # (阶段名称, 步骤序号, 创建动作实例的耗时, 阶段处理函数)
+        stages = []
+        for stateless, run in split_parallel_runs(segment.steps, process_workers > 1 or step_cache is not None):
+            for batched, part in groupby(run, key=lambda entry: entry[0] in batch_actions):
+                part = list(part)
+                indices = [index for index, _ in part]
+                if batched:
+                    for index, step in part:
+                        ordered = requires_order(all_steps, index)
+                        task_logger.info(f"批量推理执行 {step.action_name}，批次大小 {batch_size}，"
+                                         f"{'保持' if ordered else '不保持'}顺序")
+                        stages.append((step.action_name, [index], setup_seconds[index],
+                                       lambda stream, action=batch_actions[index], ordered=ordered:
+                                       action.iter_batched(stream, batch_size, ordered)))
+                    continue
+                specs = [(step.action_name, step.params) for _, step in part]
+                if stateless and process_workers > 1:
+                    ordered = requires_order(all_steps, part[-1][0])
+                    task_logger.info(f"并行执行 {' -> '.join(step.action_name for _, step in part)}，"
+                                     f"进程数 {process_workers}，{'保持' if ordered else '不保持'}顺序"
+                                     f"{'，使用步骤缓存' if step_cache else ''}")
+                    stages.append(("+".join(step.action_name for _, step in part), indices, 0.0,
+                                   lambda stream, specs=specs, ordered=ordered:
+                                   parallel_chain(stream, specs, process_workers, ordered, cache_config)))
+                elif stateless:
+                    task_logger.info(f"使用步骤缓存执行 {' -> '.join(step.action_name for _, step in part)}")
+                    started = time.perf_counter()
+                    actions = [lease.acquire(name, params, create_action_instance) for name, params in specs]
+                    signatures = prefix_signatures(specs)
+                    stages.append(("+".join(step.action_name for _, step in part), indices,
+                                   time.perf_counter() - started,
+                                   lambda stream, actions=actions, signatures=signatures:
+                                   cached_chain(stream, actions, signatures, step_cache)))
+                else:
+                    for index, step in part:
+                        started = time.perf_counter()
+                        action = lease.acquire(step.action_name, step.params, create_action_instance,
+                                               is_poolable_action(step.action_name))
+                        stages.append((step.action_name, [index], time.perf_counter() - started,
+                                       lambda stream, action=action: chain_actions(stream, [action])))
+
+        if tracker is not None:
+            stages = [(name, indices, setup, tracker.track_stage(name, stage, indices, setup))
+                      for name, indices, setup, stage in stages]
+        stages = [(name, stage) for name, _, _, stage in stages]
+
+        if options.get('execution_mode') == "pipeline":
+            task_logger.info(f"流水线执行 {len(stages)} 个阶段，队列长度 {options.get('queue_size', 8)}")
+            return StagePipeline(items, stages, options.get('queue_size', 8),
+                                 tracker.set_queue_depths if tracker is not None else None,
+                                 cancel_event=cancel_event)
+
+        stream = items
+        for _, stage in stages:
+            stream = stage(stream)
+        return stream
+
+    @staticmethod
+    def _run_directory_step(action_instance: Any, current_dir: str, output_dir: str,
+                            task_logger: logging.Logger, cancel_event: threading.Event = None,
+                            tracker: ProgressTracker = None) -> None:
+        """
+        执行 PreSortImagesAction / EnhancedImageProcessAction 等目录级动作，按比例分目录保存结果
+        """
+        for result in action_instance.iter(current_dir, output_dir):
+            if cancel_event and cancel_event.is_set():
+                raise CancelledError("任务被取消")
+            if 'item' in result:
+                item = result['item']
+                ratio = item.meta.get('ratio', 'unknown')
+                ratio_dir = os.path.join(output_dir, ratio.replace(':', '_'))
+                os.makedirs(ratio_dir, exist_ok=True)
+                unique_filename = f"{uuid.uuid4().hex[:8]}.png"
+                output_path = os.path.join(ratio_dir, unique_filename)
+                item.image.save(output_path, format='PNG')
+                if tracker is not None:
+                    tracker.item_done()
+            elif 'counts' in result:
+                task_logger.info(f"{action_instance.__class__.__name__} 统计: {result['counts']}")
+            elif 'results' in result:
+                for ratio, info in result['results'].items():
+                    task_logger.info(f"{ratio} 图像: {info['count']} 张")
+
     def get_running_tasks(self) -> Dict[str, ExecutionRecord]:
         running_records = {}
         for task_id, (future, record, cancel_event) in list(self._running_tasks.items()):
@@ -295,14 +1182,39 @@ class WorkflowEngine:
         cancelled = future.cancel()
         cancel_event.set()
         if cancelled:
-            record.fail("任务被取消")
-            history_manager.save_record(record)
-            del self._running_tasks[task_id]
+            # 多工作流运行的所有记录共用同一个 future
+            for other_id, (other_future, other_record, _) in list(self._running_tasks.items()):
+                if other_future is future:
+                    other_record.fail("任务被取消")
+                    history_manager.save_record(other_record)
+                    del self._running_tasks[other_id]
             logger.info(f"Task {task_id} cancelled via future.cancel")
         else:
             logger.info(f"Task {task_id} marked for cancellation via cancel_event")
         return True
 
+    def get_embedding_store_usage(self) -> List[Dict[str, Any]]:
+        """
+        获取各特征模型存储的占用，用于在设置中显示存储是否已满
+
+        Returns:
+            [{'model', 'rows', 'bytes', 'full'}, ...]
+        """
+        return embedding_store_usage(self._embedding_directory(), self._embedding_max_bytes())
+
+    def clear_embedding_stores(self) -> int:
+        """
+        清空特征存储，之后的运行重新提取并保存特征
+
+        Returns:
+            删除的模型存储个数
+        """
+        if self.get_running_tasks():
+            raise RuntimeError("有任务正在执行，无法清空特征存储")
+        removed = clear_embedding_stores(self._embedding_directory())
+        logger.info(f"已清空特征存储: {removed} 个模型")
+        return removed
+
     def shutdown(self) -> None:
         for task_id, (future, record, cancel_event) in list(self._running_tasks.items()):
             cancel_event.set()
@@ -0,0 +1,100 @@
+"""
+工作流前缀模块 - 检测多个工作流共有的前缀步骤，构建前缀树
+"""
+import json
+from typing import Dict, List, Tuple
+
+from .workflow import Workflow, WorkflowStep
+
+
+def step_key(step: WorkflowStep) -> Tuple[str, str]:
+    """
+    生成用于比较步骤的键：操作名称加规范化后的参数
+
+    Args:
+        step: 工作流步骤
+
+    Returns:
+        (操作名称, 参数JSON) 元组
+    """
+    return step.action_name, json.dumps(step.params or {}, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def common_prefix_length(step_lists: List[List[WorkflowStep]]) -> int:
+    """
+    计算多个步骤列表共有的前缀步骤数量
+
+    Args:
+        step_lists: 步骤列表的列表，例如各工作流的 steps 或其从某个位置开始的剩余部分
+
+    Returns:
+        共有前缀的步骤数量
+    """
+    if not step_lists:
+        return 0
+    length = 0
+    for steps in zip(*step_lists):
+        if len({step_key(step) for step in steps}) != 1:
+            break
+        length += 1
+    return length
+
+
+class PrefixNode:
+    """
+    前缀树节点，代表被至少两个工作流共享的一段连续步骤
+
+    根节点不包含步骤；每个子节点的步骤从父节点结束处开始，到这些工作流开始分叉处为止。
+    """
+    def __init__(self, start: int, end: int, workflows: List[Workflow]):
+        """
+        初始化前缀树节点
+
+        Args:
+            start: 节点第一个步骤的序号
+            end: 节点结束位置（不含），即经过该节点后已完成的步骤数量
+            workflows: 经过该节点的工作流
+        """
+        self.start = start
+        self.end = end
+        self.workflows = workflows
+        self.children: List['PrefixNode'] = []
+
+    @property
+    def steps(self) -> List[Tuple[int, WorkflowStep]]:
+        """节点包含的 (步骤序号, 工作流步骤) 列表"""
+        return [(index, self.workflows[0].steps[index]) for index in range(self.start, self.end)]
+
+    def __repr__(self) -> str:
+        names = ' -> '.join(step.action_name for _, step in self.steps)
+        return f"PrefixNode(steps={names}, workflows={len(self.workflows)}, children={len(self.children)})"
+
+
+def build_prefix_tree(workflows: List[Workflow]) -> PrefixNode:
+    """
+    构建工作流前缀树，只为至少两个工作流共享的步骤建立节点
+
+    Args:
+        workflows: 工作流列表
+
+    Returns:
+        根节点
+    """
+    root = PrefixNode(0, 0, list(workflows))
+    _grow(root)
+    return root
+
+
+def _grow(node: PrefixNode) -> None:
+    groups: Dict[Tuple[str, str], List[Workflow]] = {}
+    for workflow in node.workflows:
+        if len(workflow.steps) > node.end:
+            groups.setdefault(step_key(workflow.steps[node.end]), []).append(workflow)
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        shared = common_prefix_length([workflow.steps[node.end:] for workflow in members])
+        child = PrefixNode(node.end, node.end + shared, members)
+        node.children.append(child)
+        _grow(child)
+
@@ -4,6 +4,7 @@
 """
 from src.data import workflow_manager
 from src.data.workflow_engine import workflow_engine
+from src.data.workflow_prefix import common_prefix_length
 from typing import Dict, List, Tuple
 import logging
 import threading
@@ -16,9 +17,32 @@ class TaskError(Exception):
     pass
 
 class TaskService:
+    # 任务 ID 到最新的 (状态, 进度, 消息)，运行期间进度每秒更新，只保留最新一条
     progress_data = {}
+    progress_details = {}
     _lock = threading.Lock()
 
+    @classmethod
+    def _record_progress(cls, task_id: str, status: str, progress: float, message: str,
+                         details: Dict = None) -> None:
+        """
+        保存任务的最新进度，状态变化时记录 INFO 日志，其余的周期性进度只记录 DEBUG 日志。
+
+        Args:
+            task_id: 任务 ID
+            status: 状态
+            progress: 进度
+            message: 消息
+            details: 逐项进度详情
+        """
+        with cls._lock:
+            previous = cls.progress_data.get(task_id)
+            cls.progress_data[task_id] = (status, progress, message)
+            if details is not None:
+                cls.progress_details[task_id] = details
+        level = logging.INFO if previous is None or previous[0] != status else logging.DEBUG
+        logger.log(level, f"Task {task_id} progress: {status}, {progress:.2f}, {message}")
+
     @classmethod
     def start_task(cls, workflow_id: str, source_data: Dict, output_dir: str) -> str:
         """
@@ -42,13 +66,8 @@ class TaskService:
                 raise TaskError("数据源类型不能为空")
             
             task_id = None
-            def progress_callback(status: str, progress: float, message: str):
-                nonlocal task_id
-                with cls._lock:
-                    if task_id is None:
-                        cls.progress_data[task_id] = []
-                    cls.progress_data[task_id].append((status, progress, message))
-                logger.info(f"Task {task_id} progress: {status}, {progress:.2f}, {message}")
+            def progress_callback(status: str, progress: float, message: str, details: Dict = None):
+                cls._record_progress(task_id, status, progress, message, details)
             
             record = workflow_engine.execute_workflow(
                 workflow, source_type, source_params, output_dir, progress_callback
@@ -56,13 +75,109 @@ class TaskService:
             task_id = record.id
             with cls._lock:
                 if task_id not in cls.progress_data:
-                    cls.progress_data[task_id] = [("未开始", 0.0, "任务已启动")]
+                    cls.progress_data[task_id] = ("未开始", 0.0, "任务已启动")
             logger.info(f"Started task: {task_id}")
             return task_id
         except Exception as e:
             logger.error(f"Start task failed: {str(e)}")
             raise TaskError(f"启动任务失败: {str(e)}")
 
+    @classmethod
+    def start_multi_task(cls, workflow_ids: List[str], source_data: Dict, output_dir: str) -> str:
+        """
+        对同一数据源同时运行多个工作流，共有的前缀步骤只执行一次，
+        每个工作流输出到输出目录下以工作流名称命名的子目录。
+
+        Args:
+            workflow_ids: 工作流 ID 列表
+            source_data: 数据源配置
+            output_dir: 输出目录
+
+        Returns:
+            任务 ID（第一个工作流的执行记录 ID，停止该任务会停止所有工作流）
+        """
+        try:
+            workflows = []
+            for workflow_id in workflow_ids:
+                workflow = workflow_manager.get_workflow(workflow_id)
+                if not workflow:
+                    raise TaskError(f"工作流不存在: {workflow_id}")
+                workflows.append(workflow)
+            source_type = source_data.get("type")
+            source_params = source_data.get("params", {})
+            if not source_type:
+                raise TaskError("数据源类型不能为空")
+            logger.info(f"Shared prefix length: {common_prefix_length([workflow.steps for workflow in workflows])} steps")
+
+            task_id = None
+            def progress_callback(status: str, progress: float, message: str, details: Dict = None):
+                cls._record_progress(task_id, status, progress, message, details)
+
+            records = workflow_engine.execute_workflows(
+                workflows, source_type, source_params, output_dir, progress_callback
+            )
+            task_id = records[0].id
+            with cls._lock:
+                if task_id not in cls.progress_data:
+                    cls.progress_data[task_id] = ("未开始", 0.0, f"已启动 {len(records)} 个工作流")
+            logger.info(f"Started multi-workflow task: {task_id}")
+            return task_id
+        except Exception as e:
+            logger.error(f"Start multi task failed: {str(e)}")
+            raise TaskError(f"启动任务失败: {str(e)}")
+
+    @classmethod
+    def estimate_task(cls, workflow_id: str, source_data: Dict, sample_size: int = 20) -> Dict:
+        """
+        在随机抽取的样本上试运行工作流，估算完整运行的耗时、输出数量和临时磁盘占用。
+
+        Args:
+            workflow_id: 工作流 ID
+            source_data: 数据源配置
+            sample_size: 样本图像数
+
+        Returns:
+            估算结果字典
+        """
+        try:
+            workflow = workflow_manager.get_workflow(workflow_id)
+            if not workflow:
+                raise TaskError("工作流不存在")
+            source_type = source_data.get("type")
+            source_params = source_data.get("params", {})
+            if not source_type:
+                raise TaskError("数据源类型不能为空")
+            return workflow_engine.estimate_workflow(workflow, source_type, source_params, int(sample_size or 20))
+        except TaskError:
+            raise
+        except Exception as e:
+            logger.error(f"Estimate task failed: {str(e)}")
+            raise TaskError(f"估算失败: {str(e)}")
+
+    @classmethod
+    def resume_task(cls, record_id: str) -> str:
+        """
+        从最后一个检查点继续执行失败或取消的任务，任务 ID 与原记录 ID 相同。
+
+        Args:
+            record_id: 执行记录 ID
+
+        Returns:
+            任务 ID
+        """
+        try:
+            def progress_callback(status: str, progress: float, message: str, details: Dict = None):
+                cls._record_progress(record_id, status, progress, message, details)
+
+            with cls._lock:
+                cls.progress_data[record_id] = ("未开始", 0.0, "任务已继续")
+            workflow_engine.resume_workflow(record_id, progress_callback)
+            logger.info(f"Resumed task: {record_id}")
+            return record_id
+        except Exception as e:
+            logger.error(f"Resume task failed: {str(e)}")
+            raise TaskError(f"继续任务失败: {str(e)}")
+
     @classmethod
     def get_progress(cls, task_id: str) -> Tuple[str, float, str, bool]:
         """
@@ -75,13 +190,27 @@ class TaskService:
             Tuple[str, float, str, bool]: 状态、进度、消息、是否完成
         """
         with cls._lock:
-            if task_id not in cls.progress_data or not cls.progress_data[task_id]:
+            if task_id not in cls.progress_data:
                 return "未开始", 0.0, "等待任务启动", False
         
-            status, progress, message = cls.progress_data[task_id][-1]
+            status, progress, message = cls.progress_data[task_id]
             is_finished = status in ["完成", "错误", "取消"]  # 新增“取消”
             return status, progress, message, is_finished
 
+    @classmethod
+    def get_progress_details(cls, task_id: str) -> Dict:
+        """
+        获取任务当前步骤的逐项进度详情（已处理数量、吞吐量、预计剩余时间、各阶段计数）。
+
+        Args:
+            task_id: 任务 ID
+
+        Returns:
+            进度详情字典，尚无详情时返回空字典
+        """
+        with cls._lock:
+            return dict(cls.progress_details.get(task_id) or {})
+
     @classmethod
     def clear_progress(cls, task_id: str) -> None:
         """
@@ -91,6 +220,7 @@ class TaskService:
             task_id: 任务 ID
         """
         with cls._lock:
+            cls.progress_details.pop(task_id, None)
             if task_id in cls.progress_data:
                 del cls.progress_data[task_id]
                 logger.info(f"Cleared progress data for task: {task_id}")
@@ -111,15 +241,15 @@ class TaskService:
                 raise TaskError("没有运行中的任务")
             with cls._lock:
                 if task_id in cls.progress_data:
-                    cls.progress_data[task_id].append((
+                    cls.progress_data[task_id] = (
                         "等待取消",
                         0.0,
-                        "终止信号已发送，需等待当前工作流步骤完成"
-                    ))
+                        "终止信号已发送，将在当前图像处理完成后停止"
+                    )
             success = workflow_engine.cancel_task(task_id)
             if success:
                 logger.info(f"Stopped task: {task_id}")
-                return "终止信号已发送，任务将在当前步骤完成后停止"
+                return "终止信号已发送，任务将在当前图像处理完成后停止，已完成的结果会保留以便继续执行"
             else:
                 logger.warning(f"Failed to stop task: {task_id}")
                 return "无法停止任务，可能已完成或不存在"
@@ -127,6 +257,44 @@ class TaskService:
             logger.error(f"Stop task error: {str(e)}")
             return str(e)
 
+    @classmethod
+    def get_embedding_store_status(cls) -> str:
+        """
+        获取特征存储的占用说明，存储已满时提示提高上限或清空。
+
+        Returns:
+            每个特征模型一行的说明文本
+        """
+        try:
+            usage = workflow_engine.get_embedding_store_usage()
+        except Exception as e:
+            logger.error(f"Get embedding store usage failed: {str(e)}")
+            return f"读取特征存储失败: {str(e)}"
+        if not usage:
+            return "特征存储为空"
+        lines = []
+        for store in usage:
+            line = f"{store['model']}: {store['rows']} 张图像，{store['bytes'] / 1024 ** 3:.2f} GB"
+            if store['full']:
+                line += "（已满，新图像的特征不再保存，请提高上限或清空特征存储）"
+            lines.append(line)
+        return "\n".join(lines)
+
+    @classmethod
+    def clear_embedding_stores(cls) -> str:
+        """
+        清空特征存储。
+
+        Returns:
+            清空结果消息
+        """
+        try:
+            removed = workflow_engine.clear_embedding_stores()
+            return f"已清空 {removed} 个特征模型的存储"
+        except Exception as e:
+            logger.error(f"Clear embedding stores failed: {str(e)}")
+            return f"清空特征存储失败: {str(e)}"
+
     @classmethod
     def open_output_directory(cls, output_dir: str) -> None:
         """
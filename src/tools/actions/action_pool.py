@@ -0,0 +1,239 @@
+"""
+动作池模块 - 在进程内复用已创建的动作实例（以及其加载的模型），按内存上限做最近最少使用淘汰
+"""
+import gc
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..cache.hashing import canonical_json
+
+PoolKey = Tuple[str, str, str]
+
+
+def current_rss() -> Optional[int]:
+    """
+    获取当前进程的常驻内存大小
+
+    Returns:
+        字节数，无法获取时返回None
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class _PoolEntry:
+    """
+    池中的一个动作实例
+    """
+    def __init__(self, key: PoolKey, instance: Any, size: int):
+        self.key = key
+        self.instance = instance
+        # 创建实例前后进程常驻内存的增长
+        self.size = size
+        self.last_used = time.time()
+
+
+class ActionPool:
+    """
+    进程内的动作实例池
+
+    键为工厂函数、操作名称和规范化后的参数，参数完全相同的步骤复用同一个实例，
+    再次运行工作流时不必重新创建实例及其在构造时加载的模型（例如 ESRGAN）。实例在使用期间由一次执行独占，
+    归还后才能被下一次执行取用，同一步骤被多个任务同时执行时会各自创建实例。
+    每个实例的内存占用以构造前后进程常驻内存的增长估算，总占用超过上限时淘汰最近最少使用的空闲实例。
+
+    imgutils 的检测、标签、特征等模型由 imgutils 在模块级缓存中加载（通常在处理第一张图像时），
+    为所有实例共享并在进程内一直保留：它们不计入实例的占用，淘汰实例也不会释放这些模型。
+    只应放入不保留跨图像状态的动作，否则上一次执行的状态会带入下一次执行。
+    """
+    def __init__(self, max_bytes: int = 4 * 1024 ** 3):
+        """
+        初始化动作池
+
+        Args:
+            max_bytes: 池中实例的内存占用上限（字节），为0时归还后立即释放
+        """
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._idle: Dict[PoolKey, List[_PoolEntry]] = {}
+        self._leased: Dict[int, _PoolEntry] = {}
+
+    @staticmethod
+    def _make_key(action_name: str, params: Dict[str, Any], factory: Callable[..., Any]) -> PoolKey:
+        params_key = canonical_json(params or {})
+        if params_key is None:
+            params_key = repr(sorted((params or {}).items()))
+        return getattr(factory, '__name__', repr(factory)), action_name, params_key
+
+    def acquire(self, action_name: str, params: Dict[str, Any],
+                factory: Callable[[str, Dict[str, Any]], Any]) -> Any:
+        """
+        取用动作实例，池中没有空闲实例时通过工厂函数创建
+
+        Args:
+            action_name: 操作名称
+            params: 操作参数
+            factory: 工厂函数，接收操作名称和参数，返回动作实例
+
+        Returns:
+            动作实例，使用完毕后需要通过 release 归还
+        """
+        key = self._make_key(action_name, params, factory)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                entry = idle.pop()
+                if not idle:
+                    del self._idle[key]
+                self._leased[id(entry.instance)] = entry
+                self.hits += 1
+                return entry.instance
+            self.misses += 1
+
+        rss_before = current_rss()
+        instance = factory(action_name, params)
+        rss_after = current_rss()
+        size = max(0, rss_after - rss_before) if rss_before is not None and rss_after is not None else 0
+        entry = _PoolEntry(key, instance, size)
+        with self._lock:
+            self._leased[id(entry.instance)] = entry
+        return entry.instance
+
+    def release(self, instance: Any) -> None:
+        """
+        归还动作实例，之后超出内存上限时淘汰最近最少使用的空闲实例
+
+        Args:
+            instance: 通过 acquire 取用的动作实例
+        """
+        with self._lock:
+            entry = self._leased.pop(id(instance), None)
+            if entry is None:
+                return
+            entry.last_used = time.time()
+            self._idle.setdefault(entry.key, []).append(entry)
+            evicted = self._evict()
+        if evicted:
+            gc.collect()
+            logging.info(f"动作池淘汰 {evicted} 个实例，当前占用约 {self.total_bytes() / 1024 ** 2:.1f} MB")
+
+    def _evict(self) -> int:
+        """
+        淘汰空闲实例直到总占用不超过上限，调用时需持有锁
+
+        Returns:
+            淘汰的实例数量
+        """
+        total = sum(entry.size for entries in self._idle.values() for entry in entries) + \
+            sum(entry.size for entry in self._leased.values())
+        evicted = 0
+        while total > self.max_bytes and self._idle:
+            key, index = min(((key, i) for key, entries in self._idle.items() for i in range(len(entries))),
+                             key=lambda pair: self._idle[pair[0]][pair[1]].last_used)
+            entry = self._idle[key].pop(index)
+            if not self._idle[key]:
+                del self._idle[key]
+            total -= entry.size
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def total_bytes(self) -> int:
+        """
+        获取池中实例（包括使用中的实例）的估算内存占用
+
+        Returns:
+            字节数
+        """
+        with self._lock:
+            return sum(entry.size for entries in self._idle.values() for entry in entries) + \
+                sum(entry.size for entry in self._leased.values())
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取动作池统计信息
+
+        Returns:
+            包含空闲和使用中的实例数、估算内存占用、命中、未命中和淘汰次数的字典
+        """
+        with self._lock:
+            idle = sum(len(entries) for entries in self._idle.values())
+            leased = len(self._leased)
+        return {'idle': idle, 'leased': leased, 'bytes': self.total_bytes(),
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self) -> None:
+        """
+        释放所有空闲实例
+        """
+        with self._lock:
+            self._idle.clear()
+        gc.collect()
+
+    def lease(self, enabled: bool = True) -> 'ActionLease':
+        """
+        创建一次执行的租借记录，退出时归还期间取用的所有实例
+
+        Args:
+            enabled: 是否使用动作池，为False时每次都创建新实例
+
+        Returns:
+            租借记录
+        """
+        return ActionLease(self, enabled)
+
+
+class ActionLease:
+    """
+    一次执行期间从动作池取用的实例，作为上下文管理器使用，退出时全部归还
+    """
+    def __init__(self, pool: ActionPool, enabled: bool = True):
+        self.pool = pool
+        self.enabled = enabled
+        self._acquired: List[Any] = []
+
+    def acquire(self, action_name: str, params: Dict[str, Any],
+                factory: Callable[[str, Dict[str, Any]], Any], pooled: bool = True) -> Any:
+        """
+        取用动作实例
+
+        Args:
+            action_name: 操作名称
+            params: 操作参数
+            factory: 工厂函数，接收操作名称和参数，返回动作实例
+            pooled: 动作是否可以复用（保留跨图像状态的动作应为False）
+
+        Returns:
+            动作实例
+        """
+        if not (self.enabled and pooled):
+            return factory(action_name, params)
+        instance = self.pool.acquire(action_name, params, factory)
+        self._acquired.append(instance)
+        return instance
+
+    def __enter__(self) -> 'ActionLease':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        for instance in self._acquired:
+            self.pool.release(instance)
+        self._acquired.clear()
+
+
+# 创建全局动作池实例
+action_pool = ActionPool()
@@ -2,117 +2,29 @@
 Action注册表模块 - 管理和注册所有可用的图像处理操作
 """
 import inspect
+import logging
+import importlib
 from typing import Dict, List, Type, Any, get_type_hints,Optional
 from .base import BaseAction
 from .waifuc_actions import WaifucActionWrapper
-from .transform_actions import (
-    ModeConvertAction, BackgroundRemovalAction, AlignMaxSizeAction,
-    AlignMinSizeAction, AlignMaxAreaAction, PaddingAlignAction
-)
-from .augment_actions import (
-    RandomChoiceAction, RandomFilenameAction, MirrorAction, CharacterEnhanceAction
-)
-from .split_actions import (
-    PersonSplitAction, ThreeStageSplitAction, FrameSplitAction
-)
-from .filter_actions import (
-    FilterSimilarAction, MinSizeFilterAction, MinAreaFilterAction,
-    NoMonochromeAction, OnlyMonochromeAction, ClassFilterAction,
-    RatingFilterAction, FaceCountAction, HeadCountAction, PersonRatioAction,
-    CCIPAction, FirstNSelectAction, SliceSelectAction
-)
-from .tagging_actions import (
-    TaggingAction, TagFilterAction, TagOverlapDropAction, TagDropAction,
-    BlacklistedTagDropAction, TagRemoveUnderlineAction
-)
-from .misc_actions import (
-    SafetyAction, ArrivalAction, FileExtAction, FileOrderAction,
-    HeadCutOutAction
-)
-from .custom_actions import (
-    PreSortImagesAction, EnhancedImageProcessAction, ProcessRatioGroupAction,
-    HeadCoverAction
-)
-from .enhance_actions import (
-    ESRGANActionWrapper, SmartCropActionWrapper
-)
+from .manifest import ACTION_MANIFEST, CATEGORIES, SchemaUnavailable, module_file, read_param_schema
 
 
 class ActionRegistry:
     """
     所有可用图像处理操作的注册表
+
+    清单中的操作只记录名称、类别和所在模块，第一次获取操作类时才导入模块，
+    因此导入注册表不会加载 waifuc、imgutils 或 torch。
     """
     def __init__(self):
         self._actions: Dict[str, Type[BaseAction]] = {}
-        self._categories: Dict[str, List[str]] = {
-            "转换": [],
-            "过滤": [],
-            "变换": [],
-            "分割": [],
-            "对齐": [],
-            "标签": [],
-            "自定义": [],
-            "安全": [],
-            "调试": [],
-            "文件名": [],
-            "头部处理": [],
-            "增强": [],  # 新增“增强”类别
-        }
-        
-        # 注册操作
-        self.register("转换", ModeConvertAction)
-        self.register("转换", BackgroundRemovalAction)
-        
-        self.register("变换", RandomChoiceAction)
-        self.register("变换", RandomFilenameAction)
-        self.register("变换", MirrorAction)
-        self.register("变换", CharacterEnhanceAction)
-        
-        self.register("对齐", AlignMaxSizeAction)
-        self.register("对齐", AlignMinSizeAction)
-        self.register("对齐", AlignMaxAreaAction)
-        self.register("对齐", PaddingAlignAction)
-        
-        self.register("分割", ThreeStageSplitAction)
-        self.register("分割", PersonSplitAction)
-        self.register("分割", FrameSplitAction)
-        
-        self.register("标签", TaggingAction)
-        self.register("标签", TagFilterAction)
-        self.register("标签", TagOverlapDropAction)
-        self.register("标签", TagDropAction)
-        self.register("标签", BlacklistedTagDropAction)
-        self.register("标签", TagRemoveUnderlineAction)
-        
-        self.register("过滤", FilterSimilarAction)
-        self.register("过滤", MinSizeFilterAction)
-        self.register("过滤", MinAreaFilterAction)
-        self.register("过滤", NoMonochromeAction)
-        self.register("过滤", OnlyMonochromeAction)
-        self.register("过滤", ClassFilterAction)
-        self.register("过滤", RatingFilterAction)
-        self.register("过滤", FaceCountAction)
-        self.register("过滤", HeadCountAction)
-        self.register("过滤", PersonRatioAction)
-        self.register("过滤", CCIPAction)
-        self.register("过滤", FirstNSelectAction)
-        self.register("过滤", SliceSelectAction)
-        
-        self.register("安全", SafetyAction)
-        self.register("调试", ArrivalAction)
-        self.register("文件名", FileExtAction)
-        self.register("文件名", FileOrderAction)
-        self.register("头部处理", HeadCutOutAction)
-        
-        # 注册自定义操作
-        self.register("自定义", PreSortImagesAction)
-        self.register("自定义", EnhancedImageProcessAction)
-        self.register("自定义", ProcessRatioGroupAction)
-        self.register("自定义", HeadCoverAction)
-        
-        # 注册增强操作
-        self.register("增强", ESRGANActionWrapper)
-        self.register("增强", SmartCropActionWrapper)
+        self._lazy_actions: Dict[str, str] = {}
+        self._categories: Dict[str, List[str]] = {category: [] for category in CATEGORIES}
+        
+        # 注册清单中的操作
+        for category, action_name, module_name in ACTION_MANIFEST:
+            self.register_lazy(category, action_name, module_name)
     
     def register(self, category: str, action_class: Type[BaseAction]) -> None:
         """
@@ -131,6 +43,23 @@ class ActionRegistry:
         if action_name not in self._categories[category]:
             self._categories[category].append(action_name)
     
+    def register_lazy(self, category: str, action_name: str, module_name: str) -> None:
+        """
+        注册一个延迟导入的操作，第一次获取操作类时才导入所在模块
+        
+        Args:
+            category: 操作类别
+            action_name: 操作名称（即类名）
+            module_name: 所在模块，相对于本包的模块名称
+        """
+        self._lazy_actions[action_name] = module_name
+        
+        if category not in self._categories:
+            self._categories[category] = []
+        
+        if action_name not in self._categories[category]:
+            self._categories[category].append(action_name)
+    
     def get_action_class(self, action_name: str) -> Type[BaseAction]:
         """
         获取操作类
@@ -142,7 +71,10 @@ class ActionRegistry:
             操作类
         """
         if action_name not in self._actions:
-            raise ValueError(f"操作 '{action_name}' 未找到")
+            if action_name not in self._lazy_actions:
+                raise ValueError(f"操作 '{action_name}' 未找到")
+            module = importlib.import_module(f"{__package__}.{self._lazy_actions[action_name]}")
+            self._actions[action_name] = getattr(module, action_name)
         
         return self._actions[action_name]
     
@@ -179,6 +111,12 @@ class ActionRegistry:
             默认值：无默认值时为 None
             类型注解：无注解时为 Any
         """
+        if action_name not in self._actions and action_name in self._lazy_actions:
+            # 尚未导入的操作直接从源码读取参数，列出参数不必加载模型依赖
+            try:
+                return read_param_schema(module_file(self._lazy_actions[action_name]), action_name)
+            except (OSError, SyntaxError, SchemaUnavailable) as e:
+                logging.debug(f"无法从源码读取 {action_name} 的参数，改为导入模块: {str(e)}")
         action_class = self.get_action_class(action_name)
         sig = inspect.signature(action_class.__init__)
         type_hints = get_type_hints(action_class.__init__)
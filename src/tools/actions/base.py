@@ -2,7 +2,9 @@
 基础Action接口模块 - 定义所有图像处理操作的基本接口
 """
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Iterator, Optional
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional
+
+from .batching import micro_batches
 
 
 class BaseAction(ABC):
@@ -35,6 +37,50 @@ class BaseAction(ABC):
         """
         yield item
     
+    # 是否实现了真正的批量推理（一个批次只运行一次模型），引擎只为这些操作组织微批次
+    supports_batch = False
+
+    def process_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        """
+        批量处理图像项，默认逐项调用 process
+
+        Args:
+            items: 待处理的图像项列表
+
+        Returns:
+            与输入一一对应的处理结果，被过滤掉的图像项为 None
+        """
+        return [self.process(item) for item in items]
+
+    def batch_key(self, item: Any) -> Optional[Hashable]:
+        """
+        微批次分桶键，键相同的图像项可以堆叠为一个批次（例如模型输入尺寸相同）
+
+        Args:
+            item: 图像项
+
+        Returns:
+            分桶键，为None时不分桶
+        """
+        return None
+
+    def iter_batched(self, items: Iterable[Any], batch_size: int, ordered: bool = True) -> Iterator[Any]:
+        """
+        将图像项分组为微批次，逐批调用 process_batch
+
+        Args:
+            items: 图像项序列
+            batch_size: 每个批次的最大图像数
+            ordered: 是否保持输入顺序，为False时按 batch_key 分桶
+
+        Yields:
+            处理后的图像项
+        """
+        for batch in micro_batches(items, batch_size, None if ordered else self.batch_key):
+            for result in self.process_batch(batch):
+                if result is not None:
+                    yield result
+
     def get_info(self) -> Dict[str, Any]:
         """
         获取操作的信息
@@ -0,0 +1,325 @@
+"""
+批量推理模块 - 微批次分组以及 wd14 标签模型、YOLO 检测模型的批量推理
+
+批量推理路径依赖 imgutils 的模型文件和内部函数，任何一步失败（版本不同、模型的批量维度固定为1等）
+都会抛出异常，由调用方退回逐项推理，结果与逐项推理一致。
+"""
+import math
+import inspect
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# waifuc 标签方法名称到 imgutils wd14 模型名称的映射
+WD14_MODELS = {
+    'wd14_vit': 'ViT',
+    'wd14_convnext': 'ConvNext',
+    'wd14_convnextv2': 'ConvNextV2',
+    'wd14_swinv2': 'SwinV2',
+    'wd14_moat': 'MOAT',
+    'wd14_v3_swinv2': 'SwinV2_v3',
+    'wd14_v3_convnext': 'ConvNext_v3',
+    'wd14_v3_vit': 'ViT_v3',
+}
+
+# 检测模型所在的仓库
+DETECTION_REPOS = {
+    'face': 'deepghs/anime_face_detection',
+    'person': 'deepghs/anime_person_detection',
+}
+
+
+def micro_batches(items: Iterable[Any], batch_size: int,
+                  key: Optional[Callable[[Any], Hashable]] = None) -> Iterator[List[Any]]:
+    """
+    将图像项分组为微批次
+
+    提供 key 时按 key 分桶（例如按检测模型的输入尺寸），同一批次内的图像可以直接堆叠；
+    每个桶凑满 batch_size 即输出，缓存的图像总数超过 4 个批次时输出最满的桶，避免某个桶长期等待。
+    分桶会改变输出顺序，需要保持顺序时不要提供 key。
+
+    Args:
+        items: 图像项序列
+        batch_size: 每个批次的最大图像数
+        key: 分桶函数
+
+    Yields:
+        图像项列表
+    """
+    batch_size = max(1, int(batch_size))
+    buckets: 'OrderedDict[Hashable, List[Any]]' = OrderedDict()
+    buffered = 0
+    for item in items:
+        bucket_key = key(item) if key is not None else None
+        bucket = buckets.setdefault(bucket_key, [])
+        bucket.append(item)
+        buffered += 1
+        if len(bucket) >= batch_size:
+            del buckets[bucket_key]
+            buffered -= len(bucket)
+            yield bucket
+        elif buffered >= batch_size * 4:
+            fullest = max(buckets, key=lambda k: len(buckets[k]))
+            bucket = buckets.pop(fullest)
+            buffered -= len(bucket)
+            yield bucket
+    for bucket in buckets.values():
+        yield bucket
+
+
+def _run_session(session: Any, batch: np.ndarray) -> np.ndarray:
+    input_name = session.get_inputs()[0].name
+    output_name = session.get_outputs()[0].name
+    return session.run([output_name], {input_name: batch})[0]
+
+
+def wd14_predict_batch(images: List[Image.Image], method: str) -> np.ndarray:
+    """
+    使用 wd14 模型一次推理多张图像，返回完整的分数矩阵
+
+    Args:
+        images: 图像列表
+        method: waifuc 标签方法名称，例如 'wd14_v3_swinv2'
+
+    Returns:
+        形状为 (图像数, 标签数) 的分数矩阵
+    """
+    from imgutils.tagging.wd14 import _get_wd14_model, _prepare_image_for_tagging
+
+    session = _get_wd14_model(WD14_MODELS[method])
+    _, target_size, _, _ = session.get_inputs()[0].shape
+    batch = np.concatenate([_prepare_image_for_tagging(image, target_size) for image in images])
+    return _run_session(session, batch.astype(np.float32))
+
+
+def wd14_select_tags(indices: np.ndarray, scores: np.ndarray, method: str, general_threshold: float,
+                     character_threshold: float) -> Dict[str, float]:
+    """
+    按阈值从一张图像的分数中筛选标签
+
+    Args:
+        indices: 分数对应的标签序号
+        scores: 分数
+        method: waifuc 标签方法名称
+        general_threshold: 通用标签阈值
+        character_threshold: 角色标签阈值
+
+    Returns:
+        {标签: 分数} 字典（通用标签在前、角色标签在后，与 waifuc TaggingAction 相同）
+    """
+    from imgutils.tagging.wd14 import _get_wd14_labels
+
+    tag_names, _, general_indexes, character_indexes = _get_wd14_labels(WD14_MODELS[method])
+    found = {int(index): float(score) for index, score in zip(indices, scores)}
+    tags = {}
+    for index in general_indexes:
+        if found.get(index, 0.0) > general_threshold:
+            tags[tag_names[index]] = found[index]
+    for index in character_indexes:
+        if found.get(index, 0.0) > character_threshold:
+            tags[tag_names[index]] = found[index]
+    return tags
+
+
+def wd14_tag_batch(images: List[Image.Image], method: str, general_threshold: float,
+                   character_threshold: float, cache: Any = None) -> List[Dict[str, float]]:
+    """
+    使用 wd14 模型一次推理多张图像的标签
+
+    提供标签缓存时先按图像摘要查询缓存，只推理未命中的图像，推理结果写回缓存；
+    此时标签一律从缓存保存的 float16 分数中筛选，首次运行和命中缓存时的结果完全相同。
+
+    Args:
+        images: 图像列表
+        method: waifuc 标签方法名称，例如 'wd14_v3_swinv2'
+        general_threshold: 通用标签阈值
+        character_threshold: 角色标签阈值
+        cache: 标签缓存（TagCache），为None时不使用缓存
+
+    Returns:
+        每张图像的 {标签: 分数} 字典（通用标签和角色标签合并，与 waifuc TaggingAction 相同）
+    """
+    if cache is None:
+        preds = wd14_predict_batch(images, method)
+        return [wd14_select_tags(np.arange(len(pred)), pred, method, general_threshold, character_threshold)
+                for pred in preds]
+
+    from ..cache.hashing import image_digest, package_versions
+
+    # 模型随 imgutils 版本更新，版本变化后重新推理
+    model = f"{method}@{package_versions()['imgutils']}"
+    threshold = min(general_threshold, character_threshold)
+    digests = [image_digest(image) for image in images]
+    found = cache.get_many([digest for digest in digests if digest is not None], model, threshold)
+    pending = [i for i, digest in enumerate(digests) if digest not in found]
+    if pending:
+        preds = wd14_predict_batch([images[i] for i in pending], method)
+        uncached = {}
+        for i, pred in zip(pending, preds):
+            if digests[i] is None:
+                # 多帧图像无法计算摘要，直接使用推理结果
+                found[i] = (np.arange(len(pred)), pred)
+            else:
+                uncached[digests[i]] = pred
+        found.update(cache.put_many(uncached, model, threshold))
+    return [wd14_select_tags(*found[digest if digest is not None else i], method,
+                             general_threshold, character_threshold)
+            for i, digest in enumerate(digests)]
+
+
+def default_parameter(func: Callable, name: str, fallback: Any = None) -> Any:
+    """
+    读取函数参数的默认值，用于和逐项推理使用相同的模型版本和推理尺寸
+
+    Args:
+        func: 函数
+        name: 参数名称
+        fallback: 参数不存在或没有默认值时返回的值
+
+    Returns:
+        默认值
+    """
+    try:
+        parameter = inspect.signature(func).parameters.get(name)
+    except (TypeError, ValueError):
+        return fallback
+    if parameter is None or parameter.default is inspect.Parameter.empty:
+        return fallback
+    return parameter.default
+
+
+def yolo_input_size(width: int, height: int, max_infer_size: int = 640, align: int = 32) -> Tuple[int, int]:
+    """
+    计算 YOLO 检测模型的输入尺寸：长边缩放到不超过 max_infer_size，再按 align 对齐，
+    相同输入尺寸的图像可以堆叠为一个批次
+
+    Args:
+        width: 图像宽度
+        height: 图像高度
+        max_infer_size: 最大推理尺寸
+        align: 对齐像素数
+
+    Returns:
+        (宽度, 高度)
+    """
+    ratio = min(1.0, max_infer_size / max(width, height))
+    return (int(math.ceil(width * ratio / align) * align),
+            int(math.ceil(height * ratio / align) * align))
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> List[int]:
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(int(i))
+        xx1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.maximum(0.0, xx2 - xx1) * np.maximum(0.0, yy2 - yy1)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return keep
+
+
+_yolo_sessions: Dict[Tuple[str, str], Any] = {}
+
+
+def _open_yolo_session(repo_id: str, model_name: str) -> Any:
+    if (repo_id, model_name) not in _yolo_sessions:
+        from huggingface_hub import hf_hub_download
+        from imgutils.utils import open_onnx_model
+        _yolo_sessions[(repo_id, model_name)] = open_onnx_model(
+            hf_hub_download(repo_id, f'{model_name}/model.onnx'))
+    return _yolo_sessions[(repo_id, model_name)]
+
+
+def _yolo_xy_postprocess(boxes: np.ndarray, old_size: Tuple[int, int], new_size: Tuple[int, int]) -> np.ndarray:
+    """
+    将推理尺寸上的检测框缩放回原图坐标，与 imgutils 相同：裁剪到图像范围内并取整
+    """
+    (old_width, old_height), (new_width, new_height) = old_size, new_size
+    scale = np.array([old_width / new_width, old_height / new_height] * 2)
+    bound = np.array([old_width, old_height] * 2)
+    return np.clip(boxes * scale, 0, bound).round().astype(np.int64)
+
+
+def yolo_detect_batch(images: List[Image.Image], kind: str, model_name: str, conf_threshold: float,
+                      iou_threshold: float, max_infer_size: int = 640
+                      ) -> List[List[Tuple[Tuple[int, int, int, int], float]]]:
+    """
+    使用 YOLOv8 检测模型一次推理多张图像
+
+    图像按输入尺寸分组，每组堆叠后运行一次模型。预处理和后处理与 imgutils 的逐项检测相同
+    （透明区域合成到白色背景、双三次插值缩放，检测框裁剪到图像范围内并取整），
+    因此批量结果可以与逐项检测的结果共用检测缓存条目。
+
+    Args:
+        images: 图像列表
+        kind: 检测类型（face / person）
+        model_name: 模型名称，例如 'face_detect_v1.4_s'
+        conf_threshold: 置信度阈值
+        iou_threshold: NMS 的 IOU 阈值
+        max_infer_size: 最大推理尺寸
+
+    Returns:
+        每张图像的 [((x0, y0, x1, y1), 置信度), ...] 列表
+    """
+    from imgutils.data import load_image
+
+    session = _open_yolo_session(DETECTION_REPOS[kind], model_name)
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for index, image in enumerate(images):
+        groups.setdefault(yolo_input_size(image.width, image.height, max_infer_size), []).append(index)
+
+    results: List[Any] = [None] * len(images)
+    for (width, height), indexes in groups.items():
+        batch = np.stack([
+            np.asarray(load_image(images[i], mode='RGB', force_background='white')
+                       .resize((width, height), Image.BICUBIC), dtype=np.float32).transpose(2, 0, 1) / 255.0
+            for i in indexes
+        ])
+        output = _run_session(session, batch)
+        for i, prediction in zip(indexes, output):
+            prediction = prediction.T
+            scores = prediction[:, 4:].max(axis=1)
+            prediction, scores = prediction[scores > conf_threshold], scores[scores > conf_threshold]
+            x, y, w, h = prediction[:, 0], prediction[:, 1], prediction[:, 2], prediction[:, 3]
+            boxes = np.stack([x - w / 2, y - h / 2, x + w / 2, y + h / 2], axis=1)
+            keep = _nms(boxes, scores, iou_threshold)
+            boxes = _yolo_xy_postprocess(boxes[keep], images[i].size, (width, height))
+            results[i] = [(tuple(int(v) for v in box), float(scores[k])) for box, k in zip(boxes, keep)]
+    return results
+
+
+# 批量推理失败过的动作，进程内不再尝试批量推理
+_batch_disabled = set()
+
+
+def batch_or_fallback(batch_fn: Callable[[List[Any]], List[Any]], item_fn: Callable[[Any], Any],
+                      items: List[Any], name: str) -> List[Any]:
+    """
+    优先批量推理，失败时逐项推理
+
+    Args:
+        batch_fn: 批量处理函数
+        item_fn: 逐项处理函数
+        items: 图像项列表
+        name: 动作名称，用于日志
+
+    Returns:
+        与输入一一对应的结果列表
+    """
+    if len(items) > 1 and name not in _batch_disabled:
+        try:
+            return batch_fn(items)
+        except Exception as e:
+            # 失败通常是环境原因（imgutils 版本、模型不支持批量），之后不再尝试
+            _batch_disabled.add(name)
+            logging.warning(f"{name} 批量推理失败，之后改为逐项推理: {str(e)}")
+    return [item_fn(item) for item in items]
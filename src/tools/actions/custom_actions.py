@@ -8,7 +8,7 @@ from PIL import Image, ImageDraw
 from waifuc.model import ImageItem
 from waifuc.action import ProcessAction
 from waifuc.source import LocalSource
-from imgutils.detect.head import detect_heads
+from .detection import cached_detector
 
 class PreSortImagesAction(ProcessAction):
     """
@@ -154,7 +154,7 @@ class HeadCoverAction(ProcessAction):
 
             # 检测头部区域
             head_areas = []
-            for (x0, y0, x1, y1), _, _ in detect_heads(
+            for (x0, y0, x1, y1), _, _ in cached_detector('detect_heads')(
                 item.image,
                 model_name=self.model,
                 conf_threshold=self.conf_threshold,
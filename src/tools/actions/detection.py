@@ -0,0 +1,243 @@
+"""
+检测模块 - 带缓存的 imgutils 目标检测函数
+
+waifuc 的检测类动作（人脸、头部、人物数量过滤，人物分割，三阶段分割，头部裁剪）和自定义的
+HeadCoverAction 都调用 imgutils.detect 中的检测函数。这里把这些函数包装为先查询检测缓存的版本，
+并替换 waifuc 动作模块中引用的函数，同一张图像在一个工作流中只检测一次，再次运行时直接读取缓存。
+检测缓存未启用时，包装后的函数直接调用原函数。
+"""
+import sys
+import inspect
+import weakref
+import functools
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .batching import yolo_detect_batch
+from ..cache.hashing import image_digest, package_versions
+from ..cache.detection_cache import (
+    DEFAULT_CONF_FLOOR, Detection, DetectionCache, filter_detections, get_detection_cache
+)
+
+# imgutils 检测函数名称到检测类型的映射
+DETECTORS = {
+    'detect_faces': 'face',
+    'detect_heads': 'head',
+    'detect_person': 'person',
+    'detect_halfbody': 'halfbody',
+    'detect_eyes': 'eye',
+}
+
+_wrapped: Dict[str, Callable[..., List[Detection]]] = {}
+# 最近检测过的图像，用于在裁剪出的图像上复用父图像的检测结果
+_parents: Deque[Tuple['weakref.ref[Image.Image]', str]] = deque(maxlen=16)
+_parents_lock = threading.Lock()
+
+
+def detector_key(kind: str, model_name: str, max_infer_size: Any, iou_threshold: Any) -> str:
+    """
+    生成检测器键，检测类型、模型、推理尺寸、IOU 阈值或 imgutils 版本不同的结果互不复用
+
+    Args:
+        kind: 检测类型（face / head / person / halfbody / eye）
+        model_name: 模型名称
+        max_infer_size: 最大推理尺寸
+        iou_threshold: NMS 的 IOU 阈值
+
+    Returns:
+        检测器键
+    """
+    return f"{kind}|{model_name}|{max_infer_size}|{iou_threshold}|{package_versions()['imgutils']}"
+
+
+def _model_name(kind: str, arguments: Dict[str, Any]) -> str:
+    """
+    根据检测函数的参数确定模型名称，与批量推理路径使用的名称一致
+    """
+    if arguments.get('model_name'):
+        return arguments['model_name']
+    return f"{kind}_detect_{arguments.get('version') or 'best'}_{arguments.get('level')}"
+
+
+def _remember_parent(image: Image.Image, digest: str) -> None:
+    with _parents_lock:
+        if not any(ref() is image for ref, _ in _parents):
+            _parents.append((weakref.ref(image), digest))
+
+
+def _crop_offset(cache: DetectionCache, parent: Image.Image, parent_digest: str,
+                 image: Image.Image) -> Optional[Tuple[int, int]]:
+    """
+    判断图像是否是按父图像的某个检测框裁剪得到的，是则返回裁剪位置
+    """
+    if parent.mode != image.mode:
+        return None
+    width, height = image.size
+    for (x0, y0, x1, y1), _, _ in cache.memory_detections(parent_digest):
+        if abs((x1 - x0) - width) > 1 or abs((y1 - y0) - height) > 1:
+            continue
+        for x, y in {(int(x0), int(y0)), (round(x0), round(y0))}:
+            if x < 0 or y < 0 or x + width > parent.width or y + height > parent.height:
+                continue
+            if parent.crop((x, y, x + width, y + height)).tobytes() == image.tobytes():
+                return x, y
+    return None
+
+
+def _reuse_parent(cache: DetectionCache, image: Image.Image, detector: str,
+                  max_infer_size: Any) -> Optional[Tuple[float, List[Detection]]]:
+    """
+    在裁剪出的图像上复用父图像的检测结果
+
+    只在几何关系允许时复用：父图像不超过最大推理尺寸（检测时没有缩小，与裁剪图像的尺度相同），
+    并且父图像的检测框都不跨越裁剪边界（否则裁剪图像上会出现父图像中没有的部分目标）。
+
+    Returns:
+        (最低置信度, 平移到裁剪图像坐标的检测结果)，无法复用时返回None
+    """
+    if not isinstance(max_infer_size, (int, float)):
+        return None
+    with _parents_lock:
+        parents = [(ref(), digest) for ref, digest in reversed(_parents)]
+    for parent, parent_digest in parents:
+        if parent is None or parent is image or max(parent.size) > max_infer_size or \
+                parent.width < image.width or parent.height < image.height:
+            continue
+        entry = cache.lookup(parent_digest, detector)
+        if entry is None:
+            continue
+        offset = _crop_offset(cache, parent, parent_digest, image)
+        if offset is None:
+            continue
+        (x, y), (width, height) = offset, image.size
+        floor, detections = entry
+        reused = []
+        for (x0, y0, x1, y1), label, score in detections:
+            if x1 <= x or x0 >= x + width or y1 <= y or y0 >= y + height:
+                continue
+            if x0 < x or y0 < y or x1 > x + width or y1 > y + height:
+                return None
+            reused.append(((x0 - x, y0 - y, x1 - x, y1 - y), label, score))
+        return floor, reused
+    return None
+
+
+def _wrap(func: Callable[..., List[Detection]], kind: str) -> Callable[..., List[Detection]]:
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def detect(*args, **kwargs) -> List[Detection]:
+        cache = get_detection_cache()
+        if cache is None:
+            return func(*args, **kwargs)
+        try:
+            bound = signature.bind(*args, **kwargs)
+        except TypeError:
+            return func(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        image = arguments.get('image')
+        conf_threshold = arguments.get('conf_threshold')
+        if not isinstance(image, Image.Image) or not isinstance(conf_threshold, (int, float)):
+            return func(*args, **kwargs)
+        digest = image_digest(image)
+        if digest is None:
+            return func(*args, **kwargs)
+
+        detector = detector_key(kind, _model_name(kind, arguments), arguments.get('max_infer_size'),
+                                arguments.get('iou_threshold'))
+        cached = cache.get(digest, detector, conf_threshold)
+        if cached is not None:
+            _remember_parent(image, digest)
+            return cached
+        reused = _reuse_parent(cache, image, detector, arguments.get('max_infer_size'))
+        if reused is not None and reused[0] <= conf_threshold:
+            # 推算的结果只保存在内存中，不写入持久化缓存
+            cache.put(digest, detector, reused[0], reused[1], persist=False)
+            _remember_parent(image, digest)
+            return filter_detections(reused[1], conf_threshold)
+
+        floor = min(conf_threshold, DEFAULT_CONF_FLOOR)
+        arguments['conf_threshold'] = floor
+        detections = cache.put(digest, detector, floor, func(*bound.args, **bound.kwargs))
+        _remember_parent(image, digest)
+        return filter_detections(detections, conf_threshold)
+
+    return detect
+
+
+def cached_detect_batch(images: List[Image.Image], kind: str, model_name: str, conf_threshold: float,
+                        iou_threshold: float, max_infer_size: int = 640
+                        ) -> List[List[Tuple[Tuple[float, float, float, float], float]]]:
+    """
+    批量检测，先查询检测缓存，只对未命中的图像运行 yolo_detect_batch，与逐项检测共用缓存条目
+
+    Args:
+        images: 图像列表
+        kind: 检测类型（face / person）
+        model_name: 模型名称
+        conf_threshold: 置信度阈值
+        iou_threshold: NMS 的 IOU 阈值
+        max_infer_size: 最大推理尺寸
+
+    Returns:
+        每张图像的 [((x0, y0, x1, y1), 置信度), ...]，与 yolo_detect_batch 相同
+    """
+    cache = get_detection_cache()
+    if cache is None:
+        return yolo_detect_batch(images, kind, model_name, conf_threshold, iou_threshold, max_infer_size)
+
+    detector = detector_key(kind, model_name, max_infer_size, iou_threshold)
+    digests = [image_digest(image) for image in images]
+    results: List[Optional[List[Detection]]] = [
+        cache.get(digest, detector, conf_threshold) if digest is not None else None for digest in digests]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        floor = min(conf_threshold, DEFAULT_CONF_FLOOR)
+        detections = yolo_detect_batch([images[i] for i in pending], kind, model_name, floor,
+                                       iou_threshold, max_infer_size)
+        for i, boxes in zip(pending, detections):
+            found = [(box, kind, score) for box, score in boxes]
+            if digests[i] is not None:
+                found = cache.put(digests[i], detector, floor, found)
+            results[i] = filter_detections(found, conf_threshold)
+    for image, digest in zip(images, digests):
+        if digest is not None:
+            _remember_parent(image, digest)
+    return [[(box, score) for box, _, score in result] for result in results]
+
+
+def cached_detector(name: str) -> Callable[..., List[Detection]]:
+    """
+    获取带缓存的 imgutils 检测函数
+
+    Args:
+        name: imgutils.detect 中的函数名称，例如 'detect_heads'
+
+    Returns:
+        与原函数参数相同的检测函数
+    """
+    if name not in _wrapped:
+        import imgutils.detect
+        _wrapped[name] = _wrap(getattr(imgutils.detect, name), DETECTORS[name])
+    return _wrapped[name]
+
+
+def install_detection_cache() -> None:
+    """
+    将已导入的 waifuc 动作模块中引用的 imgutils 检测函数替换为带缓存的版本，可以重复调用
+    """
+    try:
+        import imgutils.detect
+    except ImportError:
+        return
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not module_name.startswith('waifuc.action'):
+            continue
+        for name in DETECTORS:
+            original = getattr(imgutils.detect, name, None)
+            if original is not None and getattr(module, name, None) is original:
+                setattr(module, name, cached_detector(name))
@@ -0,0 +1,154 @@
+"""
+特征模块 - 带持久化存储的 imgutils 特征提取函数
+
+waifuc 的 FilterSimilarAction 和 CCIPAction 分别调用 imgutils.metrics 中的 lpips_extract_feature 和
+ccip_extract_feature 为每张图像提取特征。这里把这些函数包装为先查询特征存储的版本，并替换 waifuc 动作模块中
+引用的函数，再次运行或对另一个数据集去重时直接读取已保存的特征。特征存储未启用时，包装后的函数直接调用原函数。
+"""
+import sys
+import inspect
+import functools
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image
+
+from ..cache.hashing import canonical_json, image_digest, package_versions
+from ..cache.embedding_store import EmbeddingStore, get_embedding_store
+
+# imgutils 特征提取函数名称到 (特征类型, 保存类型) 的映射
+# LPIPS 的各层特征很大，以 float16 保存（只用于计算差异，精度足够）
+EXTRACTORS = {
+    'lpips_extract_feature': ('lpips', 'float16'),
+    'ccip_extract_feature': ('ccip', 'float32'),
+}
+
+_wrapped: Dict[str, Callable[..., Any]] = {}
+_signatures: Dict[str, inspect.Signature] = {}
+
+
+def _original(name: str) -> Callable[..., Any]:
+    import imgutils.metrics
+    return getattr(imgutils.metrics, name)
+
+
+def embedding_key(name: str, arguments: Dict[str, Any]) -> str:
+    """
+    生成模型键，特征类型、模型参数或 imgutils 版本不同的特征互不复用
+
+    Args:
+        name: imgutils 特征提取函数名称
+        arguments: 除图像外的全部参数（包括默认值）
+
+    Returns:
+        模型键
+    """
+    options = canonical_json({key: value for key, value in arguments.items() if key != 'image'})
+    return f"{EXTRACTORS[name][0]}:{options}@{package_versions()['imgutils']}"
+
+
+def embedding_store(name: str, **options) -> Optional[EmbeddingStore]:
+    """
+    获取特征提取函数在给定参数下使用的特征存储
+
+    Args:
+        name: imgutils 特征提取函数名称
+        **options: 除图像外的参数，未提供的参数使用函数的默认值
+
+    Returns:
+        特征存储，未启用时返回None
+    """
+    if name not in _signatures:
+        _signatures[name] = inspect.signature(_original(name))
+    bound = _signatures[name].bind_partial(**options)
+    bound.apply_defaults()
+    return get_embedding_store(embedding_key(name, dict(bound.arguments)), EXTRACTORS[name][1])
+
+
+def _wrap(func: Callable[..., Any], name: str) -> Callable[..., Any]:
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def extract(*args, **kwargs) -> Any:
+        try:
+            bound = signature.bind(*args, **kwargs)
+        except TypeError:
+            return func(*args, **kwargs)
+        bound.apply_defaults()
+        image = bound.arguments.get('image')
+        digest = image_digest(image) if isinstance(image, Image.Image) else None
+        if digest is None:
+            return func(*args, **kwargs)
+        store = get_embedding_store(embedding_key(name, dict(bound.arguments)), EXTRACTORS[name][1])
+        if store is None:
+            return func(*args, **kwargs)
+        feature = store.get(digest)
+        if feature is None:
+            feature = func(*args, **kwargs)
+            store.put(digest, feature)
+            # 与再次运行时从存储读取的特征保持一致
+            feature = store.round_trip(feature)
+        return feature
+
+    return extract
+
+
+def stored_features(images: List[Image.Image], name: str, extract_batch: Callable[[List[Image.Image]], List[Any]],
+                    **options) -> List[Any]:
+    """
+    批量提取特征，先查询特征存储，只对未命中的图像调用 extract_batch，与逐项提取共用存储
+
+    Args:
+        images: 图像列表
+        name: 对应的 imgutils 逐项特征提取函数名称，用于确定模型键
+        extract_batch: 批量提取函数
+        **options: 特征提取参数（与逐项提取函数的参数相同）
+
+    Returns:
+        每张图像的特征
+    """
+    store = embedding_store(name, **options)
+    if store is None:
+        return list(extract_batch(images))
+    digests = [image_digest(image) for image in images]
+    found = store.get_many(digest for digest in digests if digest is not None)
+    pending = [i for i, digest in enumerate(digests) if digest not in found]
+    features = [found.get(digest) for digest in digests]
+    if pending:
+        for i, feature in zip(pending, extract_batch([images[i] for i in pending])):
+            features[i] = feature
+        store.put_many({digests[i]: features[i] for i in pending if digests[i] is not None})
+        for i in pending:
+            features[i] = store.round_trip(features[i])
+    return features
+
+
+def stored_extractor(name: str) -> Callable[..., Any]:
+    """
+    获取带特征存储的 imgutils 特征提取函数
+
+    Args:
+        name: imgutils.metrics 中的函数名称，例如 'ccip_extract_feature'
+
+    Returns:
+        与原函数参数相同的特征提取函数
+    """
+    if name not in _wrapped:
+        _wrapped[name] = _wrap(_original(name), name)
+    return _wrapped[name]
+
+
+def install_embedding_store() -> None:
+    """
+    将已导入的 waifuc 动作模块中引用的 imgutils 特征提取函数替换为带特征存储的版本，可以重复调用
+    """
+    try:
+        import imgutils.metrics
+    except ImportError:
+        return
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not module_name.startswith('waifuc.action'):
+            continue
+        for name in EXTRACTORS:
+            original = getattr(imgutils.metrics, name, None)
+            if original is not None and getattr(module, name, None) is original:
+                setattr(module, name, stored_extractor(name))
@@ -2,7 +2,6 @@
 enhance_actions.py - 图像增强相关的动作
 """
 from typing import Optional
-import torch
 from .waifuc_actions import WaifucActionWrapper
 from waifuc.action import (
     ESRGANAction as WaifucESRGANAction,
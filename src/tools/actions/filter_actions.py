@@ -1,8 +1,13 @@
 """
 filter_actions.py - 图像过滤相关的动作
 """
-from typing import Optional, List
+from typing import Any, Hashable, Iterable, Iterator, Optional, List
 from .waifuc_actions import WaifucActionWrapper
+from .batching import batch_or_fallback, default_parameter, micro_batches, yolo_input_size
+from .detection import cached_detect_batch, install_detection_cache
+from .embeddings import install_embedding_store, stored_extractor, stored_features
+from .similarity import IndexedFilterSimilarAction
+from .phash import PHashDedupFilterAction, hash_images
 from waifuc.action import (
     FilterSimilarAction as WaifucFilterSimilarAction,
     MinSizeFilterAction as WaifucMinSizeFilterAction,
@@ -19,21 +24,63 @@ from waifuc.action import (
     SliceSelectAction as WaifucSliceSelectAction
 )
 
+# 让 waifuc 动作内部的检测和特征提取调用经过检测缓存和特征存储
+install_detection_cache()
+install_embedding_store()
+
 class FilterSimilarAction(WaifucActionWrapper):
     """
     使用LPIPS过滤相似或重复图像。
+
+    启用特征存储时，LPIPS 特征按图像内容保存，再次运行时不需要重新提取。
+    索引模式下与全部已保留的图像比较（不受 capacity 限制），见 similarity 模块。
     
     参数:
         mode (str): 过滤模式，'all' 或 'group'，默认 'all'。
         threshold (float): 相似性阈值，默认为 0.45。
-        capacity (int): 特征缓存容量，默认为 500。
+        capacity (int): 特征缓存容量，默认为 500；索引模式下为特征存储不可用时内存中保留的特征数。
         rtol (float): 宽高比相对误差，默认为 5e-2。
         atol (float): 宽高比绝对误差，默认为 2e-2。
+        index (bool): 是否使用索引模式，默认为 False。
+        hash_prefilter (bool): 索引模式下图像较多时是否先用 LSH 预筛选候选，默认为 True。
     """
     def __init__(self, mode: str = 'all', threshold: float = 0.45,
-                 capacity: int = 500, rtol: float = 5e-2, atol: float = 2e-2):
-        super().__init__(WaifucFilterSimilarAction, mode=mode, threshold=threshold,
-                        capacity=capacity, rtol=rtol, atol=atol)
+                 capacity: int = 500, rtol: float = 5e-2, atol: float = 2e-2,
+                 index: bool = False, hash_prefilter: bool = True):
+        if index:
+            super().__init__(IndexedFilterSimilarAction, mode=mode, threshold=threshold,
+                            rtol=rtol, atol=atol, hash_prefilter=hash_prefilter, max_memory_features=capacity)
+        else:
+            super().__init__(WaifucFilterSimilarAction, mode=mode, threshold=threshold,
+                            capacity=capacity, rtol=rtol, atol=atol)
+
+class PHashDedupAction(WaifucActionWrapper):
+    """
+    使用感知哈希（pHash / dHash）快速过滤完全相同和几乎相同的图像。
+
+    只需要很小的灰度缩略图，开销远小于 LPIPS，适合放在 FilterSimilarAction 或 TaggingAction 之前
+    先去掉重复上传的图像。指定哈希集合时还会与之前运行保留的图像去重
+    （同一数据集以同一哈希集合重复运行时，之前保留的图像都会被过滤）。
+    
+    参数:
+        method (str): 哈希算法，'phash' 或 'dhash'，默认为 'phash'。
+        max_distance (int): 视为重复的最大汉明距离（0 到 32，0 只过滤哈希完全相同的图像），默认为 4。
+        hash_set (str): 持久化哈希集合的名称，默认为空（只在本次运行的图像中去重）。
+    """
+    supports_batch = True
+
+    def __init__(self, method: str = 'phash', max_distance: int = 4, hash_set: str = ''):
+        super().__init__(PHashDedupFilterAction, method=method, max_distance=max_distance, hash_set=hash_set)
+
+    def iter_batched(self, items: Iterable[Any], batch_size: int, ordered: bool = True) -> Iterator[Any]:
+        """
+        按批次计算哈希（一个批次只做一次 DCT 矩阵乘法），再按输入顺序逐项去重；结果依赖输入顺序，因此不分桶
+        """
+        for batch in micro_batches(items, batch_size):
+            hashes = hash_images([item.image for item in batch], self.params['method'])
+            for item, keep in zip(batch, self.action.accept_many(hashes)):
+                if keep:
+                    yield item
 
 class MinSizeFilterAction(WaifucActionWrapper):
     """
@@ -103,11 +150,36 @@ class FaceCountAction(WaifucActionWrapper):
         conf_threshold (float): 置信度阈值，默认为 0.25。
         iou_threshold (float): IOU 阈值，默认为 0.7。
     """
+    supports_batch = True
+
     def __init__(self, min_count: Optional[int] = None, max_count: Optional[int] = None,
                  level: str = 's', version: str = 'v1.4', conf_threshold: float = 0.25, iou_threshold: float = 0.7):
         super().__init__(WaifucFaceCountAction, min_count=min_count, max_count=max_count,
                         level=level, version=version, conf_threshold=conf_threshold, iou_threshold=iou_threshold)
 
+    def batch_key(self, item: Any) -> Hashable:
+        return yolo_input_size(item.image.width, item.image.height, self._max_infer_size())
+
+    def process_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        """
+        批量检测人脸，输入尺寸相同的图像只运行一次模型
+        """
+        return batch_or_fallback(self._count_batch, lambda item: next(self.iter(item), None), items,
+                                 self.__class__.__name__)
+
+    @staticmethod
+    def _max_infer_size() -> int:
+        from imgutils.detect import detect_faces
+        return default_parameter(detect_faces, 'max_infer_size', 640)
+
+    def _count_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        p = self.params
+        detections = cached_detect_batch([item.image for item in items], 'face',
+                                         f"face_detect_{p['version']}_{p['level']}",
+                                         p['conf_threshold'], p['iou_threshold'], self._max_infer_size())
+        return [item if _count_in_range(len(boxes), p['min_count'], p['max_count']) else None
+                for item, boxes in zip(items, detections)]
+
 class HeadCountAction(WaifucActionWrapper):
     """
     根据头部数量过滤图像。
@@ -118,6 +190,9 @@ class HeadCountAction(WaifucActionWrapper):
         level (str): 检测级别，默认为 's'。
         conf_threshold (float): 置信度阈值，默认为 0.3。
         iou_threshold (float): IOU 阈值，默认为 0.7。
+
+    头部检测的模型由 imgutils 的 detect_heads 决定，无法确定批量推理应使用的模型，因此始终逐项检测
+    （检测结果仍经过检测缓存）。
     """
     def __init__(self, min_count: Optional[int] = None, max_count: Optional[int] = None,
                  level: str = 's', conf_threshold: float = 0.3, iou_threshold: float = 0.7):
@@ -135,14 +210,49 @@ class PersonRatioAction(WaifucActionWrapper):
         conf_threshold (float): 置信度阈值，默认为 0.3。
         iou_threshold (float): IOU 阈值，默认为 0.5。
     """
+    supports_batch = True
+
     def __init__(self, ratio: float = 0.4, level: str = 'm', version: str = 'v1.1',
                  conf_threshold: float = 0.3, iou_threshold: float = 0.5):
         super().__init__(WaifucPersonRatioAction, ratio=ratio, level=level, version=version,
                         conf_threshold=conf_threshold, iou_threshold=iou_threshold)
 
+    def batch_key(self, item: Any) -> Hashable:
+        return yolo_input_size(item.image.width, item.image.height, self._max_infer_size())
+
+    def process_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        """
+        批量检测人物，输入尺寸相同的图像只运行一次模型
+        """
+        return batch_or_fallback(self._ratio_batch, lambda item: next(self.iter(item), None), items,
+                                 self.__class__.__name__)
+
+    @staticmethod
+    def _max_infer_size() -> int:
+        from imgutils.detect import detect_person
+        return default_parameter(detect_person, 'max_infer_size', 640)
+
+    def _ratio_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        p = self.params
+        detections = cached_detect_batch([item.image for item in items], 'person',
+                                         f"person_detect_{p['version']}_{p['level']}",
+                                         p['conf_threshold'], p['iou_threshold'], self._max_infer_size())
+        results = []
+        for item, boxes in zip(items, detections):
+            # 与 waifuc 相同：只保留恰好检测到一个人物且人物区域占比足够的图像
+            if len(boxes) != 1:
+                results.append(None)
+                continue
+            (x0, y0, x1, y1), _ = boxes[0]
+            area = abs((x1 - x0) * (y1 - y0))
+            results.append(item if area >= p['ratio'] * item.image.width * item.image.height else None)
+        return results
+
 class CCIPAction(WaifucActionWrapper):
     """
     使用CCIP特征聚类过滤相似图像。
+
+    启用特征存储时，CCIP 特征按图像内容和模型保存，再次运行时不需要重新提取。
     
     参数:
         init_source (Optional): 初始图像源，默认为 None。
@@ -156,6 +266,8 @@ class CCIPAction(WaifucActionWrapper):
         model (str): 模型名称，默认为 'ccip-caformer-24-randaug-pruned'。
         threshold (Optional[float]): 相似性阈值，默认为 None。
     """
+    supports_batch = True
+
     def __init__(self, init_source=None, min_val_count: int = 15, step: int = 5,
                  ratio_threshold: float = 0.6, min_clu_dump_ratio: float = 0.3, cmp_threshold: float = 0.5,
                  eps: Optional[float] = None, min_samples: Optional[int] = None,
@@ -165,6 +277,43 @@ class CCIPAction(WaifucActionWrapper):
                         cmp_threshold=cmp_threshold, eps=eps, min_samples=min_samples,
                         model=model, threshold=threshold)
 
+    def iter_batched(self, items: Iterable[Any], batch_size: int, ordered: bool = True) -> Iterator[Any]:
+        """
+        按批次提取 CCIP 特征并写入元数据的 ccip_feature（waifuc 的 CCIPAction 会直接使用），
+        再交给 waifuc 的 CCIPAction 聚类过滤；聚类依赖输入顺序，因此不分桶
+        """
+        from waifuc.model import ImageItem
+
+        prefetched = set()
+
+        def with_features() -> Iterator[Any]:
+            for batch in micro_batches(items, batch_size):
+                pending = [item for item in batch if 'ccip_feature' not in item.meta]
+                features = batch_or_fallback(self._extract_batch, self._extract_one, pending,
+                                             self.__class__.__name__)
+                by_id = {id(item): feature for item, feature in zip(pending, features)}
+                for item in batch:
+                    if id(item) in by_id:
+                        prefetched.add(id(item.image))
+                        item = ImageItem(item.image, {**item.meta, 'ccip_feature': by_id[id(item)]})
+                    yield item
+
+        for item in self.action.iter_from(with_features()):
+            # 预先提取的特征只用于聚类，不随结果输出
+            if id(item.image) in prefetched and 'ccip_feature' in item.meta:
+                item = ImageItem(item.image, {k: v for k, v in item.meta.items() if k != 'ccip_feature'})
+            yield item
+
+    def _extract_batch(self, items: List[Any]) -> List[Any]:
+        from imgutils.metrics import ccip_batch_extract_features
+
+        model = self.params['model']
+        return stored_features([item.image for item in items], 'ccip_extract_feature',
+                               lambda images: list(ccip_batch_extract_features(images, model=model)), model=model)
+
+    def _extract_one(self, item: Any) -> Any:
+        return stored_extractor('ccip_extract_feature')(item.image, model=self.params['model'])
+
 class FirstNSelectAction(WaifucActionWrapper):
     """
     选择前N张图像。
@@ -185,4 +334,11 @@ class SliceSelectAction(WaifucActionWrapper):
         step (Optional[int]): 步长，默认为 None。
     """
     def __init__(self, start: Optional[int] = None, stop: Optional[int] = None, step: Optional[int] = None):
-        super().__init__(WaifucSliceSelectAction, start=start, stop=stop, step=step)
\ No newline at end of file
+        super().__init__(WaifucSliceSelectAction, start=start, stop=stop, step=step)
+
+
+def _count_in_range(count: int, min_count: Optional[int], max_count: Optional[int]) -> bool:
+    """
+    判断检测数量是否在 [min_count, max_count] 范围内，边界为 None 时不限制
+    """
+    return (min_count is None or count >= min_count) and (max_count is None or count <= max_count)
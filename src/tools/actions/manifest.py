@@ -0,0 +1,148 @@
+"""
+动作清单模块 - 记录操作名称、类别和所在模块，并在不导入模块的情况下读取参数定义
+
+注册表启动时只读取清单，界面列出操作和参数时解析模块源码，
+只有真正创建操作实例时才导入对应模块（以及其依赖的 waifuc、imgutils、torch）。
+"""
+import os
+import ast
+import typing
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+# 操作类别，顺序即界面中的显示顺序
+CATEGORIES = ["转换", "过滤", "变换", "分割", "对齐", "标签", "自定义", "安全", "调试", "文件名", "头部处理", "增强"]
+
+# (类别, 操作名称, 所在模块)
+ACTION_MANIFEST: List[Tuple[str, str, str]] = [
+    ("转换", "ModeConvertAction", "transform_actions"),
+    ("转换", "BackgroundRemovalAction", "transform_actions"),
+    ("变换", "RandomChoiceAction", "augment_actions"),
+    ("变换", "RandomFilenameAction", "augment_actions"),
+    ("变换", "MirrorAction", "augment_actions"),
+    ("变换", "CharacterEnhanceAction", "augment_actions"),
+    ("对齐", "AlignMaxSizeAction", "transform_actions"),
+    ("对齐", "AlignMinSizeAction", "transform_actions"),
+    ("对齐", "AlignMaxAreaAction", "transform_actions"),
+    ("对齐", "PaddingAlignAction", "transform_actions"),
+    ("分割", "ThreeStageSplitAction", "split_actions"),
+    ("分割", "PersonSplitAction", "split_actions"),
+    ("分割", "FrameSplitAction", "split_actions"),
+    ("标签", "TaggingAction", "tagging_actions"),
+    ("标签", "TagFilterAction", "tagging_actions"),
+    ("标签", "TagOverlapDropAction", "tagging_actions"),
+    ("标签", "TagDropAction", "tagging_actions"),
+    ("标签", "BlacklistedTagDropAction", "tagging_actions"),
+    ("标签", "TagRemoveUnderlineAction", "tagging_actions"),
+    ("过滤", "FilterSimilarAction", "filter_actions"),
+    ("过滤", "PHashDedupAction", "filter_actions"),
+    ("过滤", "MinSizeFilterAction", "filter_actions"),
+    ("过滤", "MinAreaFilterAction", "filter_actions"),
+    ("过滤", "NoMonochromeAction", "filter_actions"),
+    ("过滤", "OnlyMonochromeAction", "filter_actions"),
+    ("过滤", "ClassFilterAction", "filter_actions"),
+    ("过滤", "RatingFilterAction", "filter_actions"),
+    ("过滤", "FaceCountAction", "filter_actions"),
+    ("过滤", "HeadCountAction", "filter_actions"),
+    ("过滤", "PersonRatioAction", "filter_actions"),
+    ("过滤", "CCIPAction", "filter_actions"),
+    ("过滤", "FirstNSelectAction", "filter_actions"),
+    ("过滤", "SliceSelectAction", "filter_actions"),
+    ("安全", "SafetyAction", "misc_actions"),
+    ("调试", "ArrivalAction", "misc_actions"),
+    ("文件名", "FileExtAction", "misc_actions"),
+    ("文件名", "FileOrderAction", "misc_actions"),
+    ("头部处理", "HeadCutOutAction", "misc_actions"),
+    ("自定义", "PreSortImagesAction", "custom_actions"),
+    ("自定义", "EnhancedImageProcessAction", "custom_actions"),
+    ("自定义", "ProcessRatioGroupAction", "custom_actions"),
+    ("自定义", "HeadCoverAction", "custom_actions"),
+    ("增强", "ESRGANActionWrapper", "enhance_actions"),
+    ("增强", "SmartCropActionWrapper", "enhance_actions"),
+]
+
+# 解析参数类型注解时可用的名称
+_ANNOTATION_NAMESPACE = {name: getattr(typing, name) for name in typing.__all__}
+_ANNOTATION_NAMESPACE.update({'int': int, 'float': float, 'str': str, 'bool': bool,
+                              'dict': dict, 'list': list, 'tuple': tuple, 'None': None})
+
+
+class SchemaUnavailable(Exception):
+    """
+    无法从源码得到参数定义（例如默认值或注解不是字面量），需要导入模块后用 inspect 读取
+    """
+    pass
+
+
+@lru_cache(maxsize=None)
+def _parse_module(module_path: str) -> ast.Module:
+    with open(module_path, encoding='utf-8') as f:
+        return ast.parse(f.read(), filename=module_path)
+
+
+def _literal(node: ast.AST) -> Any:
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise SchemaUnavailable(f"无法解析默认值: {ast.unparse(node)}")
+
+
+def _annotation(node: ast.AST) -> Any:
+    if node is None:
+        return Any
+    try:
+        return eval(compile(ast.Expression(node), '<annotation>', 'eval'), {'__builtins__': {}},
+                   dict(_ANNOTATION_NAMESPACE))
+    except Exception:
+        raise SchemaUnavailable(f"无法解析类型注解: {ast.unparse(node)}")
+
+
+def read_param_schema(module_path: str, class_name: str) -> Dict[str, Tuple[Any, Any]]:
+    """
+    从模块源码读取类 __init__ 的参数定义，结果与 inspect.signature 加 get_type_hints 相同
+
+    Args:
+        module_path: 模块文件路径
+        class_name: 类名称
+
+    Returns:
+        参数信息字典，键为参数名，值为 (默认值, 类型注解) 元组
+
+    Raises:
+        SchemaUnavailable: 类没有在模块中定义 __init__，或参数使用了无法静态解析的默认值或注解
+    """
+    for node in _parse_module(module_path).body:
+        if isinstance(node, ast.ClassDef) and node.name == class_name:
+            init = next((item for item in node.body
+                         if isinstance(item, ast.FunctionDef) and item.name == '__init__'), None)
+            break
+    else:
+        raise SchemaUnavailable(f"模块 {module_path} 中没有类 {class_name}")
+    if init is None:
+        raise SchemaUnavailable(f"{class_name} 没有定义 __init__")
+
+    args = init.args
+    if args.vararg is not None or args.kwarg is not None:
+        raise SchemaUnavailable(f"{class_name}.__init__ 使用了可变参数")
+    positional = args.posonlyargs + args.args
+    defaults = [None] * (len(positional) - len(args.defaults)) + list(args.defaults)
+    pairs = list(zip(positional, defaults)) + list(zip(args.kwonlyargs, args.kw_defaults))
+    params = {}
+    for arg, default in pairs:
+        if arg.arg == 'self':
+            continue
+        params[arg.arg] = (_literal(default) if default is not None else None, _annotation(arg.annotation))
+    return params
+
+
+def module_file(module_name: str) -> str:
+    """
+    获取动作模块的源码路径
+
+    Args:
+        module_name: 模块名称（不含包名）
+
+    Returns:
+        源码文件路径
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{module_name}.py")
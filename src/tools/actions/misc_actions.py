@@ -3,6 +3,7 @@ misc_actions.py - 其他杂项动作
 """
 from typing import Optional, Mapping, Any, Union, Tuple
 from .waifuc_actions import WaifucActionWrapper
+from .detection import install_detection_cache
 from waifuc.action import (
     SafetyAction as WaifucSafetyAction,
     ArrivalAction as WaifucArrivalAction,
@@ -11,6 +12,9 @@ from waifuc.action import (
     HeadCutOutAction as WaifucHeadCutOutAction
 )
 
+# 让 waifuc 动作内部的检测调用经过检测缓存
+install_detection_cache()
+
 class SafetyAction(WaifucActionWrapper):
     """
     检查图像安全性并移除对抗性噪声。
@@ -0,0 +1,95 @@
+"""
+并行执行模块 - 在进程池工作进程中执行无状态动作
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from .action_registry import registry
+from .waifuc_actions import WaifucActionWrapper
+from ..cache.step_cache import StepCache, prefix_signatures, run_cached
+
+
+# 工作进程内的动作实例，每个进程只在初始化时创建一次（模型也只加载一次）
+_worker_actions: List[Any] = []
+# 工作进程内的步骤缓存和各步骤的前缀签名
+_worker_cache: Optional[StepCache] = None
+_worker_signatures: List[str] = []
+
+
+def create_action_instance(action_name: str, params: Dict[str, Any]) -> Any:
+    """
+    创建动作实例，WaifucActionWrapper 会被解包为内部的 waifuc 动作
+
+    Args:
+        action_name: 操作名称
+        params: 操作参数
+
+    Returns:
+        可直接用于 iter_from 的动作实例
+    """
+    action = registry.create_action(action_name, **params)
+    if isinstance(action, WaifucActionWrapper) and hasattr(action, 'action'):
+        return action.action
+    return action
+
+
+def supports_batch(action_name: str) -> bool:
+    """
+    判断操作是否支持批量推理
+
+    Args:
+        action_name: 操作名称
+
+    Returns:
+        操作类是否实现了 process_batch
+    """
+    return bool(getattr(registry.get_action_class(action_name), 'supports_batch', False))
+
+
+def create_batch_action(action_name: str, params: Dict[str, Any]) -> Optional[Any]:
+    """
+    创建支持批量推理的动作实例（保留包装类，由其 iter_batched 分批调用 process_batch）
+
+    Args:
+        action_name: 操作名称
+        params: 操作参数
+
+    Returns:
+        动作实例，操作不支持批量推理时返回None
+    """
+    if not supports_batch(action_name):
+        return None
+    return registry.create_action(action_name, **params)
+
+
+def init_worker(step_specs: List[Tuple[str, Dict[str, Any]]],
+                cache_config: Optional[Tuple[str, int]] = None) -> None:
+    """
+    进程池初始化函数，在工作进程中创建动作实例
+
+    Args:
+        step_specs: (操作名称, 操作参数) 列表
+        cache_config: (缓存目录, 大小上限) ，为None时不使用步骤缓存
+    """
+    global _worker_actions, _worker_cache, _worker_signatures
+    _worker_actions = [create_action_instance(name, params) for name, params in step_specs]
+    if cache_config:
+        _worker_cache = StepCache(*cache_config)
+        _worker_signatures = prefix_signatures(step_specs)
+
+
+def process_item(item: Any) -> List[Any]:
+    """
+    在工作进程中让单个图像项依次流经所有动作
+
+    Args:
+        item: 输入图像项
+
+    Returns:
+        输出图像项列表（过滤动作可能返回空列表，分割动作可能返回多项）
+    """
+    if _worker_cache is not None:
+        return run_cached(item, _worker_actions, _worker_signatures, _worker_cache)
+    stream = iter([item])
+    for action in _worker_actions:
+        stream = action.iter_from(stream)
+    return list(stream)
@@ -0,0 +1,212 @@
+"""
+感知哈希模块 - 批量计算 dHash / pHash，并按汉明距离查找近似重复的图像
+
+感知哈希只需要一张很小的灰度缩略图，计算量远小于 LPIPS，适合在 FilterSimilarAction 或 TaggingAction 之前
+先去掉重复上传的图像。查找使用多索引哈希：把 64 位哈希分为 max_distance + 1 段，
+汉明距离不超过 max_distance 的两个哈希至少有一段完全相同，因此只需比较各段所在桶中的哈希。
+"""
+import logging
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from waifuc.action import FilterAction
+
+from ..cache.hash_set import HashSet, open_hash_set, open_pending_hash_set
+
+HASH_METHODS = ('phash', 'dhash')
+# pHash 缩略图边长和保留的低频系数边长
+_PHASH_SIZE = 32
+_PHASH_LOW = 8
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(size: int) -> np.ndarray:
+    """
+    正交 DCT-II 矩阵，D @ x 即 x 的一维 DCT
+    """
+    n = np.arange(size)
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def _thumbnail(image: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+    """
+    生成灰度缩略图，透明区域视为白色
+    """
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        image = Image.alpha_composite(Image.new('RGBA', rgba.size, (255, 255, 255, 255)), rgba)
+    return np.asarray(image.convert('L').resize(size, Image.LANCZOS, reducing_gap=3.0), dtype=np.float32)
+
+
+def _pack(bits: np.ndarray) -> List[int]:
+    """
+    将形状为 (n, 64) 的布尔数组按行打包为 64 位整数
+    """
+    return [int(value) for value in np.packbits(bits.reshape(len(bits), 64), axis=1).view('>u8').ravel()]
+
+
+def hash_images(images: List[Image.Image], method: str = 'phash') -> List[int]:
+    """
+    批量计算感知哈希
+
+    pHash: 32x32 缩略图的二维 DCT（整批一次矩阵乘法）取左上 8x8 低频系数，与其中位数比较；
+    dHash: 9x8 缩略图中每个像素与右侧像素比较。
+
+    Args:
+        images: 图像列表
+        method: 'phash' 或 'dhash'
+
+    Returns:
+        每张图像的 64 位哈希
+    """
+    if not images:
+        return []
+    if method == 'phash':
+        pixels = np.stack([_thumbnail(image, (_PHASH_SIZE, _PHASH_SIZE)) for image in images]).astype(np.float64)
+        dct = _dct_matrix(_PHASH_SIZE)
+        low = (dct @ pixels @ dct.T)[:, :_PHASH_LOW, :_PHASH_LOW].reshape(len(images), -1)
+        # 去掉浮点误差，纯色等平坦图像的哈希不随尺寸变化
+        low = np.round(low, 3)
+        return _pack(low > np.median(low, axis=1, keepdims=True))
+    if method == 'dhash':
+        pixels = np.stack([_thumbnail(image, (9, 8)) for image in images])
+        return _pack(pixels[:, :, 1:] > pixels[:, :, :-1])
+    raise ValueError(f"未知的哈希算法: {method}")
+
+
+def hamming(a: int, b: int) -> int:
+    """
+    两个哈希的汉明距离
+    """
+    return bin(a ^ b).count('1')
+
+
+class HashIndex:
+    """
+    64 位哈希的多索引查找表
+    """
+    def __init__(self, max_distance: int):
+        """
+        初始化查找表
+
+        Args:
+            max_distance: 视为重复的最大汉明距离（0 到 32）
+        """
+        if not 0 <= max_distance <= 32:
+            raise ValueError(f"max_distance 必须在 0 到 32 之间: {max_distance}")
+        self.max_distance = max_distance
+        bounds = [int(bound) for bound in np.linspace(0, 64, max_distance + 2)]
+        # 每段的 (右移位数, 掩码)
+        self._segments = [(64 - stop, (1 << (stop - start)) - 1) for start, stop in zip(bounds, bounds[1:])]
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._segments]
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def find(self, value: int) -> Optional[int]:
+        """
+        查找汉明距离不超过 max_distance 的哈希
+
+        Args:
+            value: 哈希值
+
+        Returns:
+            找到的哈希，没有时返回None
+        """
+        for table, (shift, mask) in zip(self._tables, self._segments):
+            for other in table.get((value >> shift) & mask, ()):
+                if hamming(value, other) <= self.max_distance:
+                    return other
+        return None
+
+    def add(self, value: int) -> None:
+        """
+        加入哈希
+
+        Args:
+            value: 哈希值
+        """
+        for table, (shift, mask) in zip(self._tables, self._segments):
+            table.setdefault((value >> shift) & mask, []).append(value)
+        self._count += 1
+
+
+class PHashDedupFilterAction(FilterAction):
+    """
+    按感知哈希去掉完全相同和几乎相同的图像，保留每组中最先出现的一张
+
+    指定 hash_set 时，先载入该名称的持久化哈希集合（之前运行保留的图像），与其中任一哈希相近的图像也会被过滤。
+    本次保留的图像的哈希先写入运行目录中的待合并集合，运行成功完成后才由引擎合并到哈希集合，
+    因此失败后重试、继续执行和估算都不会把本次的图像当作之前保留的图像过滤掉。
+    """
+    def __init__(self, method: str = 'phash', max_distance: int = 4, hash_set: str = ''):
+        """
+        初始化过滤动作
+
+        Args:
+            method: 哈希算法，'phash' 或 'dhash'
+            max_distance: 视为重复的最大汉明距离
+            hash_set: 持久化哈希集合的名称，为空时只在本次运行的图像中去重
+        """
+        if method not in HASH_METHODS:
+            raise ValueError(f"未知的哈希算法: {method}")
+        self.method = method
+        self.max_distance = max_distance
+        self.hash_set = hash_set
+        self._index = HashIndex(max_distance)
+        self._pending: Optional[HashSet] = None
+        self._loaded = False
+
+    def _load(self) -> None:
+        """
+        首次使用时载入持久化哈希集合
+        """
+        self._loaded = True
+        if not self.hash_set:
+            return
+        store = open_hash_set(self.hash_set, self.method)
+        if store is None:
+            logging.warning(f"未设置哈希集合目录，哈希集合 {self.hash_set} 不会被读取和保存")
+            return
+        previous = store.load()
+        for value in previous.tolist():
+            self._index.add(int(value))
+        logging.info(f"已载入哈希集合 {self.hash_set}（{self.method}）: {len(previous)} 个哈希")
+        # 待合并集合由引擎按片段管理，片段重新执行前已清空，同一片段中同名集合的多个步骤共同追加
+        self._pending = open_pending_hash_set(self.hash_set, self.method)
+
+    def accept_many(self, hashes: Iterable[int]) -> List[bool]:
+        """
+        按顺序判断一批哈希是否保留，保留的哈希加入查找表和待合并集合
+
+        Args:
+            hashes: 哈希值
+
+        Returns:
+            每个哈希是否保留
+        """
+        if not self._loaded:
+            self._load()
+        results, kept = [], []
+        for value in hashes:
+            keep = self._index.find(value) is None
+            if keep:
+                self._index.add(value)
+                kept.append(value)
+            results.append(keep)
+        if self._pending is not None and kept:
+            self._pending.add(kept)
+        return results
+
+    def check(self, item: Any) -> bool:
+        return self.accept_many(hash_images([item.image], self.method))[0]
+
+    def reset(self):
+        self._index = HashIndex(self.max_distance)
+        self._pending = None
+        self._loaded = False
@@ -0,0 +1,271 @@
+"""
+相似图像检索模块 - 在全部已保留的图像中查找 LPIPS 近似重复的候选
+
+waifuc 的 FilterSimilarAction 只与最近 capacity 张图像逐一计算 LPIPS 差异，间隔较远的重复图像无法发现，
+增大 capacity 又会让每张图像的比较次数线性增长。索引模式下每张图像的 LPIPS 特征先压缩为粗粒度向量：
+数据量较小时按块做矩阵运算找出距离最近的若干候选，数据量较大时用随机超平面 LSH 只取同一哈希桶中的图像，
+候选再用 LPIPS 逐一精确验证，因此每张图像的开销不随数据量线性增长。
+"""
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from waifuc.action import FilterAction
+
+from .embeddings import embedding_store, stored_extractor
+from ..cache.hashing import image_digest
+
+
+def coarse_embedding(feature: Any) -> np.ndarray:
+    """
+    将 LPIPS 的各层特征压缩为一个向量
+
+    与 LPIPS 相同，先在每个位置上沿通道归一化，再对整张特征图取平均；
+    两个向量的平方距离近似于各层未加权的 LPIPS 差异（取平均后不会更大）。
+
+    Args:
+        feature: lpips_extract_feature 的输出（各层形状为 (1, C, H, W) 的数组列表）
+
+    Returns:
+        float32 向量
+    """
+    layers = [feature] if isinstance(feature, np.ndarray) else list(feature)
+    parts = []
+    for layer in layers:
+        array = np.asarray(layer, dtype=np.float32)
+        array = array.reshape(array.shape[-3], -1) if array.ndim >= 3 else array.reshape(-1, 1)
+        array = array / (np.sqrt(np.square(array).sum(axis=0, keepdims=True)) + 1e-10)
+        parts.append(array.mean(axis=1) / np.sqrt(len(layers)))
+    return np.concatenate(parts).astype(np.float32)
+
+
+class SimilarityIndex:
+    """
+    粗粒度向量的近邻索引
+
+    向量少于 lsh_min_rows 时按块计算与全部向量的距离；达到后以向量均值为中心建立随机超平面 LSH，
+    每个哈希表的位数随数据量对数增长，使每个桶中的平均图像数保持不变，数据量翻倍时重建。
+    """
+    def __init__(self, block_size: int = 4096, lsh_min_rows: int = 2048, tables: int = 10,
+                 bucket_size: int = 16, seed: int = 0):
+        """
+        初始化索引
+
+        Args:
+            block_size: 矩阵检索每块的向量数
+            lsh_min_rows: 开始使用 LSH 的向量数
+            tables: LSH 哈希表个数
+            bucket_size: 每个哈希桶的目标平均图像数
+            seed: 随机超平面的种子
+        """
+        self.block_size = block_size
+        self.lsh_min_rows = lsh_min_rows
+        self.tables = tables
+        self.bucket_size = bucket_size
+        self._rng = np.random.default_rng(seed)
+        self._vectors: Optional[np.ndarray] = None
+        self._norms = np.empty(0, dtype=np.float32)
+        self._ratios = np.empty(0, dtype=np.float64)
+        self._count = 0
+        self._center: Optional[np.ndarray] = None
+        self._planes: Optional[np.ndarray] = None
+        self._weights: Optional[np.ndarray] = None
+        self._buckets: List[Dict[int, List[int]]] = []
+        self._built_rows = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, vector: np.ndarray, ratio: float) -> int:
+        """
+        加入一个向量
+
+        Args:
+            vector: 粗粒度向量
+            ratio: 图像高宽比
+
+        Returns:
+            向量的序号
+        """
+        if self._vectors is None:
+            self._vectors = np.empty((64, len(vector)), dtype=np.float32)
+            self._norms = np.empty(64, dtype=np.float32)
+            self._ratios = np.empty(64, dtype=np.float64)
+        elif self._count == len(self._vectors):
+            self._vectors = np.concatenate([self._vectors, np.empty_like(self._vectors)])
+            self._norms = np.concatenate([self._norms, np.empty_like(self._norms)])
+            self._ratios = np.concatenate([self._ratios, np.empty_like(self._ratios)])
+        row = self._count
+        self._vectors[row] = vector
+        self._norms[row] = float(np.dot(vector, vector))
+        self._ratios[row] = ratio
+        self._count += 1
+
+        if self._count >= self.lsh_min_rows and self._count >= 2 * self._built_rows:
+            self._build_lsh()
+        elif self._planes is not None:
+            for table, code in zip(self._buckets, self._codes(self._vectors[row:row + 1])[0]):
+                table.setdefault(int(code), []).append(row)
+        return row
+
+    def _build_lsh(self) -> None:
+        """
+        按当前数据量重新选择位数和中心，重建全部哈希表
+        """
+        vectors = self._vectors[:self._count]
+        bits = int(np.clip(np.ceil(np.log2(self._count / self.bucket_size)), 8, 30))
+        self._center = vectors.mean(axis=0)
+        self._planes = self._rng.standard_normal((self.tables * bits, vectors.shape[1])).astype(np.float32)
+        self._weights = (1 << np.arange(bits, dtype=np.int64))
+        self._buckets = [{} for _ in range(self.tables)]
+        for start in range(0, self._count, self.block_size):
+            codes = self._codes(vectors[start:start + self.block_size])
+            for offset, row_codes in enumerate(codes):
+                for table, code in zip(self._buckets, row_codes):
+                    table.setdefault(int(code), []).append(start + offset)
+        self._built_rows = self._count
+        logging.debug(f"相似图像索引已重建 LSH: {self._count} 张图像，{self.tables} 个哈希表，每个 {bits} 位")
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        计算向量在每个哈希表中的哈希值，返回形状为 (向量数, 哈希表数) 的数组
+        """
+        signs = ((vectors - self._center) @ self._planes.T) > 0
+        return signs.reshape(len(vectors), self.tables, -1).astype(np.int64) @ self._weights
+
+    def candidates(self, vector: np.ndarray, ratio: float, rtol: float, atol: float, limit: int,
+                   use_lsh: bool = True) -> List[int]:
+        """
+        查找高宽比相近且粗粒度距离最近的候选
+
+        Args:
+            vector: 查询向量
+            ratio: 查询图像的高宽比
+            rtol: 高宽比相对误差
+            atol: 高宽比绝对误差
+            limit: 最多返回的候选数
+            use_lsh: 是否在建立 LSH 后只检索同一哈希桶中的图像
+
+        Returns:
+            按距离从近到远排列的向量序号
+        """
+        if not self._count:
+            return []
+        query_norm = float(np.dot(vector, vector))
+        if use_lsh and self._planes is not None:
+            codes = self._codes(vector[None])[0]
+            rows = np.unique(np.fromiter(
+                (row for table, code in zip(self._buckets, codes) for row in table.get(int(code), ())),
+                dtype=np.int64))
+            rows = rows[np.abs(self._ratios[rows] - ratio) <= atol + rtol * abs(ratio)]
+            if not len(rows):
+                return []
+            distances = self._norms[rows] - 2 * (self._vectors[rows] @ vector) + query_norm
+            order = np.argsort(distances)[:limit]
+            return rows[order].tolist()
+
+        best_rows, best_distances = [], []
+        for start in range(0, self._count, self.block_size):
+            stop = min(start + self.block_size, self._count)
+            distances = self._norms[start:stop] - 2 * (self._vectors[start:stop] @ vector) + query_norm
+            distances[np.abs(self._ratios[start:stop] - ratio) > atol + rtol * abs(ratio)] = np.inf
+            if len(distances) > limit:
+                keep = np.argpartition(distances, limit)[:limit]
+            else:
+                keep = np.arange(len(distances))
+            keep = keep[np.isfinite(distances[keep])]
+            best_rows.append(keep + start)
+            best_distances.append(distances[keep])
+        rows, distances = np.concatenate(best_rows), np.concatenate(best_distances)
+        return rows[np.argsort(distances)[:limit]].tolist()
+
+
+class IndexedFilterSimilarAction(FilterAction):
+    """
+    与全部已保留的图像比较的 LPIPS 相似图像过滤
+
+    与 waifuc 的 FilterSimilarAction 判定规则相同（高宽比相近且 LPIPS 差异不超过阈值即视为重复），
+    但不限于最近 capacity 张图像：先从 SimilarityIndex 取出粗粒度距离最近的候选，再精确计算 LPIPS 差异。
+    候选的完整特征优先从特征存储读取；特征存储未启用或已满时保存在内存中，最多保留最近使用的
+    max_memory_features 个，更早的图像无法再精确验证，召回率会下降。
+    """
+    def __init__(self, mode: str = 'all', threshold: float = 0.45, rtol: float = 5e-2, atol: float = 2e-2,
+                 hash_prefilter: bool = True, max_candidates: int = 16, max_memory_features: int = 500):
+        """
+        初始化过滤动作
+
+        Args:
+            mode: 'all' 在全部图像中去重，'group' 只在 group_id 相同的图像中去重
+            threshold: LPIPS 差异阈值
+            rtol: 高宽比相对误差
+            atol: 高宽比绝对误差
+            hash_prefilter: 数据量较大时是否使用 LSH 预筛选（否则始终按块检索全部图像）
+            max_candidates: 每张图像最多精确验证的候选数
+            max_memory_features: 特征存储不可用时内存中最多保留的完整特征数（与 waifuc 默认的 capacity 相同）
+        """
+        self.mode = mode
+        self.threshold = threshold
+        self.rtol = rtol
+        self.atol = atol
+        self.hash_prefilter = hash_prefilter
+        self.max_candidates = max_candidates
+        self.max_memory_features = max_memory_features
+        self._indices: Dict[Hashable, SimilarityIndex] = {}
+        self._digests: Dict[Hashable, List[Optional[str]]] = {}
+        # (分组, 向量序号) 到完整特征，按最近使用排序
+        self._features: 'OrderedDict[Tuple[Hashable, int], Any]' = OrderedDict()
+        self._evicted = False
+
+    def _group(self, item: Any) -> Hashable:
+        return item.meta.get('group_id') if self.mode == 'group' else None
+
+    def check(self, item: Any) -> bool:
+        from imgutils.metrics import lpips_difference
+
+        group = self._group(item)
+        index = self._indices.setdefault(group, SimilarityIndex())
+        digests = self._digests.setdefault(group, [])
+        store = embedding_store('lpips_extract_feature')
+
+        feature = stored_extractor('lpips_extract_feature')(item.image)
+        vector = coarse_embedding(feature)
+        ratio = item.image.height * 1.0 / item.image.width
+        rows = index.candidates(vector, ratio, self.rtol, self.atol, self.max_candidates,
+                                use_lsh=self.hash_prefilter)
+        stored = store.get_many(digests[row] for row in rows if (group, row) not in self._features) \
+            if store is not None and rows else {}
+        for row in rows:
+            if (group, row) in self._features:
+                self._features.move_to_end((group, row))
+                existing = self._features[(group, row)]
+            else:
+                existing = stored.get(digests[row])
+            if existing is not None and lpips_difference(existing, feature) <= self.threshold:
+                return False
+
+        row = index.add(vector, ratio)
+        digest = image_digest(item.image)
+        digests.append(digest)
+        # 特征存储未启用或已满时，精确验证所需的完整特征只能保存在内存中
+        if digest is None or store is None or not store.rows([digest]):
+            self._remember(group, row, feature)
+        return True
+
+    def _remember(self, group: Hashable, row: int, feature: Any) -> None:
+        """
+        在内存中保存完整特征，超过 max_memory_features 时丢弃最久未使用的特征
+        """
+        self._features[(group, row)] = feature
+        while len(self._features) > max(self.max_memory_features, 0):
+            self._features.popitem(last=False)
+            if not self._evicted:
+                self._evicted = True
+                logging.warning(f"特征存储不可用，内存中只保留最近使用的 {self.max_memory_features} 个 LPIPS 特征，"
+                                f"与更早图像重复的图像可能无法被过滤（启用特征存储或提高存储上限可避免）")
+
+    def reset(self):
+        self._indices.clear()
+        self._digests.clear()
+        self._features.clear()
+        self._evicted = False
@@ -3,12 +3,16 @@ split_actions.py - 图像分割相关的动作
 """
 from typing import Optional, Dict
 from .waifuc_actions import WaifucActionWrapper
+from .detection import install_detection_cache
 from waifuc.action import (
     PersonSplitAction as WaifucPersonSplitAction,
     ThreeStageSplitAction as WaifucThreeStageSplitAction,
     FrameSplitAction as WaifucFrameSplitAction
 )
 
+# 让 waifuc 动作内部的检测调用经过检测缓存
+install_detection_cache()
+
 class PersonSplitAction(WaifucActionWrapper):
     """
     检测并裁剪图像中的每个人物，生成单独的图像。
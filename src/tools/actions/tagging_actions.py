@@ -1,8 +1,11 @@
 """
 tagging_actions.py - 图像标签管理相关的动作
 """
-from typing import Union, List, Mapping
+import logging
+from typing import Any, Dict, Union, List, Mapping, Optional
 from .waifuc_actions import WaifucActionWrapper
+from .batching import WD14_MODELS, batch_or_fallback, wd14_tag_batch
+from ..cache.tag_cache import get_tag_cache
 from waifuc.action import (
     TaggingAction as WaifucTaggingAction,
     TagFilterAction as WaifucTagFilterAction,
@@ -12,9 +15,81 @@ from waifuc.action import (
     TagRemoveUnderlineAction as WaifucTagRemoveUnderlineAction
 )
 
+# 通过标签缓存推理失败过的动作，进程内不再使用标签缓存
+_cache_disabled = set()
+
+
+def _cached_tags(item: Any, cache_params: tuple, cache: Any, name: str) -> Optional[Dict[str, float]]:
+    """
+    通过标签缓存为单个图像项生成标签
+
+    标签缓存依赖 imgutils 的内部函数，失败时（通常是 imgutils 版本不兼容）记录一次警告，之后不再使用标签缓存
+
+    Returns:
+        标签字典，失败或已停用时返回None，由调用方改为 waifuc 原有的推理
+    """
+    if name in _cache_disabled:
+        return None
+    try:
+        return _tag_items([item], *cache_params, cache)[id(item)]
+    except Exception as e:
+        _cache_disabled.add(name)
+        logging.warning(f"{name} 使用标签缓存推理失败，之后改为直接调用 waifuc: {str(e)}")
+        return None
+
+
+class _CachedTaggingAction(WaifucTaggingAction):
+    """
+    先查询标签缓存的 waifuc 标签动作，缓存未启用或标签方法不是 wd14 时与 waifuc 相同
+    """
+    def __init__(self, method: str = 'wd14_v3_swinv2', force: bool = False,
+                 general_threshold: float = 0.35, character_threshold: float = 0.85):
+        super().__init__(method=method, force=force, general_threshold=general_threshold,
+                         character_threshold=character_threshold)
+        self.cache_params = (method, general_threshold, character_threshold)
+        self.cache_force = force
+
+    def process(self, item: Any) -> Any:
+        from waifuc.model import ImageItem
+
+        cache = get_tag_cache()
+        if cache is None or self.cache_params[0] not in WD14_MODELS or \
+                ('tags' in item.meta and not self.cache_force):
+            return super().process(item)
+        tags = _cached_tags(item, self.cache_params, cache, 'TaggingAction')
+        if tags is None:
+            return super().process(item)
+        return ImageItem(item.image, {**item.meta, 'tags': tags})
+
+
+class _CachedTagFilterAction(WaifucTagFilterAction):
+    """
+    先查询标签缓存的 waifuc 标签过滤动作，缓存未启用或标签方法不是 wd14 时与 waifuc 相同
+    """
+    def __init__(self, tags: Union[List[str], Mapping[str, float]], method: str = 'wd14_convnextv2',
+                 reversed: bool = False, general_threshold: float = 0.35, character_threshold: float = 0.85):
+        super().__init__(tags=tags, method=method, reversed=reversed, general_threshold=general_threshold,
+                         character_threshold=character_threshold)
+        self.cache_params = (method, general_threshold, character_threshold)
+
+    def check(self, item: Any) -> bool:
+        from waifuc.model import ImageItem
+
+        cache = get_tag_cache()
+        if cache is None or self.cache_params[0] not in WD14_MODELS or 'tags' in item.meta:
+            return super().check(item)
+        # 标签已经存在时 waifuc 不会再次推理
+        tags = _cached_tags(item, self.cache_params, cache, 'TagFilterAction')
+        if tags is None:
+            return super().check(item)
+        return super().check(ImageItem(item.image, {**item.meta, 'tags': tags}))
+
+
 class TaggingAction(WaifucActionWrapper):
     """
     使用指定模型为图像生成标签。
+
+    启用标签缓存时，wd14 模型的分数按图像内容缓存，再次运行或修改阈值都不需要重新推理。
     
     参数:
         method (str): 标签模型，默认为 'wd14_v3_swinv2'。
@@ -22,14 +97,34 @@ class TaggingAction(WaifucActionWrapper):
         general_threshold (float): 通用标签阈值，默认为 0.35。
         character_threshold (float): 角色标签阈值，默认为 0.85。
     """
+    supports_batch = True
+
     def __init__(self, method: str = 'wd14_v3_swinv2', force: bool = False,
                  general_threshold: float = 0.35, character_threshold: float = 0.85):
-        super().__init__(WaifucTaggingAction, method=method, force=force,
+        super().__init__(_CachedTaggingAction, method=method, force=force,
                         general_threshold=general_threshold, character_threshold=character_threshold)
 
+    def process_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        """
+        批量生成标签，一个批次只运行一次 wd14 模型
+        """
+        return batch_or_fallback(self._tag_batch, lambda item: next(self.iter(item), None), items,
+                                 f"{self.__class__.__name__}({self.params['method']})")
+
+    def _tag_batch(self, items: List[Any]) -> List[Any]:
+        from waifuc.model import ImageItem
+
+        pending = [item for item in items if self.params['force'] or 'tags' not in item.meta]
+        tags = _tag_items(pending, self.params['method'], self.params['general_threshold'],
+                          self.params['character_threshold'], get_tag_cache())
+        return [ImageItem(item.image, {**item.meta, 'tags': tags[id(item)]}) if id(item) in tags else item
+                for item in items]
+
 class TagFilterAction(WaifucActionWrapper):
     """
     根据指定标签和分数过滤图像。
+
+    与 TaggingAction 共用标签缓存，图像缺少标签时优先使用缓存的分数。
     
     参数:
         tags (Union[List[str], Mapping[str, float]]): 标签或标签分数字典。
@@ -38,11 +133,47 @@ class TagFilterAction(WaifucActionWrapper):
         general_threshold (float): 通用标签阈值，默认为 0.35。
         character_threshold (float): 角色标签阈值，默认为 0.85。
     """
+    supports_batch = True
+
     def __init__(self, tags: Union[List[str], Mapping[str, float]], method: str = 'wd14_convnextv2',
                  reversed: bool = False, general_threshold: float = 0.35, character_threshold: float = 0.85):
-        super().__init__(WaifucTagFilterAction, tags=tags, method=method, reversed=reversed,
+        super().__init__(_CachedTagFilterAction, tags=tags, method=method, reversed=reversed,
                         general_threshold=general_threshold, character_threshold=character_threshold)
 
+    def process_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        """
+        批量生成缺少的标签后逐项判断，一个批次只运行一次 wd14 模型
+        """
+        return batch_or_fallback(self._filter_batch, lambda item: next(self.iter(item), None), items,
+                                 f"{self.__class__.__name__}({self.params['method']})")
+
+    def _filter_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        from waifuc.model import ImageItem
+
+        tags = _tag_items([item for item in items if 'tags' not in item.meta], self.params['method'],
+                          self.params['general_threshold'], self.params['character_threshold'],
+                          get_tag_cache())
+        results = []
+        for item in items:
+            tagged = ImageItem(item.image, {**item.meta, 'tags': tags[id(item)]}) if id(item) in tags else item
+            # 与 waifuc 的过滤动作相同，通过时输出原图像项
+            results.append(item if self.action.check(tagged) else None)
+        return results
+
+
+def _tag_items(items: List[Any], method: str, general_threshold: float,
+               character_threshold: float, cache: Any = None) -> Dict[int, Dict[str, float]]:
+    """
+    使用 wd14 模型批量生成标签（提供标签缓存时先查询缓存），返回 id(图像项) 到标签字典的映射
+    """
+    if not items:
+        return {}
+    if method not in WD14_MODELS:
+        raise ValueError(f"标签方法 {method} 不支持批量推理")
+    tags = wd14_tag_batch([item.image for item in items], method, general_threshold, character_threshold,
+                          cache)
+    return {id(item): item_tags for item, item_tags in zip(items, tags)}
+
 class TagOverlapDropAction(WaifucActionWrapper):
     """
     删除重叠标签。
@@ -1,7 +1,7 @@
 """
 Waifuc库Actions封装模块 - 封装waifuc库中的各种图像处理操作
 """
-from typing import Any, Iterator, Optional
+from typing import Any, Iterator, List, Optional
 import logging
 from .base import ActionWithParams
 
@@ -39,6 +39,18 @@ class WaifucActionWrapper(ActionWithParams):
             logging.error(f"Process error in {self.action_class.__name__}: {str(e)}")
             return None
     
+    def process_batch(self, items: List[Any]) -> List[Optional[Any]]:
+        """
+        逐项使用封装的waifuc action处理图像项，支持批量推理的子类覆盖此方法
+
+        Args:
+            items: 待处理的图像项列表
+
+        Returns:
+            与输入一一对应的处理结果，被过滤掉的图像项为 None
+        """
+        return [next(self.iter(item), None) for item in items]
+
     def iter(self, item: Any) -> Iterator[Any]:
         """
         使用封装的waifuc action处理图像项并生成结果序列
@@ -0,0 +1,11 @@
+"""
+缓存包初始化文件 - 导出哈希工具、步骤结果缓存、标签缓存、检测缓存、特征存储和哈希集合
+"""
+from .hashing import image_digest, item_digest, canonical_json, package_versions, step_signature
+from .step_cache import StepCache, prefix_signatures, run_cached
+from .tag_cache import TagCache, configure_tag_cache, get_tag_cache
+from .detection_cache import DetectionCache, configure_detection_cache, get_detection_cache
+from .embedding_store import (
+    EmbeddingStore, clear_embedding_stores, configure_embedding_store, embedding_store_usage, get_embedding_store
+)
+from .hash_set import HashSet, commit_hash_sets, configure_hash_sets, open_hash_set, open_pending_hash_set
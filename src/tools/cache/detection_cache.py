@@ -0,0 +1,252 @@
+"""
+检测缓存模块 - 按图像内容摘要和检测模型缓存目标检测结果（内存和持久化两级）
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+# (x0, y0, x1, y1), 标签, 置信度
+Detection = Tuple[Tuple[float, float, float, float], str, float]
+
+# 检测时使用的最低置信度，请求的阈值不低于它时都可以由缓存的结果筛选得到
+DEFAULT_CONF_FLOOR = 0.1
+
+
+def filter_detections(detections: List[Detection], conf_threshold: float) -> List[Detection]:
+    """
+    按置信度阈值筛选检测结果
+
+    以较低的阈值检测后再筛选，与直接以该阈值检测的结果相同：NMS 按置信度从高到低保留检测框，
+    一个检测框只会被置信度更高的检测框抑制，而这些检测框在两种情况下都存在。
+
+    Args:
+        detections: 检测结果
+        conf_threshold: 置信度阈值
+
+    Returns:
+        置信度高于阈值的检测结果
+    """
+    return [detection for detection in detections if detection[2] > conf_threshold]
+
+
+def _plain(value: Any) -> Any:
+    """
+    将 NumPy 标量转换为 Python 数值，保留整数和浮点数的区别
+    """
+    return value.item() if hasattr(value, 'item') else value
+
+
+class DetectionCache:
+    """
+    检测结果缓存
+
+    键为图像像素摘要和检测器（检测类型、模型、推理尺寸、IOU 阈值和依赖包版本），
+    值为以最低置信度检测得到的全部检测框及该最低置信度。最近使用的条目保存在内存中，
+    同一次运行中多个步骤检测同一张图像时只检测一次；所有条目同时写入 sqlite，再次运行时直接读取。
+    """
+    DB_FILENAME = "detections.sqlite"
+
+    def __init__(self, directory: Optional[str], memory_items: int = 4096, max_entries: int = 1000000):
+        """
+        初始化检测缓存
+
+        Args:
+            directory: 持久化目录，为None时只使用内存缓存
+            memory_items: 内存中保存的条目数
+            max_entries: 持久化条目数上限，超出后淘汰最久未访问的条目
+        """
+        self.directory = directory
+        self.memory_items = memory_items
+        self.max_entries = int(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._memory: 'OrderedDict[Tuple[str, str], Tuple[float, List[Detection]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(directory, self.DB_FILENAME),
+                                         timeout=30, check_same_thread=False)
+            with self._lock, self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS detections ("
+                                   "digest TEXT NOT NULL, detector TEXT NOT NULL, floor REAL NOT NULL, "
+                                   "boxes TEXT NOT NULL, last_access REAL NOT NULL, "
+                                   "PRIMARY KEY (digest, detector))")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS detections_last_access "
+                                   "ON detections (last_access)")
+
+    def _remember(self, key: Tuple[str, str], floor: float, detections: List[Detection]) -> None:
+        """
+        写入内存缓存，调用时需持有锁
+        """
+        self._memory[key] = (floor, detections)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, digest: str, detector: str, conf_threshold: float) -> Optional[List[Detection]]:
+        """
+        读取检测结果
+
+        Args:
+            digest: 图像摘要
+            detector: 检测器键
+            conf_threshold: 置信度阈值，条目的最低置信度高于该阈值时视为未命中
+
+        Returns:
+            按阈值筛选后的检测结果，未命中时返回None
+        """
+        entry = self.lookup(digest, detector)
+        if entry is None or entry[0] > conf_threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return filter_detections(entry[1], conf_threshold)
+
+    def lookup(self, digest: str, detector: str) -> Optional[Tuple[float, List[Detection]]]:
+        """
+        读取未经筛选的条目
+
+        Args:
+            digest: 图像摘要
+            detector: 检测器键
+
+        Returns:
+            (最低置信度, 全部检测结果)，不存在时返回None
+        """
+        key = (digest, detector)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+            if self._conn is None:
+                return None
+            with self._conn:
+                row = self._conn.execute("SELECT floor, boxes FROM detections WHERE digest = ? AND detector = ?",
+                                         key).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute("UPDATE detections SET last_access = ? WHERE digest = ? AND detector = ?",
+                                   (time.time(),) + key)
+            entry = (row[0], [(tuple(box), label, score) for box, label, score in json.loads(row[1])])
+            self._remember(key, *entry)
+            return entry
+
+    def memory_detections(self, digest: str) -> List[Detection]:
+        """
+        获取内存缓存中一张图像在所有检测器下的检测结果
+
+        Args:
+            digest: 图像摘要
+
+        Returns:
+            检测结果列表
+        """
+        with self._lock:
+            return [detection for (entry_digest, _), (_, detections) in self._memory.items()
+                    if entry_digest == digest for detection in detections]
+
+    def put(self, digest: str, detector: str, floor: float, detections: List[Detection],
+            persist: bool = True) -> List[Detection]:
+        """
+        写入检测结果
+
+        Args:
+            digest: 图像摘要
+            detector: 检测器键
+            floor: 检测时使用的最低置信度
+            detections: 全部检测结果
+            persist: 是否写入持久化缓存（由父图像推算的结果只保存在内存中）
+
+        Returns:
+            转换为 Python 基本类型后的检测结果
+        """
+        detections = [(tuple(_plain(v) for v in box), str(label), float(score))
+                      for box, label, score in detections]
+        with self._lock:
+            self._remember((digest, detector), floor, detections)
+            if not persist or self._conn is None:
+                return detections
+            try:
+                with self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?)",
+                                       (digest, detector, floor,
+                                        json.dumps([[list(box), label, score] for box, label, score in detections]),
+                                        time.time()))
+                    self._puts += 1
+                    if self._puts >= 1000:
+                        self._puts = 0
+                        self._evict()
+            except sqlite3.Error as e:
+                logging.warning(f"写入检测缓存失败: {str(e)}")
+        return detections
+
+    def _evict(self) -> None:
+        """
+        条目数超过上限时删除最久未访问的条目，调用时需持有锁
+        """
+        count = self._conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute("DELETE FROM detections WHERE rowid IN (SELECT rowid FROM detections "
+                               "ORDER BY last_access LIMIT ?)", (count - self.max_entries,))
+
+    def clear(self) -> None:
+        """
+        删除所有条目
+        """
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM detections")
+
+
+_settings = {'enabled': False, 'directory': None}
+_instance: Optional[DetectionCache] = None
+_instance_pid: Optional[int] = None
+_instance_lock = threading.Lock()
+
+
+def configure_detection_cache(enabled: bool, directory: Optional[str] = None) -> None:
+    """
+    设置检测缓存，由引擎在执行前调用（以 fork 方式创建的工作进程会继承该设置）
+
+    Args:
+        enabled: 是否启用检测缓存
+        directory: 持久化目录，为None时只使用内存缓存
+    """
+    global _instance
+    with _instance_lock:
+        if (_settings['enabled'], _settings['directory']) != (enabled, directory):
+            _settings['enabled'] = enabled
+            _settings['directory'] = directory
+            _instance = None
+
+
+def get_detection_cache() -> Optional[DetectionCache]:
+    """
+    获取当前进程的检测缓存，每个进程使用自己的内存缓存和数据库连接
+
+    Returns:
+        检测缓存，未启用时返回None
+    """
+    global _instance, _instance_pid
+    with _instance_lock:
+        if not _settings['enabled']:
+            return None
+        if _instance is None or _instance_pid != os.getpid():
+            try:
+                _instance = DetectionCache(_settings['directory'])
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"无法打开检测缓存 {_settings['directory']}，只使用内存缓存: {str(e)}")
+                _instance = DetectionCache(None)
+            _instance_pid = os.getpid()
+        return _instance
@@ -0,0 +1,429 @@
+"""
+特征存储模块 - 按图像内容摘要持久化保存 LPIPS、CCIP 等模型提取的特征
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 上只在进程内加锁
+    fcntl = None
+
+# 摘要以 16 字节二进制保存在键文件中
+_DIGEST_BYTES = 16
+
+
+class EmbeddingStore:
+    """
+    单个模型的特征存储
+
+    每个模型（包含模型参数和依赖包版本的键）对应一个目录：特征按行追加到 vectors.bin，
+    读取时通过内存映射访问；图像摘要按相同顺序追加到 keys.bin，打开时载入为摘要到行号的哈希索引。
+    先写特征再写摘要，摘要存在即表示该行完整，多个进程通过文件锁串行追加。
+    一个特征可以是单个数组（CCIP）或多个数组（LPIPS 的各层特征），形状在首次写入时记录在 meta.json 中。
+    """
+    META_FILENAME = "meta.json"
+    VECTORS_FILENAME = "vectors.bin"
+    KEYS_FILENAME = "keys.bin"
+    LOCK_FILENAME = "lock"
+
+    def __init__(self, directory: str, model: str, dtype: str = 'float32', max_bytes: int = 20 * 1024 ** 3):
+        """
+        初始化特征存储
+
+        Args:
+            directory: 存储根目录，每个模型使用其中的一个子目录
+            model: 模型键，不同的键互不复用
+            dtype: 新建存储时特征的保存类型（已有存储沿用创建时的类型）
+            max_bytes: 特征文件大小上限（字节），达到上限后不再写入新的特征
+        """
+        self.model = model
+        self.max_bytes = int(max_bytes)
+        self.directory = os.path.join(directory, _model_dirname(model))
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_file = os.path.join(self.directory, self.VECTORS_FILENAME)
+        self.keys_file = os.path.join(self.directory, self.KEYS_FILENAME)
+        self.hits = 0
+        self.misses = 0
+        self._dtype = np.dtype(dtype)
+        self._shapes: Optional[List[Tuple[int, ...]]] = None
+        self._single = True
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._full = False
+        self._lock = threading.Lock()
+        self._load_meta()
+
+    @property
+    def dim(self) -> Optional[int]:
+        """每行的元素个数，尚未写入任何特征时为None"""
+        return sum(int(np.prod(shape)) for shape in self._shapes) if self._shapes is not None else None
+
+    def _load_meta(self) -> None:
+        path = os.path.join(self.directory, self.META_FILENAME)
+        if not os.path.isfile(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self._dtype = np.dtype(meta['dtype'])
+        self._shapes = [tuple(shape) for shape in meta['shapes']]
+        self._single = bool(meta['single'])
+
+    def _write_meta(self, shapes: List[Tuple[int, ...]], single: bool) -> None:
+        """
+        首次写入时记录特征形状，调用时需持有文件锁
+        """
+        self._load_meta()
+        if self._shapes is not None:
+            return
+        path = os.path.join(self.directory, self.META_FILENAME)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model, 'dtype': self._dtype.str, 'shapes': [list(s) for s in shapes],
+                       'single': single}, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+        self._shapes, self._single = shapes, single
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        with open(os.path.join(self.directory, self.LOCK_FILENAME), 'a') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def _committed_rows(self) -> int:
+        """
+        磁盘上完整写入的行数
+        """
+        if self._shapes is None:
+            self._load_meta()
+        if self._shapes is None or not os.path.isfile(self.keys_file):
+            return 0
+        row_bytes = self.dim * self._dtype.itemsize
+        vectors = os.path.getsize(self.vectors_file) if os.path.isfile(self.vectors_file) else 0
+        return min(os.path.getsize(self.keys_file) // _DIGEST_BYTES, vectors // row_bytes if row_bytes else 0)
+
+    def _refresh(self) -> None:
+        """
+        载入其他进程追加的行，调用时需持有锁
+        """
+        rows = self._committed_rows()
+        if rows <= self._rows:
+            return
+        with open(self.keys_file, 'rb') as f:
+            f.seek(self._rows * _DIGEST_BYTES)
+            data = f.read((rows - self._rows) * _DIGEST_BYTES)
+        for i in range(len(data) // _DIGEST_BYTES):
+            self._index.setdefault(data[i * _DIGEST_BYTES:(i + 1) * _DIGEST_BYTES], self._rows + i)
+        self._rows = rows
+        self._matrix = None
+
+    def matrix(self) -> np.ndarray:
+        """
+        获取全部特征的只读内存映射，每行一个展平的特征
+
+        Returns:
+            形状为 (行数, dim) 的数组
+        """
+        with self._lock:
+            self._refresh()
+            return self._get_matrix()
+
+    def _get_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            if self._rows == 0:
+                self._matrix = np.empty((0, self.dim or 0), dtype=self._dtype)
+            else:
+                self._matrix = np.memmap(self.vectors_file, dtype=self._dtype, mode='r',
+                                         shape=(self._rows, self.dim))
+        return self._matrix
+
+    def rows(self, digests: Iterable[str]) -> Dict[str, int]:
+        """
+        查询图像特征所在的行号
+
+        Args:
+            digests: 图像摘要
+
+        Returns:
+            摘要到行号的字典，只包含已保存的图像
+        """
+        digests = list(digests)
+        with self._lock:
+            if any(bytes.fromhex(digest) not in self._index for digest in digests):
+                self._refresh()
+            return {digest: self._index[key] for digest in digests
+                    if (key := bytes.fromhex(digest)) in self._index}
+
+    def unpack(self, row: np.ndarray) -> Any:
+        """
+        将展平的一行还原为模型输出的形式（float32）
+
+        Args:
+            row: 一行特征
+
+        Returns:
+            单个数组或数组列表
+        """
+        arrays, offset = [], 0
+        for shape in self._shapes:
+            size = int(np.prod(shape))
+            arrays.append(np.array(row[offset:offset + size], dtype=np.float32).reshape(shape))
+            offset += size
+        return arrays[0] if self._single else arrays
+
+    def round_trip(self, feature: Any) -> Any:
+        """
+        将新提取的特征转换为之后从存储读取时的形式：按保存类型取整后转为 float32，
+        保证首次提取和再次运行得到的特征完全相同
+
+        Args:
+            feature: 单个数组或数组列表
+
+        Returns:
+            与 unpack 的返回形式相同的特征
+        """
+        if isinstance(feature, np.ndarray):
+            return np.asarray(feature, dtype=self._dtype).astype(np.float32)
+        return [np.asarray(array, dtype=self._dtype).astype(np.float32) for array in feature]
+
+    def get_many(self, digests: Iterable[str]) -> Dict[str, Any]:
+        """
+        读取多张图像的特征
+
+        Args:
+            digests: 图像摘要
+
+        Returns:
+            摘要到特征的字典，只包含命中的图像
+        """
+        digests = list(dict.fromkeys(digests))
+        rows = self.rows(digests)
+        found = {}
+        if rows:
+            with self._lock:
+                matrix = self._get_matrix()
+            found = {digest: self.unpack(matrix[row]) for digest, row in rows.items()}
+        self.hits += len(found)
+        self.misses += len(digests) - len(found)
+        return found
+
+    def get(self, digest: str) -> Optional[Any]:
+        """
+        读取一张图像的特征
+
+        Args:
+            digest: 图像摘要
+
+        Returns:
+            特征，未命中时返回None
+        """
+        return self.get_many([digest]).get(digest)
+
+    def put_many(self, entries: Dict[str, Any]) -> int:
+        """
+        写入多张图像的特征，已保存的图像和形状不一致的特征会被跳过
+
+        Args:
+            entries: 摘要到特征（单个数组或数组列表）的字典
+
+        Returns:
+            写入的行数
+        """
+        if not entries or self._full:
+            return 0
+        try:
+            with self._lock, self._file_lock():
+                return self._append(entries)
+        except OSError as e:
+            logging.warning(f"写入特征存储 {self.model} 失败: {str(e)}")
+            return 0
+
+    def put(self, digest: str, feature: Any) -> int:
+        """
+        写入一张图像的特征
+
+        Args:
+            digest: 图像摘要
+            feature: 单个数组或数组列表
+
+        Returns:
+            写入的行数
+        """
+        return self.put_many({digest: feature})
+
+    def _append(self, entries: Dict[str, Any]) -> int:
+        """
+        追加特征，调用时需持有锁和文件锁
+        """
+        first = next(iter(entries.values()))
+        single = isinstance(first, np.ndarray)
+        self._write_meta([tuple(np.shape(array)) for array in ([first] if single else first)], single)
+        # 丢弃崩溃的进程写了一半的行，保证特征文件与键文件对齐
+        rows = self._committed_rows()
+        row_bytes = self.dim * self._dtype.itemsize
+        for path, size in ((self.vectors_file, rows * row_bytes), (self.keys_file, rows * _DIGEST_BYTES)):
+            if os.path.isfile(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+        self._refresh()
+
+        keys, vectors = [], []
+        for digest, feature in entries.items():
+            key = bytes.fromhex(digest)
+            arrays = [feature] if self._single else list(feature)
+            if key in self._index or key in keys or \
+                    [tuple(np.shape(array)) for array in arrays] != self._shapes:
+                continue
+            keys.append(key)
+            vectors.append(np.concatenate([np.asarray(array, dtype=self._dtype).ravel() for array in arrays]))
+        if not keys:
+            return 0
+        if (self._rows + len(keys)) * row_bytes > self.max_bytes:
+            self._full = True
+            logging.warning(f"特征存储 {self.model} 已达到大小上限，之后的特征不再保存"
+                            f"（可在设置中提高上限或清空特征存储）")
+            return 0
+
+        with open(self.vectors_file, 'ab') as f:
+            f.write(np.stack(vectors).tobytes())
+        with open(self.keys_file, 'ab') as f:
+            f.write(b''.join(keys))
+        for i, key in enumerate(keys):
+            self._index[key] = self._rows + i
+        self._rows += len(keys)
+        self._matrix = None
+        return len(keys)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._rows
+
+
+def _model_dirname(model: str) -> str:
+    """
+    由模型键生成目录名：可读的前缀加上完整键的摘要
+    """
+    prefix = re.sub(r'[^0-9A-Za-z._-]+', '_', model)[:48].strip('_')
+    return f"{prefix}-{hashlib.blake2b(model.encode('utf-8'), digest_size=6).hexdigest()}"
+
+
+_settings = {'directory': None, 'max_bytes': 20 * 1024 ** 3}
+_instances: Dict[str, EmbeddingStore] = {}
+_instances_pid: Optional[int] = None
+_instances_lock = threading.Lock()
+
+
+def configure_embedding_store(directory: Optional[str], max_bytes: int = 20 * 1024 ** 3) -> None:
+    """
+    设置特征存储目录，由引擎在执行前调用（以 fork 方式创建的工作进程会继承该设置）
+
+    Args:
+        directory: 存储根目录，为None时禁用特征存储
+        max_bytes: 每个模型的特征文件大小上限（字节）
+    """
+    with _instances_lock:
+        if (_settings['directory'], _settings['max_bytes']) != (directory, int(max_bytes)):
+            _settings['directory'] = directory
+            _settings['max_bytes'] = int(max_bytes)
+            _instances.clear()
+
+
+def embedding_store_usage(directory: str, max_bytes: int) -> List[Dict[str, Any]]:
+    """
+    统计目录中各模型特征存储的占用
+
+    Args:
+        directory: 存储根目录
+        max_bytes: 每个模型的特征文件大小上限（字节）
+
+    Returns:
+        [{'model': 模型键, 'rows': 图像数, 'bytes': 特征文件大小, 'full': 是否已无法写入新的特征}, ...]
+    """
+    usage = []
+    if not os.path.isdir(directory):
+        return usage
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        meta_path = os.path.join(path, EmbeddingStore.META_FILENAME)
+        if not os.path.isfile(meta_path):
+            continue
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            vectors_path = os.path.join(path, EmbeddingStore.VECTORS_FILENAME)
+            size = os.path.getsize(vectors_path) if os.path.isfile(vectors_path) else 0
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取特征存储 {name} 失败: {str(e)}")
+            continue
+        row_bytes = sum(int(np.prod(shape)) for shape in meta['shapes']) * np.dtype(meta['dtype']).itemsize
+        usage.append({
+            'model': meta.get('model', name),
+            'rows': size // row_bytes if row_bytes else 0,
+            'bytes': size,
+            'full': size + row_bytes > max_bytes,
+        })
+    return usage
+
+
+def clear_embedding_stores(directory: str) -> int:
+    """
+    删除目录中的全部特征存储，调用时不能有任务正在使用特征存储
+
+    Args:
+        directory: 存储根目录
+
+    Returns:
+        删除的模型存储个数
+    """
+    with _instances_lock:
+        _instances.clear()
+        if not os.path.isdir(directory):
+            return 0
+        removed = 0
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+def get_embedding_store(model: str, dtype: str = 'float32') -> Optional[EmbeddingStore]:
+    """
+    获取当前进程中某个模型的特征存储
+
+    Args:
+        model: 模型键
+        dtype: 新建存储时特征的保存类型
+
+    Returns:
+        特征存储，未启用或无法打开时返回None
+    """
+    global _instances_pid
+    with _instances_lock:
+        if _settings['directory'] is None:
+            return None
+        if _instances_pid != os.getpid():
+            _instances.clear()
+            _instances_pid = os.getpid()
+        if model not in _instances:
+            try:
+                _instances[model] = EmbeddingStore(_settings['directory'], model, dtype, _settings['max_bytes'])
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"无法打开特征存储 {model}: {str(e)}")
+                return None
+        return _instances[model]
@@ -0,0 +1,139 @@
+"""
+哈希集合模块 - 按名称持久化保存感知哈希，用于跨多次运行、多个数据集去重
+"""
+import os
+import re
+import shutil
+import logging
+import threading
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+class HashSet:
+    """
+    持久化的 64 位哈希集合
+
+    每个集合是一个只追加写入的文件，依次保存大端序的 uint64 哈希值，读取时整体载入。
+    """
+    def __init__(self, path: str):
+        """
+        初始化哈希集合
+
+        Args:
+            path: 集合文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> np.ndarray:
+        """
+        读取集合中的全部哈希
+
+        Returns:
+            uint64 数组，集合不存在时为空数组
+        """
+        if not os.path.isfile(self.path):
+            return np.empty(0, dtype=np.uint64)
+        with self._lock, open(self.path, 'rb') as f:
+            data = f.read()
+        # 丢弃写了一半的末尾
+        data = data[:len(data) - len(data) % 8]
+        return np.frombuffer(data, dtype='>u8').astype(np.uint64)
+
+    def add(self, hashes: Iterable[int]) -> None:
+        """
+        追加哈希
+
+        Args:
+            hashes: 哈希值
+        """
+        array = np.fromiter(hashes, dtype=np.uint64)
+        if not len(array):
+            return
+        try:
+            with self._lock, open(self.path, 'ab') as f:
+                f.write(array.astype('>u8').tobytes())
+        except OSError as e:
+            logging.warning(f"写入哈希集合 {self.path} 失败: {str(e)}")
+
+
+_settings = {'directory': None, 'pending': None}
+
+
+def configure_hash_sets(directory: Optional[str], pending_directory: Optional[str] = None) -> None:
+    """
+    设置哈希集合目录，由引擎在执行前调用
+
+    Args:
+        directory: 保存哈希集合的目录
+        pending_directory: 当前片段保留的哈希先写入该目录，运行成功完成后由 commit_hash_sets 合并到哈希集合；
+            为None时本次保留的哈希不保存（例如估算模式）
+    """
+    _settings['directory'] = directory
+    _settings['pending'] = pending_directory
+
+
+def _open(directory: Optional[str], name: str, method: str) -> Optional[HashSet]:
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    filename = re.sub(r'[\\/:*?"<>|\s]+', '_', name.strip())
+    return HashSet(os.path.join(directory, f"{filename}.{method}.u64"))
+
+
+def open_hash_set(name: str, method: str) -> Optional[HashSet]:
+    """
+    按名称打开哈希集合，不同哈希算法的集合互相独立
+
+    Args:
+        name: 集合名称，例如数据集或角色名
+        method: 哈希算法
+
+    Returns:
+        哈希集合，未设置目录时返回None
+    """
+    return _open(_settings['directory'], name, method)
+
+
+def open_pending_hash_set(name: str, method: str) -> Optional[HashSet]:
+    """
+    打开本次运行中待合并的哈希集合
+
+    Args:
+        name: 集合名称
+        method: 哈希算法
+
+    Returns:
+        待合并的哈希集合，本次运行不保存哈希时返回None
+    """
+    return _open(_settings['pending'], name, method)
+
+
+def commit_hash_sets(pending_directory: str, directory: str) -> int:
+    """
+    将一次运行中待合并的哈希追加到对应的哈希集合，并删除待合并目录，在运行成功完成后调用
+
+    Args:
+        pending_directory: 待合并目录（包括各片段的子目录）
+        directory: 保存哈希集合的目录
+
+    Returns:
+        合并的哈希个数
+    """
+    if not os.path.isdir(pending_directory):
+        return 0
+    count = 0
+    # 待合并目录中每个片段一个子目录，同名集合的文件合并到同一个哈希集合
+    for root, _, filenames in sorted(os.walk(pending_directory)):
+        for filename in sorted(filenames):
+            if not filename.endswith('.u64'):
+                continue
+            hashes = HashSet(os.path.join(root, filename)).load()
+            if len(hashes):
+                os.makedirs(directory, exist_ok=True)
+                HashSet(os.path.join(directory, filename)).add(int(value) for value in hashes)
+                count += len(hashes)
+    shutil.rmtree(pending_directory, ignore_errors=True)
+    return count
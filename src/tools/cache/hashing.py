@@ -0,0 +1,123 @@
+"""
+哈希工具模块 - 为缓存生成图像内容摘要和步骤签名
+"""
+import json
+import hashlib
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+# 参与步骤签名的依赖包（导入名称到发行包名称），版本变化时缓存自动失效
+# imgutils 以 dghs-imgutils 发布，PyPI 上名为 imgutils 的是另一个无关的包
+_VERSION_PACKAGES = {
+    'waifuc': 'waifuc',
+    'imgutils': 'dghs-imgutils',
+}
+_versions: Optional[Dict[str, str]] = None
+
+
+def image_digest(image: Image.Image) -> Optional[str]:
+    """
+    计算图像像素内容的摘要
+
+    Args:
+        image: 图像
+
+    Returns:
+        十六进制摘要，多帧图像返回None（只有第一帧参与计算，无法保证唯一）
+    """
+    if getattr(image, 'is_animated', False):
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}|{image.size[0]}x{image.size[1]}|".encode())
+    if image.mode == 'P' and image.palette is not None:
+        h.update(bytes(image.getpalette() or []))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def canonical_json(value: Any) -> Optional[str]:
+    """
+    生成键有序、格式固定的 JSON 文本
+
+    Args:
+        value: 任意可序列化的值
+
+    Returns:
+        JSON 文本，无法序列化时返回None
+    """
+    try:
+        return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    except (TypeError, ValueError):
+        return None
+
+
+def item_digest(item: Any) -> Optional[str]:
+    """
+    计算图像项的摘要，包括像素内容和元数据（元数据会影响部分动作的输出，例如文件名和标签）
+
+    Args:
+        item: 图像项
+
+    Returns:
+        十六进制摘要，无法计算时返回None
+    """
+    pixels = image_digest(item.image)
+    meta = canonical_json(item.meta or {})
+    if pixels is None or meta is None:
+        return None
+    return hashlib.blake2b(f"{pixels}|{meta}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _module_version(name: str) -> str:
+    """
+    从模块的 __version__ 读取版本，用于以源码方式安装、没有发行包元数据的依赖
+    """
+    import importlib
+    try:
+        return str(getattr(importlib.import_module(name), '__version__', 'unknown'))
+    except ImportError:
+        return 'unknown'
+
+
+def package_versions() -> Dict[str, str]:
+    """
+    获取影响处理结果的依赖包和本项目的版本
+
+    Returns:
+        包名到版本的映射
+    """
+    global _versions
+    if _versions is None:
+        from importlib import metadata
+        from src import __version__
+
+        versions = {'image_processor': __version__}
+        for name, distribution in _VERSION_PACKAGES.items():
+            try:
+                versions[name] = metadata.version(distribution)
+            except metadata.PackageNotFoundError:
+                versions[name] = _module_version(name)
+        _versions = versions
+    return _versions
+
+
+def step_signature(parent: str, action_name: str, params: Dict[str, Any]) -> str:
+    """
+    计算步骤签名，签名同时包含之前所有步骤的签名，因此代表从片段开始到该步骤的整个前缀
+
+    Args:
+        parent: 前一步骤的签名，第一步为空字符串
+        action_name: 操作名称
+        params: 操作参数
+
+    Returns:
+        十六进制签名
+    """
+    payload = canonical_json({
+        'parent': parent,
+        'action': action_name,
+        'params': json.loads(json.dumps(params or {}, default=str)),
+        'versions': package_versions(),
+    })
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
@@ -0,0 +1,308 @@
+"""
+步骤结果缓存模块 - 以内容地址缓存无状态步骤对每个图像的输出
+"""
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .hashing import item_digest, step_signature
+
+# PNG 可以无损保存的图像模式，其余模式（如 I / F）以 NumPy 数组保存
+_PNG_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I;16')
+
+
+class StepCache:
+    """
+    内容地址的步骤结果缓存
+
+    键由输入图像摘要和步骤前缀签名组成，值为该输入经过前缀所有步骤后的全部输出图像项。
+    每个条目保存为 objects 目录下的一个文件，条目大小和最近访问时间记录在 sqlite 索引中，
+    总大小超过上限时按最近最少使用的顺序淘汰。多个进程可以同时使用同一个缓存目录。
+    写入时只更新进程内累计的总大小，累计值超过上限时才从索引重新统计并淘汰，写入开销不随条目数增长。
+    """
+    DB_FILENAME = "index.sqlite"
+    OBJECTS_DIRNAME = "objects"
+
+    def __init__(self, directory: str, max_bytes: int = 5 * 1024 ** 3):
+        """
+        初始化步骤结果缓存
+
+        Args:
+            directory: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+        """
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.objects_dir = os.path.join(directory, self.OBJECTS_DIRNAME)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, self.DB_FILENAME),
+                                     timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._total = self.total_bytes()
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        """
+        读取缓存条目
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            输出图像项列表，未命中时返回None
+        """
+        with self._lock, self._conn:
+            found = self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?",
+                                       (time.time(), key)).rowcount
+        if not found:
+            self.misses += 1
+            return None
+        try:
+            with open(self._object_path(key), 'rb') as f:
+                items = _decode_items(f.read())
+        except Exception as e:
+            logging.warning(f"读取缓存条目 {key} 失败: {str(e)}")
+            self._delete(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return items
+
+    def put(self, key: str, items: Sequence[Any]) -> bool:
+        """
+        写入缓存条目，元数据无法序列化为 JSON 的输出不会被缓存
+
+        Args:
+            key: 缓存键
+            items: 输出图像项列表
+
+        Returns:
+            是否写入成功
+        """
+        data = _encode_items(items)
+        if data is None:
+            return False
+        path = self._object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f"写入缓存条目 {key} 失败: {str(e)}")
+            return False
+        with self._lock, self._conn:
+            old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                               (key, len(data), time.time()))
+            self._total += len(data) - (old[0] if old else 0)
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+        return True
+
+    def total_bytes(self) -> int:
+        """
+        获取缓存条目总大小
+
+        Returns:
+            总字节数
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            包含条目数、总大小、命中和未命中次数的字典
+        """
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self) -> None:
+        """
+        清空缓存
+        """
+        with self._lock, self._conn:
+            keys = [row[0] for row in self._conn.execute("SELECT key FROM entries")]
+            self._conn.execute("DELETE FROM entries")
+            self._total = 0
+        for key in keys:
+            try:
+                os.remove(self._object_path(key))
+            except OSError:
+                pass
+
+    def _delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._total -= old[0] if old else 0
+        try:
+            os.remove(self._object_path(key))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        """
+        总大小超过上限时淘汰最近最少使用的条目，直到低于上限的 90%
+
+        总大小从索引重新统计（包括其他进程写入的条目），并用于校正进程内的累计值
+        """
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            with self._lock:
+                self._total = total
+            return
+        target = self.max_bytes * 0.9
+        with self._lock, self._conn:
+            victims = []
+            for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+                if total <= target:
+                    break
+                victims.append(key)
+                total -= size
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in victims])
+            self._total = total
+        for key in victims:
+            try:
+                os.remove(self._object_path(key))
+            except OSError:
+                pass
+        logging.info(f"步骤缓存淘汰 {len(victims)} 个条目")
+
+    def close(self) -> None:
+        """
+        关闭索引数据库连接
+        """
+        with self._lock:
+            self._conn.close()
+
+
+def _encode_image(image: Image.Image) -> Tuple[str, bytes]:
+    buffer = io.BytesIO()
+    if image.mode in _PNG_MODES:
+        image.save(buffer, format='PNG', compress_level=1)
+        return 'png', buffer.getvalue()
+    np.save(buffer, np.asarray(image), allow_pickle=False)
+    return 'npy', buffer.getvalue()
+
+
+def _decode_image(kind: str, data: bytes, mode: str) -> Image.Image:
+    if kind == 'npy':
+        image = Image.fromarray(np.load(io.BytesIO(data), allow_pickle=False))
+    else:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    if image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+
+def _encode_items(items: Sequence[Any]) -> Optional[bytes]:
+    """
+    将图像项列表编码为单个字节串：一行 JSON 头（元数据、格式和长度）后接各图像数据
+    """
+    header = []
+    blobs = []
+    for item in items:
+        if getattr(item.image, 'is_animated', False):
+            return None
+        kind, blob = _encode_image(item.image)
+        header.append({'meta': item.meta, 'kind': kind, 'mode': item.image.mode, 'size': len(blob)})
+        blobs.append(blob)
+    try:
+        head = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    except (TypeError, ValueError):
+        return None
+    return head + b'\n' + b''.join(blobs)
+
+
+def _decode_items(data: bytes) -> List[Any]:
+    from waifuc.model import ImageItem
+
+    head, _, body = data.partition(b'\n')
+    items = []
+    offset = 0
+    for entry in json.loads(head.decode('utf-8')):
+        blob = body[offset:offset + entry['size']]
+        offset += entry['size']
+        items.append(ImageItem(_decode_image(entry['kind'], blob, entry['mode']), entry['meta']))
+    return items
+
+
+def prefix_signatures(step_specs: Sequence[Tuple[str, Dict[str, Any]]]) -> List[str]:
+    """
+    计算一组连续步骤的前缀签名
+
+    Args:
+        step_specs: (操作名称, 操作参数) 列表
+
+    Returns:
+        每个步骤对应的前缀签名
+    """
+    signatures = []
+    parent = ''
+    for action_name, params in step_specs:
+        parent = step_signature(parent, action_name, params)
+        signatures.append(parent)
+    return signatures
+
+
+def run_cached(item: Any, actions: Sequence[Any], signatures: Sequence[str],
+               cache: Optional[StepCache]) -> List[Any]:
+    """
+    让单个图像项流经一组无状态动作，优先复用缓存中最长的已计算前缀，
+    只重新计算之后的步骤，并缓存每个步骤的输出
+
+    Args:
+        item: 输入图像项
+        actions: 动作实例列表
+        signatures: 各步骤的前缀签名
+        cache: 步骤缓存，为None时直接计算
+
+    Returns:
+        输出图像项列表
+    """
+    digest = item_digest(item) if cache is not None else None
+    if digest is None:
+        outputs = [item]
+        for action in actions:
+            outputs = list(action.iter_from(iter(outputs)))
+        return outputs
+
+    keys = [hashlib.blake2b(f"{digest}|{signature}".encode(), digest_size=16).hexdigest()
+            for signature in signatures]
+    start, outputs = 0, [item]
+    for k in range(len(actions), 0, -1):
+        cached = cache.get(keys[k - 1])
+        if cached is not None:
+            start, outputs = k, cached
+            break
+    for j in range(start, len(actions)):
+        outputs = list(actions[j].iter_from(iter(outputs)))
+        cache.put(keys[j], outputs)
+    return outputs
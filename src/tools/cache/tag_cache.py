@@ -0,0 +1,214 @@
+"""
+标签缓存模块 - 按图像内容摘要和标签模型持久化保存标签模型输出的分数
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+# 每张图像最多保存的分数个数
+DEFAULT_TOP_K = 256
+# 低于该分数的标签不保存（请求的阈值更低时按请求的阈值保存）
+DEFAULT_MIN_SCORE = 0.05
+
+SparseScores = Tuple[np.ndarray, np.ndarray]
+
+
+def sparsify(scores: np.ndarray, floor: float, top_k: int) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    将模型输出的分数向量压缩为稀疏形式：分数高于 floor 的前 top_k 个标签的序号和 float16 分数
+
+    Args:
+        scores: 分数向量
+        floor: 保存的最低分数
+        top_k: 最多保存的标签数
+
+    Returns:
+        (序号数组, 分数数组, 截断分数)，未保存的标签分数都不高于截断分数
+    """
+    scores = np.asarray(scores, dtype=np.float32).ravel()
+    kept = np.flatnonzero(scores > floor)
+    if len(kept) > top_k:
+        order = np.argsort(scores[kept])[::-1]
+        kept = np.sort(kept[order[:top_k]])
+    dropped = np.ones(len(scores), dtype=bool)
+    dropped[kept] = False
+    cutoff = float(scores[dropped].max()) if dropped.any() else 0.0
+    index_dtype = np.uint16 if len(scores) <= 65536 else np.uint32
+    return kept.astype(index_dtype), scores[kept].astype(np.float16), cutoff
+
+
+class TagCache:
+    """
+    标签分数缓存
+
+    键为图像像素摘要和标签模型（包含模型所在依赖包的版本），值为稀疏保存的分数。
+    只要请求的阈值不低于条目的截断分数，就可以直接从缓存的分数重新按阈值筛选标签，
+    修改阈值不需要重新推理。条目保存在单个 sqlite 文件中，条目数超过上限时淘汰最久未访问的条目。
+    """
+    DB_FILENAME = "tags.sqlite"
+
+    def __init__(self, directory: str, max_entries: int = 1000000, top_k: int = DEFAULT_TOP_K,
+                 min_score: float = DEFAULT_MIN_SCORE):
+        """
+        初始化标签缓存
+
+        Args:
+            directory: 缓存目录
+            max_entries: 条目数上限
+            top_k: 每张图像最多保存的分数个数
+            min_score: 默认保存的最低分数
+        """
+        self.directory = directory
+        self.max_entries = int(max_entries)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, self.DB_FILENAME),
+                                     timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS scores ("
+                               "digest TEXT NOT NULL, model TEXT NOT NULL, cutoff REAL NOT NULL, "
+                               "indices BLOB NOT NULL, index_bytes INTEGER NOT NULL, scores BLOB NOT NULL, "
+                               "last_access REAL NOT NULL, PRIMARY KEY (digest, model))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS scores_last_access ON scores (last_access)")
+
+    def get_many(self, digests: Iterable[str], model: str, threshold: float) -> Dict[str, SparseScores]:
+        """
+        读取多张图像的缓存分数
+
+        Args:
+            digests: 图像摘要
+            model: 标签模型键
+            threshold: 要使用的最低阈值，截断分数高于该阈值的条目视为未命中
+
+        Returns:
+            摘要到 (序号数组, 分数数组) 的字典，只包含命中的图像
+        """
+        digests = list(dict.fromkeys(digests))
+        found: Dict[str, SparseScores] = {}
+        if not digests:
+            return found
+        placeholders = ",".join("?" * len(digests))
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"SELECT digest, cutoff, indices, index_bytes, scores FROM scores "
+                f"WHERE model = ? AND digest IN ({placeholders})", [model] + digests).fetchall()
+            for digest, cutoff, indices, index_bytes, scores in rows:
+                if cutoff > threshold:
+                    continue
+                found[digest] = (np.frombuffer(indices, dtype=np.uint16 if index_bytes == 2 else np.uint32),
+                                 np.frombuffer(scores, dtype=np.float16))
+            if found:
+                self._conn.executemany("UPDATE scores SET last_access = ? WHERE digest = ? AND model = ?",
+                                       [(time.time(), digest, model) for digest in found])
+        self.hits += len(found)
+        self.misses += len(digests) - len(found)
+        return found
+
+    def put_many(self, entries: Dict[str, np.ndarray], model: str, threshold: float) -> Dict[str, SparseScores]:
+        """
+        写入多张图像的完整分数向量
+
+        Args:
+            entries: 摘要到分数向量的字典
+            model: 标签模型键
+            threshold: 本次请求的最低阈值，低于默认最低分数时按该阈值保存
+
+        Returns:
+            摘要到写入的 (序号数组, 分数数组) 的字典
+        """
+        floor = min(self.min_score, threshold)
+        sparse: Dict[str, SparseScores] = {}
+        rows = []
+        now = time.time()
+        for digest, vector in entries.items():
+            indices, scores, cutoff = sparsify(vector, floor, self.top_k)
+            sparse[digest] = (indices, scores)
+            rows.append((digest, model, cutoff, indices.tobytes(), indices.dtype.itemsize, scores.tobytes(), now))
+        if not rows:
+            return sparse
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._puts += len(rows)
+                if self._puts >= 1000:
+                    self._puts = 0
+                    self._evict()
+        except sqlite3.Error as e:
+            logging.warning(f"写入标签缓存失败: {str(e)}")
+        return sparse
+
+    def _evict(self) -> None:
+        """
+        条目数超过上限时删除最久未访问的条目，调用时需持有锁
+        """
+        count = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute("DELETE FROM scores WHERE rowid IN (SELECT rowid FROM scores "
+                               "ORDER BY last_access LIMIT ?)", (count - self.max_entries,))
+
+    def clear(self) -> None:
+        """
+        删除所有条目
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM scores")
+
+    def close(self) -> None:
+        """
+        关闭数据库连接
+        """
+        with self._lock:
+            self._conn.close()
+
+
+_settings = {'directory': None}
+_instance: Optional[TagCache] = None
+_instance_pid: Optional[int] = None
+_instance_lock = threading.Lock()
+
+
+def configure_tag_cache(directory: Optional[str]) -> None:
+    """
+    设置标签缓存目录，由引擎在执行前调用（以 fork 方式创建的工作进程会继承该设置）
+
+    Args:
+        directory: 缓存目录，为None时禁用标签缓存
+    """
+    global _instance
+    with _instance_lock:
+        if _settings['directory'] != directory:
+            _settings['directory'] = directory
+            _instance = None
+
+
+def get_tag_cache() -> Optional[TagCache]:
+    """
+    获取当前进程的标签缓存，每个进程使用自己的数据库连接
+
+    Returns:
+        标签缓存，未启用或无法打开时返回None
+    """
+    global _instance, _instance_pid
+    with _instance_lock:
+        if _settings['directory'] is None:
+            return None
+        if _instance is None or _instance_pid != os.getpid():
+            try:
+                _instance = TagCache(_settings['directory'])
+                _instance_pid = os.getpid()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"无法打开标签缓存 {_settings['directory']}: {str(e)}")
+                _settings['directory'] = None
+                return None
+        return _instance
@@ -1,9 +1,16 @@
 """
 Sources包初始化文件 - 导出所有公共组件
+
+来源类在第一次访问时才导入所在模块，导入本包不会加载 waifuc。
 """
-from .source_registry import registry
+from .source_registry import registry, SOURCE_MANIFEST
 from .base import BaseSource, SourceWithParams
-from .waifuc_sources import (
-    LocalSource, DanbooruSource, SankakuSource, ZerochanSource,
-    PixivSource, YandereSource
-)
+
+
+def __getattr__(name):
+    if any(source_name == name for _, source_name, _ in SOURCE_MANIFEST):
+        return registry.get_source_class(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['registry', 'BaseSource', 'SourceWithParams'] + [source_name for _, source_name, _ in SOURCE_MANIFEST]
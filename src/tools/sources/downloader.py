@@ -0,0 +1,273 @@
+"""
+并发下载模块 - 为网络图像来源提供连接池、按主机并发和限速的下载层
+"""
+import io
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+
+# 各站点的默认限速（每秒请求数），按主机名后缀匹配
+DEFAULT_RATE_LIMITS = {
+    'donmai.us': 5.0,
+    'yande.re': 2.0,
+    'zerochan.net': 1.0,
+    'sankakucomplex.com': 2.0,
+    'sankakuapi.com': 2.0,
+    'pximg.net': 3.0,
+}
+
+# 遇到 429/503 时的最大重试次数
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """
+    令牌桶限速器，以固定速率补充令牌，允许不超过容量的突发请求
+    """
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数
+            burst: 桶容量，默认为 max(1, rate)
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst) if burst else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        获取一个令牌，令牌不足时阻塞等待
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """
+        站点要求退避时清空令牌，使后续请求至少等待指定时间
+
+        Args:
+            seconds: 等待秒数
+        """
+        with self.lock:
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+            self.updated = time.monotonic()
+
+
+def enlarge_connection_pool(session: requests.Session, pool_size: int) -> requests.Session:
+    """
+    扩大会话的连接池，保留已挂载适配器的重试策略
+
+    Args:
+        session: requests 会话
+        pool_size: 每个主机的最大连接数
+
+    Returns:
+        同一个会话
+    """
+    for prefix in ('http://', 'https://'):
+        adapter = session.get_adapter(prefix)
+        max_retries = adapter.max_retries if isinstance(adapter, HTTPAdapter) else 0
+        session.mount(prefix, HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                          max_retries=max_retries))
+    return session
+
+
+_shared_session: Optional[requests.Session] = None
+_shared_session_lock = threading.Lock()
+
+
+def get_shared_session(pool_size: int = 16) -> requests.Session:
+    """
+    获取进程内共享的带连接池的会话
+
+    Args:
+        pool_size: 每个主机的最大连接数
+
+    Returns:
+        共享会话
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = enlarge_connection_pool(requests.Session(), pool_size)
+        return _shared_session
+
+
+class ConcurrentDownloader:
+    """
+    并发下载器
+
+    每个主机使用独立的线程池，线程数即该主机的最大并发下载数；每个主机另有一个令牌桶限速，
+    遇到 429/503 时按 Retry-After 退避。所有请求复用同一个带连接池的会话。
+    """
+    def __init__(self, session: Optional[requests.Session] = None, workers_per_host: int = 4,
+                 rate_limits: Optional[Dict[str, float]] = None, default_rate: float = 0,
+                 timeout: float = 30):
+        """
+        初始化下载器
+
+        Args:
+            session: requests 会话，默认使用共享会话
+            workers_per_host: 每个主机的并发下载数
+            rate_limits: 主机名后缀到每秒请求数的映射，会覆盖 DEFAULT_RATE_LIMITS 中的同名项
+            default_rate: 未匹配主机的每秒请求数，0 表示不限速
+            timeout: 单个请求的超时时间（秒）
+        """
+        self.workers_per_host = max(1, int(workers_per_host))
+        pool_size = self.workers_per_host * 2
+        if session is None:
+            session = get_shared_session(pool_size)
+        else:
+            enlarge_connection_pool(session, pool_size)
+        self.session = session
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.default_rate = float(default_rate or 0)
+        self.timeout = timeout
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._buckets: Dict[str, Optional[TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+    def _host_rate(self, host: str) -> float:
+        for suffix, rate in self.rate_limits.items():
+            if host == suffix or host.endswith('.' + suffix):
+                return float(rate)
+        return self.default_rate
+
+    def _host_resources(self, host: str) -> Tuple[ThreadPoolExecutor, Optional[TokenBucket]]:
+        with self._lock:
+            if host not in self._executors:
+                self._executors[host] = ThreadPoolExecutor(max_workers=self.workers_per_host,
+                                                           thread_name_prefix=f"download-{host}")
+                rate = self._host_rate(host)
+                self._buckets[host] = TokenBucket(rate) if rate > 0 else None
+            return self._executors[host], self._buckets[host]
+
+    def fetch(self, url: str) -> bytes:
+        """
+        下载单个文件（在调用线程中执行，遵守所在主机的限速）
+
+        Args:
+            url: 文件地址
+
+        Returns:
+            文件内容
+        """
+        _, bucket = self._host_resources(urlsplit(url).hostname or '')
+        for attempt in range(MAX_RETRIES + 1):
+            if bucket:
+                bucket.acquire()
+            response = self.session.get(url, timeout=self.timeout)
+            if response.status_code in (429, 503) and attempt < MAX_RETRIES:
+                delay = _retry_after(response, attempt)
+                logging.warning(f"{url} 返回 {response.status_code}，{delay:.1f} 秒后重试")
+                if bucket:
+                    bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response.content
+
+    def submit(self, url: str):
+        """
+        将下载任务提交到对应主机的线程池
+
+        Args:
+            url: 文件地址
+
+        Returns:
+            下载任务的 Future
+        """
+        executor, _ = self._host_resources(urlsplit(url).hostname or '')
+        return executor.submit(self.fetch, url)
+
+    def iter_items(self, records: Iterable[Tuple[Any, str, Dict[str, Any]]],
+                   group_name: str = 'web') -> Iterator[Any]:
+        """
+        并发下载 (ID, 地址, 元数据) 序列并按原顺序输出图像项
+
+        同时在途的下载数量有上限，下游处理较慢时不会无限制地提前下载。
+
+        Args:
+            records: waifuc 网络来源 _iter_data() 产出的记录
+            group_name: 来源分组名称，用于生成默认文件名
+
+        Yields:
+            图像项
+        """
+        from waifuc.model import ImageItem
+
+        max_pending = self.workers_per_host * 4
+        pending = deque()
+
+        def collect():
+            id_, url, meta, future = pending.popleft()
+            try:
+                data = future.result()
+                image = Image.open(io.BytesIO(data))
+                image.load()
+            except Exception as e:
+                logging.error(f"下载 {url} 失败: {str(e)}")
+                return None
+            _, ext = os.path.splitext(urlsplit(url).path)
+            meta = {**meta, 'url': url}
+            meta.setdefault('filename', f"{group_name}_{id_}{ext}")
+            return ImageItem(image, meta)
+
+        try:
+            for id_, url, meta in records:
+                pending.append((id_, url, meta, self.submit(url)))
+                while len(pending) >= max_pending:
+                    item = collect()
+                    if item is not None:
+                        yield item
+            while pending:
+                item = collect()
+                if item is not None:
+                    yield item
+        finally:
+            for *_, future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        """
+        关闭所有主机的线程池
+        """
+        with self._lock:
+            for executor in self._executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._executors.clear()
+            self._buckets.clear()
+
+
+def _retry_after(response: requests.Response, attempt: int) -> float:
+    """
+    解析 Retry-After 头，缺失时按指数退避
+    """
+    value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return float(2 ** attempt)
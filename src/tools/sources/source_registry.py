@@ -1,32 +1,38 @@
 """
 Source注册表模块 - 管理和注册所有可用的图像来源
 """
-from typing import Dict, List, Type, Any
+import importlib
+from typing import Dict, List, Tuple, Type, Any
 from .base import BaseSource
-from .waifuc_sources import (
-    LocalSource, DanbooruSource, SankakuSource, ZerochanSource,
-    PixivSource, YandereSource
-)
+
+# (类别, 来源名称, 所在模块)，第一次获取来源类时才导入模块
+SOURCE_MANIFEST: List[Tuple[str, str, str]] = [
+    ("本地", "LocalSource", "waifuc_sources"),
+    ("网络", "DanbooruSource", "waifuc_sources"),
+    ("网络", "SankakuSource", "waifuc_sources"),
+    ("网络", "ZerochanSource", "waifuc_sources"),
+    ("网络", "PixivSource", "waifuc_sources"),
+    ("网络", "YandereSource", "waifuc_sources"),
+]
 
 
 class SourceRegistry:
     """
     所有可用图像来源的注册表
+
+    清单中的来源只记录名称、类别和所在模块，导入注册表不会加载 waifuc。
     """
     def __init__(self):
         self._sources: Dict[str, Type[BaseSource]] = {}
+        self._lazy_sources: Dict[str, str] = {}
         self._categories: Dict[str, List[str]] = {
             "本地": [],
             "网络": [],
         }
         
         # 注册来源
-        self.register("本地", LocalSource)
-        self.register("网络", DanbooruSource)
-        self.register("网络", SankakuSource)
-        self.register("网络", ZerochanSource)
-        self.register("网络", PixivSource)
-        self.register("网络", YandereSource)
+        for category, source_name, module_name in SOURCE_MANIFEST:
+            self.register_lazy(category, source_name, module_name)
     
     def register(self, category: str, source_class: Type[BaseSource]) -> None:
         """
@@ -45,6 +51,23 @@ class SourceRegistry:
         if source_name not in self._categories[category]:
             self._categories[category].append(source_name)
     
+    def register_lazy(self, category: str, source_name: str, module_name: str) -> None:
+        """
+        注册一个延迟导入的来源，第一次获取来源类时才导入所在模块
+        
+        Args:
+            category: 来源类别
+            source_name: 来源名称（即类名）
+            module_name: 所在模块，相对于本包的模块名称
+        """
+        self._lazy_sources[source_name] = module_name
+        
+        if category not in self._categories:
+            self._categories[category] = []
+        
+        if source_name not in self._categories[category]:
+            self._categories[category].append(source_name)
+    
     def get_source_class(self, source_name: str) -> Type[BaseSource]:
         """
         获取来源类
@@ -56,7 +79,10 @@ class SourceRegistry:
             来源类
         """
         if source_name not in self._sources:
-            raise ValueError(f"来源 '{source_name}' 未找到")
+            if source_name not in self._lazy_sources:
+                raise ValueError(f"来源 '{source_name}' 未找到")
+            module = importlib.import_module(f"{__package__}.{self._lazy_sources[source_name]}")
+            self._sources[source_name] = getattr(module, source_name)
         
         return self._sources[source_name]
     
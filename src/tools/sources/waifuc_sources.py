@@ -26,6 +26,25 @@ class WaifucSourceWrapper(SourceWithParams):
         """
         yield from self.source
 
+    def iter_items(self, downloader: Optional[Any] = None) -> Iterator[Any]:
+        """
+        获取图像项，网络来源交给并发下载器下载
+
+        waifuc 的网络来源逐个下载图像；提供下载器时只使用来源的 _iter_data() 获取
+        (ID, 地址, 元数据) 记录，实际下载由下载器按主机并发、限速执行。
+
+        Args:
+            downloader: ConcurrentDownloader 实例，为空时使用 waifuc 原有的逐个下载
+
+        Yields:
+            图像项序列
+        """
+        if downloader is None or not hasattr(self.source, '_iter_data'):
+            yield from self.source
+            return
+        group_name = getattr(self.source, 'group_name', self.__class__.__name__.lower())
+        yield from downloader.iter_items(self.source._iter_data(), group_name)
+
 
 # 本地图像来源
 class LocalSource(WaifucSourceWrapper):
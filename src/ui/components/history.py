@@ -5,6 +5,26 @@
 import gradio as gr
 import json
 from src.services.history_service import HistoryService, HistoryError
+from src.services.task_service import TaskService, TaskError
+from src.ui.components.task import format_size
+
+def format_profile(summary):
+    """
+    将执行记录的性能汇总格式化为 Markdown 表格，按阶段耗时从高到低排列
+    """
+    if not summary:
+        return "该记录没有性能数据"
+    size = lambda value: format_size(value) if value is not None else "-"
+    lines = [f"**性能汇总**：耗时 {summary['wall_seconds']:.1f} 秒，CPU {summary['cpu_seconds']:.1f} 秒，"
+             f"内存峰值 {size(summary['peak_rss_bytes'])}，读取 {size(summary['bytes_read'])}，"
+             f"写入 {size(summary['bytes_written'])}",
+             "",
+             "| 阶段 | 耗时(秒) | CPU(秒) | 加载(秒) | 输入 | 输出 | 丢弃 | 出错 | 内存峰值 |",
+             "| --- | --- | --- | --- | --- | --- | --- | --- | --- |"]
+    lines += [f"| {s['stage']} | {s['wall_seconds']:.2f} | {s['cpu_seconds']:.2f} | {s['model_load_seconds']:.2f} "
+              f"| {s['items_in']} | {s['items_out']} | {s['items_dropped']} | {s['items_errored']} "
+              f"| {size(s['peak_rss_bytes'])} |" for s in summary['stages']]
+    return "\n".join(lines)
 
 def render():
     """
@@ -26,7 +46,9 @@ def render():
         selected_record_index = gr.State(None)
         view_detail_btn = gr.Button("查看详情")
         open_dir_btn = gr.Button("打开输出目录")
+        resume_btn = gr.Button("从检查点继续执行")
         detail_output = gr.Textbox(label="记录详情", interactive=False, lines=10)
+        profile_output = gr.Markdown()
 
         # 刷新记录
         def refresh_records():
@@ -55,17 +77,19 @@ def render():
         def view_detail(selected_index, history_table_value):
             try:
                 if selected_index is None or not history_table_value:
-                    return "请先选择记录"
+                    return "请先选择记录", ""
                 record_id = history_table_value[selected_index][0]
                 record = HistoryService.get_record(record_id)
-                return json.dumps(record, indent=2) if record else "记录不存在"
+                if not record:
+                    return "记录不存在", ""
+                return json.dumps(record, indent=2), format_profile(record.get("profile_summary"))
             except HistoryError as e:
-                return str(e)
+                return str(e), ""
 
         view_detail_btn.click(
             fn=view_detail,
             inputs=[selected_record_index, history_table],
-            outputs=detail_output
+            outputs=[detail_output, profile_output]
         )
 
         # 打开输出目录
@@ -88,6 +112,29 @@ def render():
             outputs=detail_output
         )
 
+        # 从检查点继续执行失败或取消的任务
+        def resume_record(selected_index, history_table_value):
+            try:
+                if selected_index is None or not history_table_value:
+                    raise HistoryError("请先选择记录")
+                record_id = history_table_value[selected_index][0]
+                record = HistoryService.get_record(record_id)
+                if not record:
+                    raise HistoryError("记录不存在")
+                checkpoints = record.get("checkpoints") or []
+                TaskService.resume_task(record_id)
+                if checkpoints:
+                    return f"任务已从步骤 {checkpoints[-1]['last_step'] + 2} 继续执行，任务 ID: {record_id}"
+                return f"任务已重新开始执行（将跳过已处理的图像），任务 ID: {record_id}"
+            except (HistoryError, TaskError) as e:
+                return str(e)
+
+        resume_btn.click(
+            fn=resume_record,
+            inputs=[selected_record_index, history_table],
+            outputs=detail_output
+        )
+
         # 清理记录
         def clear_records(clear_option):
             try:
@@ -4,6 +4,7 @@
 """
 import gradio as gr
 from src.services.config_service import ConfigService, ConfigError
+from src.services.task_service import TaskService
 
 def render():
     """
@@ -12,7 +13,7 @@ def render():
     with gr.Tabs():
         with gr.Tab("通用设置"):
             output_dir = gr.Textbox(label="默认输出目录", value=ConfigService.get_output_directory())
-            temp_dir = gr.Textbox(label="临时目录", placeholder="留空使用系统默认")
+            temp_dir = gr.Textbox(label="临时目录", placeholder="留空时放在输出目录下，最终结果可直接移动到输出目录")
             log_level = gr.Dropdown(
                 choices=["DEBUG", "INFO", "WARNING", "ERROR"], label="日志级别",
                 value=ConfigService.get_log_level()
@@ -26,6 +27,63 @@ def render():
             size_1_1 = gr.Number(label="正方形 (1:1) 最小尺寸", value=1024)
             size_2_3 = gr.Number(label="纵向 (2:3) 最小尺寸", value=960)
             size_3_2 = gr.Number(label="横向 (3:2) 最小尺寸", value=960)
+            execution_mode = gr.Dropdown(
+                choices=["materialize", "stream", "hybrid", "pipeline"], label="执行模式",
+                value=ConfigService.get("engine.execution_mode", "materialize")
+            )
+            process_workers = gr.Number(
+                label="无状态步骤并行进程数（0 表示不启用）",
+                value=ConfigService.get("engine.process_workers", 0), precision=0
+            )
+            queue_size = gr.Number(
+                label="流水线队列长度", value=ConfigService.get("engine.queue_size", 8), precision=0
+            )
+            commit_workers = gr.Number(
+                label="提交最终结果的并行线程数", value=ConfigService.get("engine.commit_workers", 8), precision=0
+            )
+            intermediate_codec = gr.Dropdown(
+                choices=["auto", "mmap", "raw", "png0", "png1", "webp"], label="中间结果编码格式（auto 按基准测试选择）",
+                value=ConfigService.get("engine.intermediate_codec", "auto")
+            )
+            batch_size = gr.Number(
+                label="批量推理的批次大小（1 表示逐项推理）", value=ConfigService.get("engine.batch_size", 8), precision=0
+            )
+            action_pool_enabled = gr.Checkbox(
+                label="复用动作实例（多次运行之间不重新创建，构造时加载的模型不重新加载）",
+                value=ConfigService.get("engine.action_pool_enabled", True)
+            )
+            action_pool_max_gb = gr.Number(
+                label="复用的动作实例的内存上限（GB，不含 imgutils 自行缓存的模型）", value=ConfigService.get("engine.action_pool_max_gb", 4)
+            )
+
+            step_cache_enabled = gr.Checkbox(
+                label="缓存无状态步骤的结果（适合反复调整同一工作流时开启，重复运行时只重新计算修改过的步骤）",
+                value=ConfigService.get("cache.step_cache_enabled", False)
+            )
+            step_cache_max_gb = gr.Number(
+                label="步骤缓存大小上限（GB）", value=ConfigService.get("cache.step_cache_max_gb", 5)
+            )
+            tag_cache_enabled = gr.Checkbox(
+                label="缓存标签模型的分数（修改阈值或重复运行时不再推理）",
+                value=ConfigService.get("cache.tag_cache_enabled", True)
+            )
+            detection_cache_enabled = gr.Checkbox(
+                label="缓存人脸、头部、人物检测结果（多个检测步骤共用，重复运行时不再检测）",
+                value=ConfigService.get("cache.detection_cache_enabled", True)
+            )
+            embedding_store_enabled = gr.Checkbox(
+                label="保存 LPIPS、CCIP 特征（重复运行或跨数据集去重时不再提取）",
+                value=ConfigService.get("cache.embedding_store_enabled", True)
+            )
+            embedding_store_max_gb = gr.Number(
+                label="每个特征模型的存储大小上限（GB）", value=ConfigService.get("cache.embedding_store_max_gb", 20)
+            )
+            embedding_store_status = gr.Textbox(
+                label="特征存储占用", value=TaskService.get_embedding_store_status, interactive=False
+            )
+            with gr.Row():
+                refresh_store_btn = gr.Button("刷新特征存储占用")
+                clear_store_btn = gr.Button("清空特征存储")
 
         with gr.Tab("数据源设置"):
             danbooru_limit = gr.Number(label="Danbooru 默认下载数量", value=100)
@@ -35,6 +93,14 @@ def render():
             pixiv_username = gr.Textbox(label="Pixiv 用户名")
             pixiv_password = gr.Textbox(label="Pixiv 密码", type="password")
             pixiv_limit = gr.Number(label="Pixiv 默认下载数量", value=100)
+            download_workers = gr.Number(
+                label="每个站点的并发下载数",
+                value=ConfigService.get("sources.download.workers_per_host", 4), precision=0
+            )
+            download_rate = gr.Number(
+                label="未内置站点的每秒请求数上限（0 表示不限速）",
+                value=ConfigService.get("sources.download.default_rate", 0)
+            )
 
         save_btn = gr.Button("保存设置")
         settings_output = gr.Textbox(label="设置结果")
@@ -42,9 +108,9 @@ def render():
         # 保存设置
         def save_settings(
             output_dir, temp_dir, log_level, theme, language, tooltips,
-            prefix, size_1_1, size_2_3, size_3_2,
+            prefix, size_1_1, size_2_3, size_3_2, execution_mode, process_workers, queue_size, commit_workers, intermediate_codec, batch_size, action_pool_enabled, action_pool_max_gb, step_cache_enabled, step_cache_max_gb, tag_cache_enabled, detection_cache_enabled, embedding_store_enabled, embedding_store_max_gb,
             danbooru_limit, sankaku_username, sankaku_password, sankaku_limit,
-            pixiv_username, pixiv_password, pixiv_limit
+            pixiv_username, pixiv_password, pixiv_limit, download_workers, download_rate
         ):
             try:
                 ConfigService.set_output_directory(output_dir)
@@ -59,6 +125,20 @@ def render():
                     "2:3": size_2_3,
                     "3:2": size_3_2
                 })
+                ConfigService.set("engine.execution_mode", execution_mode)
+                ConfigService.set("engine.process_workers", int(process_workers or 0))
+                ConfigService.set("engine.queue_size", int(queue_size or 8))
+                ConfigService.set("engine.commit_workers", max(1, int(commit_workers or 8)))
+                ConfigService.set("engine.intermediate_codec", intermediate_codec)
+                ConfigService.set("engine.batch_size", max(1, int(batch_size or 1)))
+                ConfigService.set("engine.action_pool_enabled", bool(action_pool_enabled))
+                ConfigService.set("engine.action_pool_max_gb", float(action_pool_max_gb or 0))
+                ConfigService.set("cache.step_cache_enabled", bool(step_cache_enabled))
+                ConfigService.set("cache.step_cache_max_gb", float(step_cache_max_gb or 5))
+                ConfigService.set("cache.tag_cache_enabled", bool(tag_cache_enabled))
+                ConfigService.set("cache.detection_cache_enabled", bool(detection_cache_enabled))
+                ConfigService.set("cache.embedding_store_enabled", bool(embedding_store_enabled))
+                ConfigService.set("cache.embedding_store_max_gb", float(embedding_store_max_gb or 20))
                 ConfigService.set("sources.danbooru.default_limit", danbooru_limit)
                 ConfigService.set("sources.sankaku.username", sankaku_username)
                 ConfigService.set("sources.sankaku.password", sankaku_password)
@@ -66,6 +146,8 @@ def render():
                 ConfigService.set("sources.pixiv.username", pixiv_username)
                 ConfigService.set("sources.pixiv.password", pixiv_password)
                 ConfigService.set("sources.pixiv.default_limit", pixiv_limit)
+                ConfigService.set("sources.download.workers_per_host", max(1, int(download_workers or 4)))
+                ConfigService.set("sources.download.default_rate", float(download_rate or 0))
                 # 主题动态应用（Gradio 需重载）
                 return "设置已保存，请重启应用以应用主题和语言"
             except ConfigError as e:
@@ -75,9 +157,18 @@ def render():
             fn=save_settings,
             inputs=[
                 output_dir, temp_dir, log_level, theme, language, tooltips,
-                prefix, size_1_1, size_2_3, size_3_2,
+                prefix, size_1_1, size_2_3, size_3_2, execution_mode, process_workers, queue_size, commit_workers, intermediate_codec, batch_size, action_pool_enabled, action_pool_max_gb, step_cache_enabled, step_cache_max_gb, tag_cache_enabled, detection_cache_enabled, embedding_store_enabled, embedding_store_max_gb,
                 danbooru_limit, sankaku_username, sankaku_password, sankaku_limit,
-                pixiv_username, pixiv_password, pixiv_limit
+                pixiv_username, pixiv_password, pixiv_limit, download_workers, download_rate
             ],
             outputs=settings_output
-        )
\ No newline at end of file
+        )
+
+        # 特征存储达到上限后不再保存新特征，在这里查看占用或清空
+        refresh_store_btn.click(fn=TaskService.get_embedding_store_status, outputs=embedding_store_status)
+
+        def clear_stores():
+            message = TaskService.clear_embedding_stores()
+            return f"{message}\n{TaskService.get_embedding_store_status()}"
+
+        clear_store_btn.click(fn=clear_stores, outputs=embedding_store_status)
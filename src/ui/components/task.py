@@ -5,10 +5,70 @@ import re
 import pandas as pd # 如果完全删除了 step_states 和 results，并且没有其他地方用 pd，可以考虑删除此导入
 from src.services.workflow_service import WorkflowService
 from src.services.task_service import TaskService, TaskError
+from src.data.progress import format_duration
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def format_progress_details(details):
+    """
+    将逐项进度详情格式化为 Markdown：当前步骤的计数、吞吐量、预计剩余时间和各阶段的流入流出数量
+    """
+    if not details:
+        return ""
+    total = details.get("items_total")
+    throughput = details.get("throughput")
+    eta = details.get("eta_seconds")
+    title = f"步骤 {details.get('step', '')}"
+    if details.get("workflow"):
+        title = f"{details['workflow']} {title}"
+    parts = [f"**{title}**",
+             f"已读取 {details.get('items_done', 0)}/{total if total is not None else '?'} 张",
+             f"输出 {details.get('items_out', 0)} 张"]
+    if throughput is not None:
+        parts.append(f"{throughput:.2f} 张/秒")
+    if eta is not None:
+        parts.append(f"预计剩余 {format_duration(eta)}")
+    lines = [" | ".join(parts)]
+    if details.get("stages"):
+        lines += ["", "| 阶段 | 流入 | 流出 |", "| --- | --- | --- |"]
+        lines += [f"| {stage['name']} | {stage['in']} | {stage['out']} |" for stage in details["stages"]]
+    return "\n".join(lines)
+
+def format_size(size):
+    """
+    将字节数格式化为便于阅读的单位
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def format_estimate(result):
+    """
+    将估算结果格式化为 Markdown：总耗时、输出数量、磁盘占用和各步骤的测量结果
+    """
+    total = result.get("total_inputs")
+    lines = [f"**估算结果**（样本 {result['sample_size']} 张 / 共 {total if total is not None else '?'} 张，"
+             f"执行模式 {result.get('execution_mode', '')}）",
+             "",
+             f"预计耗时 {format_duration(result['estimated_seconds'])} | "
+             f"预计输出 {result['estimated_outputs']} 张（约 {format_size(result['output_bytes'])}）| "
+             f"临时磁盘峰值约 {format_size(result['peak_scratch_bytes'])}",
+             "",
+             "| 步骤 | 操作 | 样本输入 | 样本输出 | 每张耗时 | 模型加载 | 预计输入 | 预计耗时 |",
+             "| --- | --- | --- | --- | --- | --- | --- | --- |"]
+    for step in result["steps"]:
+        per_item = step["seconds_per_item"]
+        lines.append(f"| {step['index'] + 1} | {step['action']} | {step['sample_inputs']} | {step['sample_outputs']} | "
+                     f"{f'{per_item * 1000:.1f} ms' if per_item is not None else '-'} | {step['load_seconds']:.1f} 秒 | "
+                     f"{step['estimated_inputs']} | {format_duration(step['estimated_seconds'])} |")
+    if result.get("warnings"):
+        lines += [""] + [f"- {warning}" for warning in result["warnings"]]
+    lines += ["", "估算按单进程逐步执行计算，启用并行或流水线时实际耗时会更短。"]
+    return "\n".join(lines)
+
 def render(source_data):
     task_id = gr.State(None)
     with gr.Column():
@@ -16,7 +76,16 @@ def render(source_data):
             choices=[(w["name"], w["id"]) for w in WorkflowService.get_all_workflows()] or [("无工作流", "")],
             label="选择工作流"
         )
+        extra_workflows = gr.Dropdown(
+            choices=[(w["name"], w["id"]) for w in WorkflowService.get_all_workflows()],
+            label="同时运行的其他工作流（共享相同的前缀步骤只执行一次）",
+            multiselect=True
+        )
         output_dir = gr.Textbox(label="输出目录", placeholder="请输入输出目录")
+        with gr.Row():
+            sample_size = gr.Number(label="估算样本数", value=20, precision=0)
+            estimate_btn = gr.Button("估算耗时和磁盘占用")
+        estimate_output = gr.Markdown()
         with gr.Row():
             start_btn = gr.Button("开始任务")
             stop_btn = gr.Button("停止任务")
@@ -24,16 +93,21 @@ def render(source_data):
         gr.Markdown("### 任务进度")
         progress_bar = gr.Slider(minimum=0, maximum=100, label="进度", interactive=False)
         log_output = gr.Textbox(label="任务日志", interactive=False, lines=10)
+        step_stats = gr.Markdown()
         # results_table = gr.Dataframe(value=[], headers=["步骤", "状态", "详情"], datatype=["str", "str", "str"], interactive=False) # <-- 已删除
 
-        async def start_task(workflow_id, source_data, output_dir):
+        async def start_task(workflow_id, extra_workflow_ids, source_data, output_dir):
             try:
                 if not workflow_id or not source_data or not output_dir:
                     # yield "请先选择工作流、数据源和输出目录", 0.0, pd.DataFrame(columns=["步骤", "状态", "详情"]), gr.update(visible=True), None # <-- 修改前
-                    yield "请先选择工作流、数据源和输出目录", 0.0, gr.update(visible=True), None # <-- 修改后
+                    yield "请先选择工作流、数据源和输出目录", 0.0, gr.update(visible=True), None, "" # <-- 修改后
                     return
                 
-                task_id_value = TaskService.start_task(workflow_id, source_data, output_dir)
+                extra_ids = [w for w in (extra_workflow_ids or []) if w and w != workflow_id]
+                if extra_ids:
+                    task_id_value = TaskService.start_multi_task([workflow_id] + extra_ids, source_data, output_dir)
+                else:
+                    task_id_value = TaskService.start_task(workflow_id, source_data, output_dir)
                 logger.info(f"Task started: {task_id_value}")
                 
                 last_log = "" # 跟踪最新的日志内容
@@ -55,7 +129,7 @@ def render(source_data):
                         match_complete = re.match(r"处理完成\. 总图像: (\d+), 成功: (\d+), 失败: (\d+)", current_log)
                         if match_complete:
                             pass # 原本这里更新 step_states
-                        if current_log == "终止信号已发送，需等待当前工作流步骤完成":
+                        if current_log == "终止信号已发送，将在当前图像处理完成后停止":
                             pass # 原本这里更新 step_states
                         if current_log == "任务已终止":
                             pass # 原本这里更新 step_states
@@ -73,13 +147,14 @@ def render(source_data):
                         current_log,
                         progress_percent,
                         gr.update(visible=not is_finished),
-                        task_id_value
+                        task_id_value,
+                        format_progress_details(TaskService.get_progress_details(task_id_value))
                     )
                     
                     if is_finished:
                         if status == "取消":
                             # yield ("任务已终止", 0.0, results, gr.update(visible=False), None) # <-- 修改前
-                            yield ("任务已终止", 0.0, gr.update(visible=False), None) # <-- 修改后
+                            yield ("任务已终止", 0.0, gr.update(visible=False), None, gr.update()) # <-- 修改后
                         TaskService.clear_progress(task_id_value)
                         logger.info(f"Task finished: {task_id_value}, status: {status}")
                         break
@@ -89,10 +164,10 @@ def render(source_data):
             except TaskError as e:
                 logger.error(f"Start task error: {str(e)}")
                 # yield str(e), 0.0, pd.DataFrame(columns=["步骤", "状态", "详情"]), gr.update(visible=True), None # <-- 修改前
-                yield str(e), 0.0, gr.update(visible=True), None # <-- 修改后
+                yield str(e), 0.0, gr.update(visible=True), None, "" # <-- 修改后
 
         # start_btn.click(fn=start_task, inputs=[workflow_dropdown, source_data, output_dir], outputs=[log_output, progress_bar, results_table, stop_btn, task_id]) # <-- 修改前
-        start_btn.click(fn=start_task, inputs=[workflow_dropdown, source_data, output_dir], outputs=[log_output, progress_bar, stop_btn, task_id]) # <-- 修改后
+        start_btn.click(fn=start_task, inputs=[workflow_dropdown, extra_workflows, source_data, output_dir], outputs=[log_output, progress_bar, stop_btn, task_id, step_stats]) # <-- 修改后
 
         def stop_task(task_id_val): # Renamed task_id to task_id_val to avoid conflict with gr.State
             try:
@@ -107,6 +182,17 @@ def render(source_data):
         # stop_btn.click(fn=stop_task, inputs=task_id, outputs=[log_output, progress_bar, results_table, stop_btn, task_id]) # <-- 修改前
         stop_btn.click(fn=stop_task, inputs=task_id, outputs=[log_output, progress_bar, stop_btn, task_id]) # <-- 修改后
 
+        def estimate_task(workflow_id, source_data_val, sample_size_val):
+            if not workflow_id or not source_data_val:
+                return "请先选择工作流和数据源"
+            try:
+                return format_estimate(TaskService.estimate_task(workflow_id, source_data_val, sample_size_val))
+            except TaskError as e:
+                logger.error(f"Estimate task error: {str(e)}")
+                return str(e)
+
+        estimate_btn.click(fn=estimate_task, inputs=[workflow_dropdown, source_data, sample_size], outputs=estimate_output)
+
         def open_output_directory(output_dir_val): # Renamed output_dir to avoid conflict
             try:
                 TaskService.open_output_directory(output_dir_val)